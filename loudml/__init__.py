@@ -8,6 +8,8 @@ from loudml.warp10 import Warp10Bucket
 from loudml.mongo import MongoBucket
 from loudml.opentsdb import OpenTSDBBucket
 from loudml.prometheus import PrometheusBucket
+from loudml.filestorage import FileStorage
+from loudml.sqlitestorage import SQLiteStorage
 
 
 entry_points = defaultdict(list, {
@@ -26,6 +28,10 @@ entry_points = defaultdict(list, {
         ('opentsdb', OpenTSDBBucket),
         ('prometheus', PrometheusBucket),
     ],
+    'loudml.storages': [
+        ('file', FileStorage),
+        ('sqlite', SQLiteStorage),
+    ],
 })
 
 
@@ -1,7 +1,9 @@
 """
 Base interface for Loud ML bucket classes
 """
+import copy
 import datetime
+import json
 
 from abc import (
     ABCMeta,
@@ -24,6 +26,9 @@ from loudml import (
     errors,
     schemas,
 )
+from loudml.misc import (
+    make_ts,
+)
 
 
 class Bucket(metaclass=ABCMeta):
@@ -294,6 +299,124 @@ class Bucket(metaclass=ABCMeta):
         return []
 
 
+def _feature_query_key(feature):
+    """
+    Features with the same key aggregate the same data
+    """
+    return (
+        feature.bucket,
+        feature.measurement,
+        feature.field,
+        feature.metric,
+        feature.script,
+        json.dumps(feature.match_all, sort_keys=True),
+    )
+
+
+class PrefetchedBucket:
+    """
+    Serve `get_times_data()` requests from data read in advance
+
+    Models that read the same bucket with the same bucket interval share a
+    single query: `prefetch()` reads the union of their features over the
+    union of their time ranges, then each request gets the columns and the
+    rows it asks for. Requests that are not covered, and any other call,
+    are passed to the wrapped bucket.
+    """
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.queries = 0
+        self._bucket_interval = None
+        self._columns = {}
+        self._rows = []
+        self._from_ts = None
+        self._to_ts = None
+
+    def __getattr__(self, name):
+        return getattr(self.bucket, name)
+
+    def prefetch(self, bucket_interval, features, from_date, to_date):
+        """
+        Read `features` in the time range [from_date, to_date[
+        """
+        columns = {}
+        union = []
+        for feature in features:
+            key = _feature_query_key(feature)
+            if key in columns:
+                continue
+            columns[key] = len(union)
+            # Features of different models may have the same name
+            feature = copy.copy(feature)
+            feature.name = 'feature_{}'.format(len(union))
+            union.append(feature)
+
+        from_ts = make_ts(from_date)
+        to_ts = make_ts(to_date)
+        data = self.bucket.get_times_data(
+            bucket_interval=bucket_interval,
+            features=union,
+            from_date=from_ts,
+            to_date=to_ts,
+        )
+        self.queries += 1
+        self._rows = [
+            (make_ts(timeval), offset, X, timeval)
+            for offset, X, timeval in data
+        ]
+        self._bucket_interval = bucket_interval
+        self._columns = columns
+        self._from_ts = from_ts
+        self._to_ts = to_ts
+
+    def _get_columns(self, bucket_interval, features, from_date, to_date):
+        if bucket_interval != self._bucket_interval \
+           or from_date is None or to_date is None \
+           or make_ts(from_date) < self._from_ts \
+           or make_ts(to_date) > self._to_ts:
+            return None
+        try:
+            return [
+                self._columns[_feature_query_key(feature)]
+                for feature in features
+            ]
+        except KeyError:
+            return None
+
+    def get_times_data(
+        self,
+        bucket_interval,
+        features,
+        from_date=None,
+        to_date=None,
+    ):
+        columns = self._get_columns(
+            bucket_interval, features, from_date, to_date)
+        if columns is None:
+            self.queries += 1
+            return self.bucket.get_times_data(
+                bucket_interval=bucket_interval,
+                features=features,
+                from_date=from_date,
+                to_date=to_date,
+            )
+
+        from_ts = make_ts(from_date)
+        to_ts = make_ts(to_date)
+        t0 = None
+        result = []
+        for ts, offset, X, timeval in self._rows:
+            if ts < from_ts:
+                continue
+            if ts >= to_ts:
+                break
+            if t0 is None:
+                t0 = offset
+            result.append((offset - t0, X[columns], timeval))
+        return result
+
+
 def load_bucket(settings):
     """
     Load bucket
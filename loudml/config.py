@@ -56,6 +56,10 @@ class Config:
         self._storage = data.get('storage', {})
         if 'path' not in self._storage:
             self._storage['path'] = "/var/lib/loudml"
+        if 'type' not in self._storage:
+            self._storage['type'] = "file"
+        if 'max_checkpoints' not in self._storage:
+            self._storage['max_checkpoints'] = 0
 
         self._training = data.get('training', {})
         if 'num_cpus' not in self._training:
@@ -68,12 +72,40 @@ class Config:
             self._training['batch_size'] = 64
         if 'epochs' not in self._training:
             self._training['epochs'] = 100
+        if 'parallel_trials' not in self._training:
+            self._training['parallel_trials'] = 1
+        if 'max_queue' not in self._training:
+            self._training['max_queue'] = 16
 
         self._inference = data.get('inference', {})
         if 'num_cpus' not in self._inference:
             self._inference['num_cpus'] = 1
         if 'num_gpus' not in self._inference:
             self._inference['num_gpus'] = 0
+        if 'backend' not in self._inference:
+            self._inference['backend'] = 'keras'
+        if 'maxtasksperchild' not in self._inference:
+            self._inference['maxtasksperchild'] = 0
+        if 'model_cache_size' not in self._inference:
+            self._inference['model_cache_size'] = 16
+        if 'model_cache_max_bytes' not in self._inference:
+            self._inference['model_cache_max_bytes'] = 512 * 1024 * 1024
+        if 'spillover' not in self._inference:
+            self._inference['spillover'] = 2
+        if 'batch_evals' not in self._inference:
+            self._inference['batch_evals'] = True
+        if 'nice' not in self._inference:
+            self._inference['nice'] = 0
+        if 'max_queue' not in self._inference:
+            self._inference['max_queue'] = 1024
+
+        self._io = data.get('io', {})
+        if 'workers' not in self._io:
+            self._io['workers'] = 2
+        if 'nice' not in self._io:
+            self._io['nice'] = 0
+        if 'max_queue' not in self._io:
+            self._io['max_queue'] = 256
 
         self._server = data.get('server', {})
         if 'listen' not in self._server:
@@ -84,6 +116,13 @@ class Config:
             self._server['maxtasksperchild'] = 100
         if 'jobs_max_ttl' not in self._server:
             self._server['jobs_max_ttl'] = 60
+        if 'request_timeout' not in self._server:
+            self._server['request_timeout'] = 60
+
+        if 'workers' not in self._training:
+            self._training['workers'] = self._server['workers']
+        if 'workers' not in self._inference:
+            self._inference['workers'] = self._server['workers']
 
         self._debug = bool(data.get('debug', False))
 
@@ -135,6 +174,11 @@ class Config:
         # XXX: return a copy to prevent modification by the caller
         return copy.deepcopy(self._inference)
 
+    @property
+    def io(self):
+        # XXX: return a copy to prevent modification by the caller
+        return copy.deepcopy(self._io)
+
     @property
     def metrics(self):
         return copy.deepcopy(self._metrics)
@@ -0,0 +1,167 @@
+"""
+Model-affinity job dispatcher
+
+Jobs are dispatched to single-process worker lanes. Jobs that work on a
+model are routed to the same lane, so that the model stays loaded in the
+cache of a single worker. Model names are mapped to lanes with
+consistent hashing; when the preferred lane is busy, the job spills over
+to the next lanes on the ring.
+"""
+
+import bisect
+import logging
+import threading
+import zlib
+
+g_virtual_nodes = 64
+
+
+def _hash(value):
+    return zlib.crc32(value.encode('utf-8')) & 0xffffffff
+
+
+class _Lane:
+    """
+    Single-process worker pool
+    """
+
+    def __init__(self, worker_id, pool):
+        self.worker_id = worker_id
+        self.pool = pool
+        self.depth = 0
+        self.jobs = 0
+        self.affine = 0
+        self.spilled = 0
+        self.cache = {}
+
+    @property
+    def desc(self):
+        hits = self.cache.get('hits', 0)
+        misses = self.cache.get('misses', 0)
+        return {
+            'id': self.worker_id,
+            'queue_depth': self.depth,
+            'jobs': self.jobs,
+            'affine_jobs': self.affine,
+            'spilled_jobs': self.spilled,
+            'cache': dict(
+                self.cache,
+                hit_ratio=hits / (hits + misses) if hits + misses else None,
+            ),
+        }
+
+
+class Dispatcher:
+    """
+    Dispatch jobs to worker lanes
+
+    `create_pool(worker_id)` must return a single-process pool, with the
+    `schedule()`, `stop()` and `join()` methods of `pebble.ProcessPool`.
+    A job is sent to the next lane on the ring when the preferred one
+    already has `spillover` jobs queued or running.
+    """
+
+    def __init__(self, workers, create_pool, spillover=2):
+        if workers < 1:
+            raise ValueError("at least one worker is required")
+
+        self.spillover = max(1, spillover)
+        self._lock = threading.Lock()
+        self._lanes = [
+            _Lane(worker_id, create_pool(worker_id))
+            for worker_id in range(workers)
+        ]
+        ring = sorted(
+            (_hash("{}#{}".format(worker_id, i)), worker_id)
+            for worker_id in range(workers)
+            for i in range(g_virtual_nodes)
+        )
+        self._ring_keys = [key for key, _ in ring]
+        self._ring_lanes = [worker_id for _, worker_id in ring]
+
+    def __len__(self):
+        return len(self._lanes)
+
+    def get_lanes(self, key):
+        """
+        List worker ids by order of preference for the given key
+        """
+        start = bisect.bisect(self._ring_keys, _hash(key))
+        size = len(self._ring_lanes)
+        lanes = []
+        for i in range(size):
+            worker_id = self._ring_lanes[(start + i) % size]
+            if worker_id not in lanes:
+                lanes.append(worker_id)
+                if len(lanes) == len(self._lanes):
+                    break
+        return lanes
+
+    def _select(self, key):
+        if key is None:
+            return min(self._lanes, key=lambda lane: lane.depth)
+
+        lanes = [self._lanes[i] for i in self.get_lanes(key)]
+        lane = next(
+            (lane for lane in lanes if lane.depth < self.spillover),
+            None,
+        )
+        if lane is None:
+            # Every lane is busy: queue the job where it waits the least
+            lane = min(lanes, key=lambda lane: lane.depth)
+
+        if lane is lanes[0]:
+            lane.affine += 1
+        else:
+            lane.spilled += 1
+            logging.debug(
+                "job for '%s' spilled over to worker %d",
+                key,
+                lane.worker_id,
+            )
+        return lane
+
+    def schedule(self, key, func, args=None, kwargs=None):
+        """
+        Submit a function to a worker lane. Jobs with the same key are
+        routed to the same lane unless it is busy. A None key goes to the
+        least loaded lane.
+        """
+        with self._lock:
+            lane = self._select(key)
+            lane.depth += 1
+            lane.jobs += 1
+
+        def done_cb(future):
+            with self._lock:
+                lane.depth -= 1
+
+        try:
+            future = lane.pool.schedule(func, args=args, kwargs=kwargs)
+        except Exception:
+            done_cb(None)
+            raise
+        future.add_done_callback(done_cb)
+        return future
+
+    def set_worker_stats(self, worker_id, cache):
+        """
+        Update the model cache statistics reported by a worker
+        """
+        try:
+            self._lanes[worker_id].cache = cache
+        except (IndexError, TypeError):
+            logging.warning("got stats for unknown worker '%s'", worker_id)
+
+    @property
+    def desc(self):
+        with self._lock:
+            return [lane.desc for lane in self._lanes]
+
+    def stop(self):
+        for lane in self._lanes:
+            lane.pool.stop()
+
+    def join(self):
+        for lane in self._lanes:
+            lane.pool.join()
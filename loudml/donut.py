@@ -27,6 +27,12 @@ from . import (
     errors,
     schemas,
 )
+from .npvae import (
+    MC_SAMPLING,
+    NumpyDonut,
+    mc_noise,
+    weighted_std,
+)
 from voluptuous import (
     All,
     Any,
@@ -42,26 +48,44 @@ from hyperopt import (
     Trials,
 )
 from hyperopt import space_eval
+from hyperopt.base import (
+    Domain,
+    JOB_STATE_DONE,
+    spec_from_misc,
+)
 from hyperopt import hp
 import h5py  # Read training_config.optimizer_config
 from tensorflow.contrib.keras.api.keras import regularizers
 from tensorflow.contrib.keras.api.keras.losses import mean_squared_error
 from tensorflow.contrib.keras.api.keras.models import Model as _Model
 from tensorflow.contrib.keras.api.keras.layers import Lambda, Input, Dense
-from tensorflow.contrib.keras.api.keras.callbacks import EarlyStopping
+from tensorflow.contrib.keras.api.keras.callbacks import (
+    Callback,
+    EarlyStopping,
+)
 from tensorflow.contrib.keras.api.keras.models import load_model
 from tensorflow.python.keras.utils import generic_utils
 from tensorflow.contrib.keras.api.keras import backend as K
 import tensorflow as tf
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    as_completed,
+)
+import base64
+import collections
+import contextlib
 import datetime
+import hashlib
 import json
 import logging
 import os
 import sys
 import random
+import time
 import numpy as np
 import itertools
 import math
+import multiprocessing
 from scipy.stats import norm
 
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
@@ -90,6 +114,15 @@ g_mc_count = 1000
 g_mc_batch_size = 256
 g_lambda = 0.01
 
+# Upper bound for the size of one batch of decoded Monte Carlo samples
+g_mc_max_bytes = 64 * 1024 * 1024
+# Upper bound for the size of windows cached during a training run
+g_window_cache_max_bytes = 256 * 1024 * 1024
+
+INFERENCE_BACKENDS = ['keras', 'numpy']
+
+TRIAL_PRUNING = ['median', 'halving']
+
 
 def set_seed():
     if os.environ.get('RANDOM_SEED'):
@@ -139,6 +172,117 @@ def add_loss(model, W):
     model.add_loss(vae_loss)
 
 
+def _sample_latent(z_mean, z_log_var, count, sampling='random'):
+    """
+    Draw `count` latent samples for each row of Q(z|X)
+
+    Returns the samples and their weights (see `mc_noise()`). Samples of
+    row i are stored in rows [i * n, (i + 1) * n[, n being the number of
+    samples per row.
+    """
+    rows, dim = z_mean.shape
+    epsilon, weights = mc_noise(rows, count, dim, sampling)
+    count = epsilon.shape[1]
+    z_mean = np.repeat(z_mean, count, axis=0)
+    z_log_var = np.repeat(z_log_var, count, axis=0)
+    epsilon = epsilon.reshape((rows * count, dim))
+    return z_mean + np.exp(0.5 * z_log_var) * epsilon, weights
+
+
+def _mc_chunk_size(W, mc_count, max_bytes=None):
+    """
+    Number of windows whose Monte Carlo samples fit in the memory budget
+    """
+    if max_bytes is None:
+        max_bytes = g_mc_max_bytes
+    row_bytes = W * np.dtype(float).itemsize
+    return max(1, int(max_bytes // (row_bytes * mc_count)))
+
+
+def _window_view(x, W):
+    """
+    Read-only view of all the windows of size W of a 1-D array
+    """
+    nb_windows = max(0, len(x) - W + 1)
+    if nb_windows == 0:
+        return np.zeros((0, W), dtype=x.dtype)
+
+    return np.lib.stride_tricks.as_strided(
+        x,
+        shape=(nb_windows, W),
+        strides=(x.strides[0], x.strides[0]),
+        writeable=False,
+    )
+
+
+def _window_nbytes(windows):
+    """
+    Memory used by windows, either a copy or a strided view of a series
+    """
+    if windows.ndim == 2 and windows.strides[0] == windows.strides[1]:
+        nb_windows, W = windows.shape
+        return (nb_windows + W - 1) * windows.itemsize if nb_windows else 0
+    return windows.nbytes
+
+
+def _array_digest(x):
+    if x is None:
+        return None
+    return hashlib.sha1(np.ascontiguousarray(x).tobytes()).hexdigest()
+
+
+class _WindowCache:
+    """
+    LRU cache of train/validation window sets for one training run
+
+    Keys are (span, abnormal windows digest, train size). Least recently
+    used entries are evicted to stay below `max_bytes`.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes or g_window_cache_max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, build):
+        """
+        Return the cached window sets for `key`, or call `build()` to
+        create them
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            logging.debug("window cache hit: span=%s", key[0])
+            return entry[0]
+
+        self.misses += 1
+        logging.debug("window cache miss: span=%s", key[0])
+        value = build()
+        size = sum(
+            _window_nbytes(windows)
+            for windows_set in value
+            for windows in windows_set
+        )
+        if size > self.max_bytes:
+            return value
+
+        while self.nbytes + size > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.nbytes -= evicted_size
+            self.evictions += 1
+
+        self._entries[key] = (value, size)
+        self.nbytes += size
+        return value
+
+
 def _get_encoder(_keras_model):
     # instantiate encoder model
     main_input = _keras_model.inputs[0]
@@ -215,33 +359,214 @@ class HyperParameters:
             setattr(self, key, value)
 
 
+def _build_keras_model(W, intermediate_dim, latent_dim, optimizer='adam'):
+    """
+    Build and compile Donut Keras model
+    """
+    # expected input data shape: (batch_size, timesteps,)
+    # network parameters
+    input_shape = (W, )
+
+    # VAE model = encoder + decoder
+    # build encoder model
+    main_input = Input(shape=input_shape)
+    # bool vector to flag missing data points
+    aux_input = Input(shape=input_shape)
+    aux_output = Lambda(lambda x: x)(aux_input)
+    x = Dense(intermediate_dim,
+              kernel_regularizer=regularizers.l2(0.001),
+              activation='relu')(main_input)
+    x = Dense(intermediate_dim,
+              kernel_regularizer=regularizers.l2(0.001),
+              activation='relu')(x)
+    z_mean = Dense(latent_dim, name='z_mean')(x)
+    z_log_var = Dense(latent_dim, name='z_log_var')(x)
+
+    # use reparameterization trick to push the sampling out as input
+    # note that "output_shape" isn't necessary with the TensorFlow backend
+    z = Lambda(sampling, output_shape=(latent_dim,),
+               name='z')([z_mean, z_log_var])
+
+    # build decoder model
+    x = Dense(intermediate_dim,
+              kernel_regularizer=regularizers.l2(0.001),
+              activation='relu', name='decoder_dense_0')(z)
+    x = Dense(intermediate_dim,
+              kernel_regularizer=regularizers.l2(0.001),
+              activation='relu', name='decoder_dense_1')(x)
+    main_output = Dense(W, activation='linear', name='decoder_dense_2')(x)
+
+    # instantiate Donut model
+    keras_model = _Model([main_input, aux_input], [
+                         main_output, aux_output], name='donut')
+    add_loss(keras_model, W)
+    optimizer_cls = None
+    if optimizer == 'adam':
+        optimizer_cls = tf.keras.optimizers.Adam(clipnorm=10.)
+
+    keras_model.compile(
+        optimizer=optimizer_cls,
+    )
+    return keras_model
+
+
+class _TrialPruner(Callback):
+    """
+    Stop hyperparameter search trials that are clearly worse than
+    previous ones
+
+    `history` holds the validation loss curves of previous trials.
+
+    - median: stop when the best validation loss of the trial is worse
+      than the median of the best losses of previous trials at the same
+      epoch.
+    - halving: at epochs min_epochs * eta^k only, stop unless the trial is
+      in the top 1/eta of previous trials.
+    """
+
+    def __init__(self, strategy, history, min_epochs=5, min_trials=2, eta=3):
+        super().__init__()
+        self.strategy = strategy
+        self.history = [curve for curve in history if len(curve) > 0]
+        self.min_epochs = min_epochs
+        self.min_trials = min_trials
+        self.eta = eta
+        self.val_losses = []
+        self.pruned = False
+
+    def _should_prune(self, epoch):
+        best = np.min(self.val_losses)
+        ref = np.array([
+            np.min(curve[:epoch + 1]) for curve in self.history
+        ])
+
+        if self.strategy == 'median':
+            return best > np.median(ref)
+
+        rung = self.min_epochs
+        while rung < epoch + 1:
+            rung *= self.eta
+        if rung != epoch + 1:
+            return False
+
+        nb_kept = max(1, len(ref) // self.eta)
+        return best > np.sort(ref)[nb_kept - 1]
+
+    def on_epoch_end(self, epoch, logs=None):
+        val_loss = (logs or {}).get('val_loss')
+        if val_loss is None:
+            return
+
+        self.val_losses.append(float(val_loss))
+        if epoch + 1 < self.min_epochs or len(self.history) < self.min_trials:
+            return
+
+        if self._should_prune(epoch):
+            logging.info("trial pruned after %d epochs (val_loss = %f)",
+                         epoch + 1, val_loss)
+            self.pruned = True
+            self.model.stop_training = True
+
+
+class _TrialHistory:
+    """
+    Validation loss curves and pruning status of hyperparameter search
+    trials
+    """
+
+    def __init__(self):
+        self.curves = []
+        self.pruned = []
+
+    def add(self, val_losses, pruned):
+        self.curves.append(list(val_losses))
+        self.pruned.append(pruned)
+
+    def stats(self, num_epochs):
+        """
+        Number of epochs run, and estimated number of epochs saved by
+        pruning. A pruned trial is assumed to have saved the mean number
+        of epochs of complete trials, minus the epochs it ran.
+        """
+        epochs = [len(curve) for curve in self.curves]
+        complete = [
+            nb for nb, pruned in zip(epochs, self.pruned) if not pruned
+        ]
+        expected = np.mean(complete) if len(complete) else num_epochs
+        saved = sum(
+            max(0, expected - nb)
+            for nb, pruned in zip(epochs, self.pruned) if pruned
+        )
+        return {
+            'trials': len(self.curves),
+            'pruned': sum(self.pruned),
+            'epochs': sum(epochs),
+            'epochs_saved': int(round(saved)),
+        }
+
+
+def _run_trial(
+    settings,
+    params,
+    dataset,
+    train_size,
+    batch_size,
+    num_epochs,
+    abnormal,
+    num_cpus,
+    num_threads,
+    history=None,
+):
+    """
+    Evaluate one trial of the hyperparameter search in a worker process.
+    The dataset is already scaled.
+
+    Returns the score, the validation loss curve and whether the trial
+    was pruned.
+    """
+    model = DonutModel(settings)
+    pruner = model._get_trial_pruner(history or [])
+    score, _ = model._cross_val_model(
+        HyperParameters(params),
+        dataset,
+        train_size,
+        batch_size,
+        num_epochs,
+        num_cpus=num_cpus,
+        num_gpus=0,
+        abnormal=abnormal,
+        num_threads=num_threads,
+        pruner=pruner,
+    )
+    K.clear_session()
+    if pruner is None:
+        return score, [], False
+    return score, pruner.val_losses, pruner.pruned
+
+
 def _serialize_keras_model(keras_model):
     """
-    Serialize Keras model
+    Serialize Keras model to HDF5 bytes
     """
 
-    import base64
     import tempfile
 
     fd, path = tempfile.mkstemp()
     try:
         keras_model.save(path)
         with os.fdopen(fd, 'rb') as tmp:
-            model_b64 = base64.b64encode(tmp.read())
+            return tmp.read()
     finally:
         os.remove(path)
 
-    return model_b64.decode('utf-8')
-
 
-def _load_keras_model(model_b64):
+def _load_keras_model(model_data):
     import tempfile
-    import base64
 
     fd, path = tempfile.mkstemp()
     try:
         with os.fdopen(fd, 'wb') as tmp:
-            tmp.write(base64.b64decode(model_b64.encode('utf-8')))
+            tmp.write(model_data)
             tmp.close()
     finally:
         keras_model = load_model(path, compile=False)
@@ -289,6 +614,8 @@ class TimeSeriesPrediction:
         self.scores = None
         self.mses = None
         self.mse = None
+        self.step_durations = None
+        self.mcmc_iterations = None
 
     def get_schema(
         self,
@@ -355,6 +682,8 @@ class TimeSeriesPrediction:
             result['stats'] = self.stats
         if self.constraint is not None:
             result['constraint'] = self.constraint
+        if self.step_durations is not None:
+            result['step_durations'] = list_from_np(self.step_durations)
         return result
 
     def get_field_names(self):
@@ -446,23 +775,107 @@ class TimeSeriesPrediction:
         plt.show()
 
 
-def generator(x, missing, batch_size, model):
-    batch_x = np.zeros((batch_size, x.shape[1]))
-    batch_missing = np.zeros((batch_size, x.shape[1]))
+def mcmc_impute(x, missing, reconstruct, tolerance=None, max_iter=None):
+    """
+    Replace missing values of `x` by their reconstruction, in place
+
+    Windows are refined `max_iter` times. If `tolerance` is set, a window
+    stops being refined as soon as the maximum change of its imputed values
+    is below `tolerance`.
+
+    Returns the number of iterations done for each window.
+    """
+    if max_iter is None:
+        max_iter = g_mcmc_count
+
+    iterations = np.zeros((len(x),), dtype=int)
+
+    if tolerance is None:
+        for _ in range(max_iter):
+            x_decoded = reconstruct(x, missing)
+            x[missing] = x_decoded[missing]
+        iterations[:] = max_iter
+        return iterations
+
+    # Windows without missing values do not need any refinement
+    active = np.flatnonzero(missing.any(axis=1))
+    for _ in range(max_iter):
+        if len(active) == 0:
+            break
+
+        x_active = x[active]
+        missing_active = missing[active]
+        x_decoded = reconstruct(x_active, missing_active)
+        delta = np.max(
+            np.where(missing_active, np.abs(x_decoded - x_active), 0),
+            axis=1,
+        )
+        x_active[missing_active] = x_decoded[missing_active]
+        x[active] = x_active
+        iterations[active] += 1
+        active = active[delta >= tolerance]
+
+    return iterations
+
+
+def _build_mcmc_function(model, W, count):
+    """
+    Build a function that imputes missing points of a batch with `count`
+    MCMC iterations. Iterations are unrolled in the TF graph, so that a
+    batch is imputed with a single session call.
+    """
+    x_input = K.placeholder(shape=(None, W))
+    missing_input = K.placeholder(shape=(None, W))
+    is_missing = K.greater(missing_input, 0)
+
+    x = x_input
+    for _ in range(count):
+        x_decoded = model([x, missing_input])[0]
+        x = tf.where(is_missing, x_decoded, x)
+
+    return K.function([x_input, missing_input], [x])
+
+
+def generator(
+    x,
+    missing,
+    batch_size,
+    model,
+    tolerance=None,
+    max_iter=None,
+    in_graph=True,
+):
+    """
+    Yield random training batches
+
+    Missing points and randomly flagged abnormal points are imputed with
+    MCMC. Fixed count iterations run in the TF graph unless `in_graph` is
+    unset. Adaptive iterations (see `mcmc_impute()`) run from Python.
+    """
+    if max_iter is None:
+        max_iter = g_mcmc_count
+
+    impute = None
+    if in_graph and tolerance is None:
+        impute = _build_mcmc_function(model, x.shape[1], max_iter)
+
     while True:
         abnormal = np.random.binomial(1, g_lambda, x.shape[1])
-        for i in range(batch_size):
-            index = random.randint(0, len(x)-1)
-            batch_x[i] = x[index]
-            batch_missing[i] = np.maximum(
-                abnormal,
-                missing[index],
-            )
+        index = np.random.randint(0, len(x), size=batch_size)
+        batch_x = x[index]
+        batch_missing = np.maximum(abnormal, missing[index]).astype(x.dtype)
 
-        for _ in range(g_mcmc_count):
-            x_decoded, _ = model.predict(
-                [batch_x, batch_missing], batch_size=g_mc_batch_size)
-            batch_x[batch_missing > 0] = x_decoded[batch_missing > 0]
+        if impute is not None:
+            batch_x = impute([batch_x, batch_missing])[0]
+        else:
+            mcmc_impute(
+                batch_x,
+                batch_missing > 0,
+                lambda x, m: model.predict(
+                    [x, m], batch_size=g_mc_batch_size)[0],
+                tolerance=tolerance,
+                max_iter=max_iter,
+            )
 
         yield ([batch_x, batch_missing], None)
 
@@ -494,6 +907,7 @@ class DonutModel(Model):
     Time-series VAE model, "Donut"
     """
     TYPE = 'donut'
+    RUN_STATE_KEYS = ['run', 'anomaly', 'last_anomaly_ts']
 
     SCHEMA = Model.SCHEMA.extend({
         Required('bucket_interval'): schemas.TimeDelta(
@@ -507,6 +921,19 @@ class DonutModel(Model):
         Optional('seasonality', default=DEFAULT_SEASONALITY): schemas.seasonality,
         Optional('forecast'): Any(None, "auto", All(int, Range(min=1))),
         Optional('grace_period', default=0): schemas.TimeDelta(min=0, min_included=True),
+        Optional('forecast_trajectories', default=100): All(int, Range(min=2)),
+        Optional('mcmc_tolerance', default=None): Any(
+            None, All(Any(int, float), Range(min=0, min_included=False)),
+        ),
+        Optional('mcmc_max_iter', default=None): Any(
+            None, All(int, Range(min=1)),
+        ),
+        Optional('mc_count', default=None): Any(
+            None, All(int, Range(min=2)),
+        ),
+        Optional('mc_sampling', default='random'): Any(*MC_SAMPLING),
+        Optional('dtype', default='float64'): Any('float32', 'float64'),
+        Optional('trial_pruning', default=None): Any(None, *TRIAL_PRUNING),
     })
 
     def __init__(self, settings, state=None):
@@ -528,6 +955,9 @@ class DonutModel(Model):
         self._keras_model = None
         self._encoder_model = None
         self._decoder_model = None
+        self._np_model = None
+        self._graph = None
+        self._session = None
 
         if self.span is None or self.span == "auto":
             self.min_span = settings.get('min_span') or _hp_span_min
@@ -538,6 +968,14 @@ class DonutModel(Model):
 
         self.grace_period = parse_timedelta(
             settings['grace_period']).total_seconds()
+        self.forecast_trajectories = settings['forecast_trajectories']
+        self.mcmc_tolerance = settings['mcmc_tolerance']
+        self.mcmc_max_iter = settings['mcmc_max_iter']
+        self.mc_count = settings['mc_count']
+        self.mc_sampling = settings['mc_sampling']
+        self.dtype = np.dtype(settings['dtype'])
+        self.trial_pruning = settings['trial_pruning']
+        self._pruning_stats = None
 
         self.current_eval = None
         if len(self.features) > 1:
@@ -657,7 +1095,7 @@ class DonutModel(Model):
         self.min_threshold = 68
         self.max_threshold = 99.7
 
-    def _set_xpu_config(self, num_cpus, num_gpus):
+    def _set_xpu_config(self, num_cpus, num_gpus, num_threads=None):
         if os.environ.get('PYTHONHASHSEED'):
             config = tf.ConfigProto(
                 intra_op_parallelism_threads=1,
@@ -668,6 +1106,9 @@ class DonutModel(Model):
                 allow_soft_placement=True,
                 device_count={'CPU': num_cpus, 'GPU': num_gpus},
             )
+            if num_threads is not None:
+                config.intra_op_parallelism_threads = num_threads
+                config.inter_op_parallelism_threads = num_threads
         if num_gpus > 0:
             config.gpu_options.allow_growth = True
             config.log_device_placement = True
@@ -675,6 +1116,200 @@ class DonutModel(Model):
         sess = tf.Session(graph=tf.get_default_graph(), config=config)
         set_seed()
         K.set_session(sess)
+        return sess
+
+    def _cross_val_model(
+        self,
+        params,
+        dataset,
+        train_size,
+        batch_size,
+        num_epochs,
+        num_cpus,
+        num_gpus,
+        abnormal=None,
+        num_threads=None,
+        pruner=None,
+        window_cache=None,
+    ):
+        """
+        Train and evaluate model with the given hyperparameters
+        """
+        keras_model = None
+        # Destroys the current TF graph and creates a new one.
+        # Useful to avoid clutter from old models / layers.
+        K.clear_session()
+        self._set_xpu_config(num_cpus, num_gpus, num_threads)
+
+        self.span = W = params.span
+
+        def split():
+            return self.train_test_split(
+                dataset,
+                train_size=train_size,
+                abnormal=abnormal,
+            )
+
+        if window_cache is None:
+            (X_miss, X_train), (X_miss_val, X_test) = split()
+        else:
+            key = (W, _array_digest(abnormal), train_size)
+            (X_miss, X_train), (X_miss_val, X_test) = \
+                window_cache.get(key, split)
+
+        if len(X_train) == 0:
+            raise errors.NoData("insufficient training data")
+        if len(X_test) == 0:
+            raise errors.NoData("insufficient validation data")
+
+        keras_model = _build_keras_model(
+            W,
+            params.intermediate_dim,
+            params.latent_dim,
+            params.optimizer,
+        )
+
+        _stop = EarlyStopping(
+            monitor='val_loss',
+            patience=5,
+            verbose=_verbose,
+            mode='auto',
+        )
+        keras_model.fit_generator(
+            generator(
+                X_train,
+                X_miss,
+                batch_size,
+                keras_model,
+                tolerance=self.mcmc_tolerance,
+                max_iter=self.mcmc_max_iter,
+            ),
+            epochs=num_epochs,
+            steps_per_epoch=int(math.ceil(len(X_train) / batch_size)),
+            verbose=_verbose,
+            validation_data=convert_to_generator_like(
+                (X_test, X_miss_val),
+                batch_size=batch_size,
+                epochs=num_epochs,
+                shuffle=False,
+            ),
+            validation_steps=int(math.ceil(len(X_test) / batch_size)),
+            callbacks=[_stop] if pruner is None else [_stop, pruner],
+            workers=0,  # https://github.com/keras-team/keras/issues/5511
+        )
+
+        # How well did it do?
+        score = keras_model.evaluate(
+            [X_test, X_miss_val],
+            batch_size=batch_size,
+            verbose=_verbose,
+        )
+
+        return score, keras_model
+
+    def _get_trial_pruner(self, history):
+        if self.trial_pruning is None:
+            return None
+        return _TrialPruner(self.trial_pruning, history)
+
+    def _parallel_search(
+        self,
+        space,
+        trials,
+        dataset,
+        train_size,
+        batch_size,
+        num_epochs,
+        max_evals,
+        parallel_trials,
+        num_cpus=1,
+        rstate=None,
+        progress_cb=None,
+        abnormal=None,
+        history=None,
+    ):
+        """
+        Run the hyperparameter search with `parallel_trials` trials
+        evaluated at once in worker processes
+
+        TPE suggests one batch of trials at a time, from the results of
+        all previous batches. Trials of a batch are pruned against trials
+        of the previous batches.
+        """
+        if history is None:
+            history = _TrialHistory()
+
+        if rstate is None:
+            rstate = np.random.RandomState()
+
+        domain = Domain(lambda args: None, space)
+        num_threads = max(1, multiprocessing.cpu_count() // parallel_trials)
+
+        logging.info(
+            "hyperparameter search: %d trials, %d in parallel, "
+            "%d thread(s) per trial",
+            max_evals, parallel_trials, num_threads,
+        )
+
+        with ProcessPoolExecutor(
+            max_workers=parallel_trials,
+            mp_context=multiprocessing.get_context('spawn'),
+        ) as pool:
+            while len(trials) < max_evals:
+                nb_trials = min(parallel_trials, max_evals - len(trials))
+                new_ids = trials.new_trial_ids(nb_trials)
+                trials.refresh()
+                docs = tpe.suggest(
+                    new_ids, domain, trials, rstate.randint(2 ** 31 - 1))
+                if len(docs) == 0:
+                    break
+
+                futures = {}
+                for doc in docs:
+                    params = space_eval(space, spec_from_misc(doc['misc']))
+                    future = pool.submit(
+                        _run_trial,
+                        self.settings,
+                        params,
+                        dataset,
+                        train_size,
+                        batch_size,
+                        num_epochs,
+                        abnormal,
+                        num_cpus,
+                        num_threads,
+                        history.curves,
+                    )
+                    futures[future] = doc
+
+                for future in as_completed(futures):
+                    doc = futures[future]
+                    try:
+                        score, val_losses, pruned = future.result()
+                        history.add(val_losses, pruned)
+                        doc['result'] = {
+                            'loss': nan_to_none(score),
+                            'status': STATUS_OK,
+                        }
+                    except Exception as exn:
+                        logging.warning("iteration failed: %s", exn)
+                        doc['result'] = {'loss': None, 'status': STATUS_FAIL}
+                    doc['state'] = JOB_STATE_DONE
+                    doc['refresh_time'] = datetime.datetime.utcnow()
+
+                    self.current_eval += 1
+                    if progress_cb is not None:
+                        progress_cb(self.current_eval, max_evals)
+
+                trials.insert_trial_docs(docs)
+                trials.refresh()
+
+        if not any(
+            result['status'] == STATUS_OK for result in trials.results
+        ):
+            raise ValueError("all trials failed")
+
+        return trials.argmin
 
     def _train_on_dataset(
         self,
@@ -687,6 +1322,7 @@ class DonutModel(Model):
         max_evals=None,
         progress_cb=None,
         abnormal=None,
+        parallel_trials=1,
     ):
         if max_evals is None:
             # latent_dim*intermediate_dim
@@ -697,98 +1333,21 @@ class DonutModel(Model):
         self.stat_dataset(dataset)
         dataset = self.scale_dataset(dataset)
 
-        def cross_val_model(params):
-            keras_model = None
-            # Destroys the current TF graph and creates a new one.
-            # Useful to avoid clutter from old models / layers.
-            K.clear_session()
-            self._set_xpu_config(num_cpus, num_gpus)
+        history = _TrialHistory()
+        window_cache = _WindowCache()
 
-            self.span = W = params.span
-            (X_miss, X_train), (X_miss_val, X_test) = self.train_test_split(
+        def cross_val_model(params, pruner=None):
+            score, keras_model = self._cross_val_model(
+                params,
                 dataset,
-                train_size=train_size,
+                train_size,
+                batch_size,
+                num_epochs,
+                num_cpus,
+                num_gpus,
                 abnormal=abnormal,
-            )
-            if len(X_train) == 0:
-                raise errors.NoData("insufficient training data")
-            if len(X_test) == 0:
-                raise errors.NoData("insufficient validation data")
-
-            # expected input data shape: (batch_size, timesteps,)
-            # network parameters
-            input_shape = (W, )
-            intermediate_dim = params.intermediate_dim
-            latent_dim = params.latent_dim
-
-            # VAE model = encoder + decoder
-            # build encoder model
-            main_input = Input(shape=input_shape)
-            # bool vector to flag missing data points
-            aux_input = Input(shape=input_shape)
-            aux_output = Lambda(lambda x: x)(aux_input)
-            x = Dense(intermediate_dim,
-                      kernel_regularizer=regularizers.l2(0.001),
-                      activation='relu')(main_input)
-            x = Dense(intermediate_dim,
-                      kernel_regularizer=regularizers.l2(0.001),
-                      activation='relu')(x)
-            z_mean = Dense(latent_dim, name='z_mean')(x)
-            z_log_var = Dense(latent_dim, name='z_log_var')(x)
-
-            # use reparameterization trick to push the sampling out as input
-            # note that "output_shape" isn't necessary with the TensorFlow backend
-            z = Lambda(sampling, output_shape=(latent_dim,),
-                       name='z')([z_mean, z_log_var])
-
-            # build decoder model
-            x = Dense(intermediate_dim,
-                      kernel_regularizer=regularizers.l2(0.001),
-                      activation='relu', name='decoder_dense_0')(z)
-            x = Dense(intermediate_dim,
-                      kernel_regularizer=regularizers.l2(0.001),
-                      activation='relu', name='decoder_dense_1')(x)
-            main_output = Dense(W, activation='linear', name='decoder_dense_2')(x)
-
-            # instantiate Donut model
-            keras_model = _Model([main_input, aux_input], [
-                                 main_output, aux_output], name='donut')
-            add_loss(keras_model, W)
-            optimizer_cls = None
-            if params.optimizer == 'adam':
-                optimizer_cls = tf.keras.optimizers.Adam(clipnorm=10.)
-
-            keras_model.compile(
-                optimizer=optimizer_cls,
-            )
-
-            _stop = EarlyStopping(
-                monitor='val_loss',
-                patience=5,
-                verbose=_verbose,
-                mode='auto',
-            )
-            keras_model.fit_generator(
-                generator(X_train, X_miss, batch_size, keras_model),
-                epochs=num_epochs,
-                steps_per_epoch=int(math.ceil(len(X_train) / batch_size)),
-                verbose=_verbose,
-                validation_data=convert_to_generator_like(
-                    (X_test, X_miss_val),
-                    batch_size=batch_size,
-                    epochs=num_epochs,
-                    shuffle=False,
-                ),
-                validation_steps=int(math.ceil(len(X_test) / batch_size)),
-                callbacks=[_stop],
-                workers=0,  # https://github.com/keras-team/keras/issues/5511
-            )
-
-            # How well did it do?
-            score = keras_model.evaluate(
-                [X_test, X_miss_val],
-                batch_size=batch_size,
-                verbose=_verbose,
+                pruner=pruner,
+                window_cache=window_cache,
             )
 
             self.current_eval += 1
@@ -804,7 +1363,10 @@ class DonutModel(Model):
             hyperparameters.assign(args)
 
             try:
-                score, _ = cross_val_model(hyperparameters)
+                pruner = self._get_trial_pruner(history.curves)
+                score, _ = cross_val_model(hyperparameters, pruner)
+                if pruner is not None:
+                    history.add(pruner.val_losses, pruner.pruned)
                 return {'loss': nan_to_none(score), 'status': STATUS_OK}
             except Exception as exn:
                 logging.warning("iteration failed: %s", exn)
@@ -828,25 +1390,67 @@ class DonutModel(Model):
         # The Trials object will store details of each iteration
         trials = Trials()
 
+        fmin_state = None
+        if os.environ.get('RANDOM_SEED'):
+            fmin_state = np.random.RandomState(
+                int(os.environ.get('RANDOM_SEED')))
+
+        if parallel_trials > 1 and multiprocessing.current_process().daemon:
+            # Daemonic processes, e.g. the workers of the job pool, are not
+            # allowed to start child processes
+            logging.info(
+                "hyperparameter search: daemonic process, "
+                "trials are evaluated sequentially",
+            )
+            parallel_trials = 1
+
         # Run the hyperparameter search using the tpe algorithm
         try:
-            fmin_state = None
-            if os.environ.get('RANDOM_SEED'):
-                fmin_state = np.random.RandomState(
-                    int(os.environ.get('RANDOM_SEED')))
-            best = fmin(
-                objective,
-                space,
-                algo=tpe.suggest,
-                max_evals=max_evals,
-                trials=trials,
-                rstate=fmin_state,
-            )
+            if parallel_trials > 1 and max_evals > 1:
+                best = self._parallel_search(
+                    space,
+                    trials,
+                    dataset,
+                    train_size,
+                    batch_size,
+                    num_epochs,
+                    max_evals,
+                    parallel_trials,
+                    num_cpus,
+                    fmin_state,
+                    progress_cb=progress_cb,
+                    abnormal=abnormal,
+                    history=history,
+                )
+            else:
+                best = fmin(
+                    objective,
+                    space,
+                    algo=tpe.suggest,
+                    max_evals=max_evals,
+                    trials=trials,
+                    rstate=fmin_state,
+                )
         except ValueError:
             raise errors.NoData(
                 "training failed, try to increase the time range")
 
+        logging.info(
+            "window cache: %d hits, %d misses, %d evictions",
+            window_cache.hits, window_cache.misses, window_cache.evictions,
+        )
+
+        if self.trial_pruning is not None:
+            self._pruning_stats = history.stats(num_epochs)
+            logging.info(
+                "trial pruning: %d/%d trials pruned, %d epochs saved",
+                self._pruning_stats['pruned'],
+                self._pruning_stats['trials'],
+                self._pruning_stats['epochs_saved'],
+            )
+
         # Get the values of the optimal parameters
+        # Final training with best parameters is never pruned
         best_params = space_eval(space, best)
         score, self._keras_model = cross_val_model(
             HyperParameters(best_params)
@@ -879,21 +1483,22 @@ class DonutModel(Model):
             verbose=_verbose,
             mode='auto',
         )
-        self._keras_model.fit(
-            [X_train, X_miss],
-            epochs=num_epochs,
-            batch_size=batch_size,
-            verbose=_verbose,
-            validation_data=([X_test, X_miss_val], None),
-            callbacks=[_stop],
-        )
+        with self._keras_scope():
+            self._keras_model.fit(
+                [X_train, X_miss],
+                epochs=num_epochs,
+                batch_size=batch_size,
+                verbose=_verbose,
+                validation_data=([X_test, X_miss_val], None),
+                callbacks=[_stop],
+            )
 
-        # How well did it do?
-        score = self._keras_model.evaluate(
-            [X_test, X_miss_val],
-            batch_size=batch_size,
-            verbose=_verbose,
-        )
+            # How well did it do?
+            score = self._keras_model.evaluate(
+                [X_test, X_miss_val],
+                batch_size=batch_size,
+                verbose=_verbose,
+            )
         return score
 
     def compute_bucket_scores(self, y_true, y_pred, y_low, y_high):
@@ -942,7 +1547,13 @@ class DonutModel(Model):
 
         return scores, mses
 
-    def _format_dataset(self, x, accept_missing=True, abnormal=None):
+    def _format_dataset(
+        self,
+        x,
+        accept_missing=True,
+        abnormal=None,
+        lazy=False,
+    ):
         """
         Format dataset for time-series training & inference
 
@@ -962,38 +1573,48 @@ class DonutModel(Model):
         ]
 
         Buckets with missing values are flagged in the missing array.
+
+        Windows are strided views of the input series. If `lazy` is set,
+        these read-only views are returned and windows are only copied
+        when batches are extracted from them.
         """
-        missing = []
-        data_x = []
-        for i in range(len(x) - self.W + 1):
-            j = i + self.W
-            if accept_missing or not np.isnan(x[i:j]).any():
-                # arxiv.org/abs/1802.03903
-                # set user defined abnormal data points to zero
-                if abnormal is None:
-                    is_nan = np.isnan(x[i:j])
-                else:
-                    is_nan = np.logical_or(
-                        np.isnan(x[i:j]),
-                        abnormal[i:j],
-                    )
+        x = np.asarray(x, dtype=self.dtype)
+        is_nan = np.isnan(x)
+
+        # arxiv.org/abs/1802.03903
+        # set user defined abnormal data points to zero
+        if abnormal is None:
+            mask = is_nan
+        else:
+            mask = np.logical_or(is_nan, abnormal[:len(x)])
+
+        # set missing points to zero
+        values = np.where(mask, 0, x).astype(self.dtype, copy=False)
+
+        missing = _window_view(mask, self.W)
+        data_x = _window_view(values, self.W)
 
-                missing.append(is_nan)
-                _x = np.copy(x[i:j])
-                # set missing points to zero
-                _x[is_nan] = 0.0
-                data_x.append(_x)
+        if not accept_missing:
+            nb_nan = np.concatenate(([0], np.cumsum(is_nan)))
+            complete = (nb_nan[self.W:] - nb_nan[:-self.W]) == 0
+            return missing[complete], data_x[complete]
 
-        return np.array(missing), np.array(data_x)
+        if lazy:
+            return missing, data_x
+
+        return missing.copy(), data_x.copy()
 
     def train_test_split(self, dataset, abnormal=None, train_size=0.67):
         """
         Splits data to training and testing parts
+
+        Windows are read-only views of the dataset, see `_format_dataset()`
         """
         ntrn = round(len(dataset) * train_size)
         X_train_missing, X_train = self._format_dataset(
-            dataset[0:ntrn], abnormal=abnormal)
-        X_test_missing, X_test = self._format_dataset(dataset[ntrn:])
+            dataset[0:ntrn], abnormal=abnormal, lazy=True)
+        X_test_missing, X_test = self._format_dataset(
+            dataset[ntrn:], lazy=True)
         return (X_train_missing, X_train), (X_test_missing, X_test)
 
     def train(
@@ -1010,12 +1631,17 @@ class DonutModel(Model):
         progress_cb=None,
         incremental=False,
         windows=[],
+        parallel_trials=1,
     ):
         """
         Train model
+
+        `parallel_trials` hyperparameter search trials are evaluated at
+        once in worker processes.
         """
         self.means, self.stds = None, None
         self.scores = None
+        self._pruning_stats = None
 
         period = DateRange.build_date_range(
             from_date, to_date, self.bucket_interval)
@@ -1079,6 +1705,7 @@ class DonutModel(Model):
                 abnormal=abnormal,
             )
         else:
+            self.unload()
             best_params, score = self._train_on_dataset(
                 dataset,
                 train_size,
@@ -1089,6 +1716,7 @@ class DonutModel(Model):
                 max_evals,
                 progress_cb=progress_cb,
                 abnormal=abnormal,
+                parallel_trials=parallel_trials,
             )
         self.current_eval = None
 
@@ -1098,15 +1726,18 @@ class DonutModel(Model):
                not isinstance(val, float):
                 best_params[key] = np.asscalar(val)
 
-        model_b64 = _serialize_keras_model(self._keras_model)
+        with self._keras_scope():
+            weights = _serialize_keras_model(self._keras_model)
 
         self._state = {
-            'h5py': model_b64,
+            'weights': weights,
             'best_params': best_params,
             'means': self.means.tolist(),
             'stds': self.stds.tolist(),
             'loss': nan_to_none(score),
         }
+        if self._pruning_stats is not None:
+            self._state['trial_pruning'] = self._pruning_stats
         self.unload()
         # prediction = self.predict(
         #    bucket,
@@ -1117,9 +1748,12 @@ class DonutModel(Model):
         # )
         # prediction.stat()
 
-        return {
+        res = {
             'loss': nan_to_none(score),
         }
+        if self._pruning_stats is not None:
+            res['trial_pruning'] = self._pruning_stats
+        return res
 
     def unload(self):
         """
@@ -1128,29 +1762,60 @@ class DonutModel(Model):
         self._keras_model = None
         self._encoder_model = None
         self._decoder_model = None
+        self._np_model = None
+        if self._session is not None:
+            self._session.close()
+        self._graph = None
+        self._session = None
         K.clear_session()
 
-    def load(self, num_cpus, num_gpus):
+    @contextlib.contextmanager
+    def _keras_scope(self):
+        """
+        Make the graph and session of the loaded Keras model the default
+        ones
+        """
+        if self._graph is None:
+            yield
+            return
+
+        with self._graph.as_default(), self._session.as_default():
+            yield
+
+    def load(self, num_cpus=1, num_gpus=0, backend='keras'):
         """
         Load current model
         """
         if not self.is_trained:
             raise errors.ModelNotTrained()
-        if self._keras_model:
+        if backend not in INFERENCE_BACKENDS:
+            raise errors.Invalid(
+                "unknown inference backend '{}'".format(backend))
+        if backend == 'numpy' and self._np_model:
+            # Already loaded
+            return
+        if backend == 'keras' and self._keras_model:
             # Already loaded
             return
+        weights = self.weights
+        if weights is None:
+            raise errors.ModelNotTrained()
 
-        K.clear_session()
-        self._set_xpu_config(num_cpus, num_gpus)
-
-        if self._state.get('h5py', None) is not None:
-            self._keras_model = _load_keras_model(self._state.get('h5py'))
-            # instantiate encoder model
-            self._encoder_model = _get_encoder(self._keras_model)
-            # instantiate decoder model
-            self._decoder_model = _get_decoder(self._keras_model)
+        self.unload()
+        if backend == 'numpy':
+            self._np_model = NumpyDonut.from_bytes(weights)
         else:
-            raise errors.ModelNotTrained()
+            # Each model has its own graph and session, so that several
+            # models can stay loaded in the same process
+            self._graph = tf.Graph()
+            with self._graph.as_default():
+                self._session = self._set_xpu_config(num_cpus, num_gpus)
+            with self._keras_scope():
+                self._keras_model = _load_keras_model(weights)
+                # instantiate encoder model
+                self._encoder_model = _get_encoder(self._keras_model)
+                # instantiate decoder model
+                self._decoder_model = _get_decoder(self._keras_model)
 
         if 'means' in self._state:
             self.means = np.array(self._state['means'])
@@ -1173,6 +1838,21 @@ class DonutModel(Model):
         """
         return self._state is not None and ('weights' in self._state or 'h5py' in self._state)
 
+    @property
+    def weights(self):
+        """
+        Keras model of the current checkpoint, as HDF5 bytes. The storage
+        may provide a memory-mapped file instead of bytes. Old
+        checkpoints hold base64 encoded data in the `h5py` key.
+        """
+        if self._state is None:
+            return None
+        if self._state.get('weights') is not None:
+            return self._state['weights']
+        if self._state.get('h5py') is not None:
+            return base64.b64decode(self._state['h5py'].encode('utf-8'))
+        return None
+
     @property
     def _span(self):
         if self._state and 'span' in self._state['best_params']:
@@ -1184,127 +1864,165 @@ class DonutModel(Model):
     def _window(self):
         return self._span
 
-    def predict(
-        self,
-        bucket,
-        from_date,
-        to_date,
-        num_cpus=1,
-        num_gpus=0,
-    ):
-        global g_mcmc_count
-        global g_mc_count
-        global g_mc_batch_size
+    def _encode(self, x, missing):
+        """
+        Return the mean and log of variance of Q(z|X)
+        """
+        if self._np_model is not None:
+            return self._np_model.encode(x)
 
-        period = DateRange.build_date_range(
-            from_date, to_date, self.bucket_interval)
+        with self._keras_scope():
+            z_mean, z_log_var, _ = self._encoder_model.predict(
+                [x, missing], batch_size=g_mc_batch_size)
+        return z_mean, z_log_var
 
-        # This is the number of buckets that the function MUST return
-        predict_len = int((period.to_ts - period.from_ts) /
-                          self.bucket_interval)
+    def _decode(self, z, batch_size=None, last_only=False):
+        """
+        Reconstruct windows from latent vectors. With the NumPy backend,
+        `last_only` restricts the computation to the last bucket.
+        """
+        if self._np_model is not None:
+            return self._np_model.decode(z, last_only=last_only)
 
-        logging.info("predict(%s) range=%s", self.name, period)
+        with self._keras_scope():
+            return self._decoder_model.predict(
+                z, batch_size=batch_size or g_mc_batch_size)
 
-        self.load(num_cpus, num_gpus)
-
-        # Build history time range
-        # Extra data are required to predict first buckets
-        _window = self._window - 1
+    def _mc_std(self, x_):
+        """
+        Compute the standard deviation of the last bucket of each window
+        using Monte Carlo integration.
 
-        hist = DateRange(
-            period.from_ts - _window * self.bucket_interval,
-            period.to_ts,
-        )
+        Windows are encoded once, then latent samples of many windows are
+        decoded together in chunks that fit in `g_mc_max_bytes`. The number
+        of samples and the sampling scheme are set by the `mc_count` and
+        `mc_sampling` model settings.
+        """
+        nb_windows, W = x_.shape
+        std = np.empty((nb_windows,), dtype=float)
+        no_missing_point = np.full(x_.shape, False, dtype=bool)
+        z_mean, z_log_var = self._encode(x_, no_missing_point)
+
+        mc_count = self.mc_count or g_mc_count
+        chunk_size = _mc_chunk_size(W, mc_count)
+        for i in range(0, nb_windows, chunk_size):
+            j = min(i + chunk_size, nb_windows)
+            Z, weights = _sample_latent(
+                z_mean[i:j], z_log_var[i:j], mc_count, self.mc_sampling)
+            x_decoded = self._decode(Z, batch_size=len(Z), last_only=True)
+            samples = x_decoded[:, -1].reshape((j - i, -1))
+            std[i:j] = weighted_std(samples, weights)
+
+        return std
+
+    def _fetch_dataset(self, bucket, from_ts, to_ts):
+        """
+        Fetch buckets in range [from_ts, to_ts[ and apply feature defaults
 
-        # Prepare dataset
-        nb_buckets = int((hist.to_ts - hist.from_ts) / self.bucket_interval)
+        Returns the dataset and the timestamps of the buckets
+        """
+        rng = DateRange(from_ts, to_ts)
+        nb_buckets = int((to_ts - from_ts) / self.bucket_interval)
         dataset = np.full((nb_buckets,), np.nan, dtype=float)
         X = []
 
         # Fill dataset
-        logging.info("extracting data for range=%s", hist)
+        logging.info("extracting data for range=%s", rng)
         data = bucket.get_times_data(
             bucket_interval=self.bucket_interval,
             features=self.features,
-            from_date=hist.from_ts,
-            to_date=hist.to_ts,
+            from_date=from_ts,
+            to_date=to_ts,
         )
 
-        # Only a subset of history will be used for computing the prediction
-        X_until = None  # right bound for prediction
-        i = None
-
         for i, (_, val, timeval) in enumerate(data):
+            if make_datetime(timeval).timestamp() >= to_ts:
+                break
             dataset[i] = val
+            X.append(make_ts(timeval))
 
-            dt = make_datetime(timeval)
-            ts = dt.timestamp()
-            if ts < period.to_ts:
-                X.append(make_ts(timeval))
-                X_until = i + 1
-
-        if i is None:
-            raise errors.NoData("no data found for time range {}".format(hist))
+        if len(X) == 0:
+            raise errors.NoData("no data found for time range {}".format(rng))
 
         self.apply_defaults(dataset)
 
-        nb_buckets_found = i + 1
+        nb_buckets_found = len(X)
         if nb_buckets_found < nb_buckets:
             dataset = np.resize(dataset, (nb_buckets_found,))
 
         logging.info("found %d time periods", nb_buckets_found)
+        return dataset, X
 
-        real = np.copy(dataset)
+    def _predict_windows(self, norm_dataset, init=None):
+        """
+        Predict the last bucket of every window of a normalized dataset
 
-        norm_dataset = self.scale_dataset(dataset)
-        missing, X_test = self._format_dataset(norm_dataset[:X_until])
+        `init`, if set, gives the initial value of missing buckets before
+        MCMC imputation. It has the same layout as `norm_dataset`.
+
+        Returns the imputed windows, the standard deviation of the
+        predicted values and the number of MCMC iterations per window.
+        """
+        missing, X_test = self._format_dataset(norm_dataset)
         if len(X_test) == 0:
             raise errors.LoudMLException("not enough data for prediction")
 
+        if init is not None:
+            _, X_init = self._format_dataset(init, lazy=True)
+            X_test = np.where(missing, X_init, X_test)
+
         # force last col to missing
         missing[:, -1] = True
 
         logging.info("generating prediction")
         x_ = X_test.copy()
         # MCMC
-        for _ in range(g_mcmc_count):
-            z_mean, _, _ = self._encoder_model.predict(
-                [x_, missing], batch_size=g_mc_batch_size)
-            x_decoded = self._decoder_model.predict(
-                z_mean, batch_size=g_mc_batch_size)
-            x_[missing] = x_decoded[missing]
+        iterations = self._mcmc_impute(x_, missing)
+
+        # MC integration
+        return x_, self._mc_std(x_), iterations
+
+    def _mcmc_impute(self, x_, missing):
+        iterations = mcmc_impute(
+            x_,
+            missing,
+            lambda x, m: self._decode(self._encode(x, m)[0]),
+            tolerance=self.mcmc_tolerance,
+            max_iter=self.mcmc_max_iter,
+        )
+        if len(iterations) > 0:
+            logging.debug(
+                "MCMC imputation: %.2f iterations per window (max=%d)",
+                np.mean(iterations), np.max(iterations),
+            )
+        return iterations
 
+    def _build_prediction(
+        self,
+        timestamps,
+        observed,
+        x_,
+        std,
+        predict_len,
+        mcmc_iterations=None,
+    ):
         y = np.full((predict_len,), np.nan, dtype=float)
         y_low = np.full((predict_len,), np.nan, dtype=float)
         y_high = np.full((predict_len,), np.nan, dtype=float)
-        no_missing_point = np.full((g_mc_count, self.W), False, dtype=bool)
-        for j, x in enumerate(x_):
-            y[j] = x[-1]
-            # MC integration
-            _, _, Z = self._encoder_model.predict(
-                [np.tile(x, [g_mc_count, 1]), no_missing_point],
-                batch_size=g_mc_batch_size,
-            )
-            x_decoded = self._decoder_model.predict(
-                Z, batch_size=g_mc_batch_size)
-            std = np.std(x_decoded[:, -1])
-            y_low[j] = x[-1] - 3 * std
-            y_high[j] = x[-1] + 3 * std
+
+        nb_windows = len(x_)
+        y[:nb_windows] = x_[:, -1]
+        y_low[:nb_windows] = x_[:, -1] - 3 * std
+        y_high[:nb_windows] = x_[:, -1] + 3 * std
 
         y = self.unscale_dataset(y)
         y_low = self.unscale_dataset(y_low)
         y_high = self.unscale_dataset(y_high)
 
-        # Build final result
-        timestamps = X[_window:]
-
-        shape = (predict_len, len(self.features))
-        observed = np.full(shape, np.nan, dtype=float)
-        observed = real[_window:]
         self.apply_defaults(observed)
         self.apply_defaults(y)
 
-        return TimeSeriesPrediction(
+        prediction = TimeSeriesPrediction(
             self,
             timestamps=timestamps,
             observed=observed,
@@ -1312,6 +2030,108 @@ class DonutModel(Model):
             lower=y_low,
             upper=y_high,
         )
+        prediction.mcmc_iterations = mcmc_iterations
+        return prediction
+
+    def _save_eval_state(self, _state, to_ts, norm_dataset, x_):
+        """
+        Keep the last W - 1 normalized buckets and their imputed values
+        so that the next evaluation only has to process new buckets
+        """
+        _window = self._window - 1
+        if len(norm_dataset) < _window:
+            _state.pop('eval', None)
+            return
+
+        buffer = norm_dataset[len(norm_dataset) - _window:]
+        _state['eval'] = {
+            'span': self._window,
+            'bucket_interval': self.bucket_interval,
+            'to_ts': to_ts,
+            'means': self.means.tolist(),
+            'stds': self.stds.tolist(),
+            'buffer': [nan_to_none(val) for val in buffer],
+            'imputed': x_[-1][1:].tolist(),
+        }
+
+    def _get_eval_state(self, _state):
+        """
+        Return the incremental evaluation state if it is still valid for
+        the current model
+        """
+        state = _state.get('eval')
+        if state is None:
+            return None
+        if state['span'] != self._window \
+           or state['bucket_interval'] != self.bucket_interval \
+           or len(state['buffer']) != self._window - 1 \
+           or not np.allclose(state['means'], self.means) \
+           or not np.allclose(state['stds'], self.stds):
+            return None
+        return state
+
+    def get_history_range(self, from_date, to_date):
+        """
+        Time range of the data read by `predict()`
+
+        Extra data are required to predict first buckets
+        """
+        period = DateRange.build_date_range(
+            from_date, to_date, self.bucket_interval)
+
+        return DateRange(
+            period.from_ts - (self._window - 1) * self.bucket_interval,
+            period.to_ts,
+        )
+
+    def predict(
+        self,
+        bucket,
+        from_date,
+        to_date,
+        num_cpus=1,
+        num_gpus=0,
+        backend='keras',
+        _state=None,
+    ):
+        period = DateRange.build_date_range(
+            from_date, to_date, self.bucket_interval)
+
+        # This is the number of buckets that the function MUST return
+        predict_len = int((period.to_ts - period.from_ts) /
+                          self.bucket_interval)
+
+        logging.info("predict(%s) range=%s", self.name, period)
+
+        self.load(num_cpus, num_gpus, backend)
+
+        _window = self._window - 1
+        hist = self.get_history_range(from_date, to_date)
+
+        # Prepare dataset
+        dataset, X = self._fetch_dataset(bucket, hist.from_ts, hist.to_ts)
+        real = np.copy(dataset)
+
+        norm_dataset = self.scale_dataset(dataset)
+        x_, std, iterations = self._predict_windows(norm_dataset)
+
+        if _state is not None:
+            self._save_eval_state(
+                _state,
+                X[-1] + self.bucket_interval,
+                norm_dataset,
+                x_,
+            )
+
+        # Build final result
+        return self._build_prediction(
+            timestamps=X[_window:],
+            observed=real[_window:],
+            x_=x_,
+            std=std,
+            predict_len=predict_len,
+            mcmc_iterations=iterations,
+        )
 
     def generate_fake_prediction(self):
         now_ts = datetime.datetime.now().timestamp()
@@ -1339,11 +2159,8 @@ class DonutModel(Model):
         percent_noise=0,
         num_cpus=1,
         num_gpus=0,
+        backend='keras',
     ):
-        global g_mcmc_count
-        global g_mc_count
-        global g_mc_batch_size
-
         period = DateRange.build_date_range(
             from_date, to_date, self.bucket_interval)
 
@@ -1353,7 +2170,7 @@ class DonutModel(Model):
 
         logging.info("forecast(%s) range=%s", self.name, period)
 
-        self.load(num_cpus, num_gpus)
+        self.load(num_cpus, num_gpus, backend)
 
         # Build history time range
         # Extra data are required to predict first buckets
@@ -1365,92 +2182,77 @@ class DonutModel(Model):
         )
 
         # Prepare dataset
-        nb_buckets = int((hist.to_ts - hist.from_ts) / self.bucket_interval)
-        dataset = np.full((nb_buckets,), np.nan, dtype=float)
-        X = []
-
-        # Fill dataset
-        logging.info("extracting data for range=%s", hist)
-        data = bucket.get_times_data(
-            bucket_interval=self.bucket_interval,
-            features=self.features,
-            from_date=hist.from_ts,
-            to_date=hist.to_ts,
-        )
-
-        # Only a subset of history will be used for computing the prediction
-        X_until = None  # right bound for prediction
-        i = None
-
-        for i, (_, val, timeval) in enumerate(data):
-            dataset[i] = val
-
-            dt = make_datetime(timeval)
-            ts = dt.timestamp()
-            if ts < period.to_ts:
-                X.append(make_ts(timeval))
-                X_until = i + 1
-
-        if i is None:
-            raise errors.NoData("no data found for time range {}".format(hist))
-
-        self.apply_defaults(dataset)
-
-        nb_buckets_found = i + 1
-        if nb_buckets_found < nb_buckets:
-            dataset = np.resize(dataset, (nb_buckets_found,))
-
-        logging.info("found %d time periods", nb_buckets_found)
-
+        dataset, X = self._fetch_dataset(bucket, hist.from_ts, hist.to_ts)
         real = np.copy(dataset)
 
         norm_dataset = self.scale_dataset(dataset)
-        _, X_test = self._format_dataset(norm_dataset[:X_until])
+        _, X_test = self._format_dataset(norm_dataset, lazy=True)
         if len(X_test) == 0:
             raise errors.LoudMLException("not enough data for prediction")
 
         logging.info("generating prediction")
-        x_ = X_test.copy()
+        horizon = len(X_test)
+        nb_trajectories = self.forecast_trajectories
 
         p = norm().ppf(1-(1-percent_interval)/2)
-        missing = np.full((self._window,), False, dtype=bool)
-        # force last col to missing
-        missing[-1] = True
         y = np.full((forecast_len,), np.nan, dtype=float)
         y_low = np.full((forecast_len,), np.nan, dtype=float)
         y_high = np.full((forecast_len,), np.nan, dtype=float)
-        x = x_[0]
+
+        # All trajectories are rolled out together. The first one always
+        # follows the mean of Q(z|X), the other ones sample the latent
+        # space at each step with the `mc_sampling` scheme and make the
+        # ensemble used for uncertainty. The number of sigma points is set
+        # by the latent dimension.
+        z_mean, _ = self._encode(
+            X_test[:1], np.full(X_test[:1].shape, False, dtype=bool))
+        latent_dim = z_mean.shape[1]
+        epsilon, _ = mc_noise(
+            1, nb_trajectories - 1, latent_dim, self.mc_sampling)
+        nb_trajectories = epsilon.shape[1] + 1
+
+        x = np.tile(X_test[0], (nb_trajectories, 1))
+        missing = np.full(x.shape, False, dtype=bool)
+        # force last col to missing
+        missing[:, -1] = True
         noise = percent_noise * float(self.bucket_interval) / (24*3600)
-        for j, _ in enumerate(x_):
+        step_durations = []
+        mcmc_iterations = np.zeros((horizon,), dtype=int)
+
+        for j in range(horizon):
+            step_start = time.perf_counter()
+
             # MCMC
-            for _ in range(g_mcmc_count):
-                z_mean, _, _ = self._encoder_model.predict(
-                    [np.array([x]), np.array([missing])],
-                    batch_size=g_mc_batch_size,
-                )
-                x_decoded = self._decoder_model.predict(
-                    z_mean, batch_size=g_mc_batch_size)
-                x[missing] = x_decoded[0][missing]
+            mcmc_iterations[j] = np.max(self._mcmc_impute(x, missing))
 
             # uncertainty is modeled using a random uniform noise distribution
             # that increases over time
-            expand = np.random.uniform(-noise * j, noise * j, len(x))
+            expand = np.random.uniform(-noise * j, noise * j, x.shape)
             x *= 1 + expand
-            # MC integration
-            _, _, Z = self._encoder_model.predict(
-                [np.tile(x, [g_mc_count, 1]), np.tile(
-                    missing, [g_mc_count, 1])],
-                batch_size=g_mc_batch_size,
-            )
-            x_decoded = self._decoder_model.predict(
-                Z, batch_size=g_mc_batch_size)
-            std = np.std(x_decoded[:, -1])
-            y_low[j] = x[-1] - p * std
-            y_high[j] = x[-1] + p * std
-            y[j] = x[-1]
-            x = np.roll(x, -1)
+
+            # Sample next value of trajectories
+            z_mean, z_log_var = self._encode(x[1:], missing[1:])
+            epsilon, weights = mc_noise(
+                1, nb_trajectories - 1, latent_dim, self.mc_sampling)
+            Z = z_mean + np.exp(0.5 * z_log_var) * epsilon[0]
+            x[1:, -1] = self._decode(Z, last_only=True)[:, -1]
+
+            std = weighted_std(x[1:, -1], weights)
+            y_low[j] = x[0, -1] - p * std
+            y_high[j] = x[0, -1] + p * std
+            y[j] = x[0, -1]
+            x = np.roll(x, -1, axis=1)
             # set missing point to zero
-            x[-1] = 0
+            x[:, -1] = 0
+
+            step_durations.append(time.perf_counter() - step_start)
+
+        logging.info(
+            "forecast(%s) %d steps x %d trajectories in %.3fs "
+            "(step: avg=%.4fs, max=%.4fs)",
+            self.name, horizon, nb_trajectories, sum(step_durations),
+            np.mean(step_durations), np.max(step_durations),
+        )
 
         y = self.unscale_dataset(y)
         y_low = self.unscale_dataset(y_low)
@@ -1459,13 +2261,11 @@ class DonutModel(Model):
         # Build final result
         timestamps = X[_window:]
 
-        shape = (forecast_len, len(self.features))
-        observed = np.full(shape, np.nan, dtype=float)
         observed = real[_window:]
         self.apply_defaults(observed)
         self.apply_defaults(y)
 
-        return TimeSeriesPrediction(
+        prediction = TimeSeriesPrediction(
             self,
             timestamps=timestamps,
             observed=observed,
@@ -1473,6 +2273,9 @@ class DonutModel(Model):
             lower=y_low,
             upper=y_high,
         )
+        prediction.step_durations = step_durations
+        prediction.mcmc_iterations = mcmc_iterations
+        return prediction
 
     def detect_anomalies(self, prediction, hooks=[]):
         """
@@ -1567,12 +2370,17 @@ class DonutModel(Model):
                     self._state['anomaly'] = None
                     self._state['last_anomaly_ts'] = ts
 
-            stats.append({
+            bucket_stats = {
                 'mse': nan_to_none(mse),
                 'score': max_score,
                 'anomaly': is_anomaly,
                 'anomalies': anomalies,
-            })
+            }
+            if prediction.mcmc_iterations is not None \
+               and i < len(prediction.mcmc_iterations):
+                bucket_stats['mcmc_iterations'] = \
+                    int(prediction.mcmc_iterations[i])
+            stats.append(bucket_stats)
 
         prediction.stats = stats
         prediction.anomaly_indices = anomaly_indices
@@ -1582,16 +2390,95 @@ class DonutModel(Model):
         bucket,
         from_date,
         to_date,
-        _state={},
+        _state=None,
         num_cpus=1,
         num_gpus=0,
+        backend='keras',
     ):
-        return self.predict(
-            bucket,
-            from_date,
-            to_date,
-            num_cpus=num_cpus,
-            num_gpus=num_gpus,
+        """
+        Incremental prediction
+
+        The evaluation state saved in `_state` by the previous call holds
+        the last W - 1 normalized buckets and their imputed values. When
+        the requested range follows or overlaps the previous one, only new
+        buckets are fetched and only new windows are evaluated: the range is
+        clipped to start at the end of the previous one, and the result
+        does not include the buckets that were already evaluated.
+        Otherwise, the full history is processed like `predict()` does.
+        `_state`, if given, is updated for the next call.
+        """
+        period = DateRange.build_date_range(
+            from_date, to_date, self.bucket_interval)
+
+        self.load(num_cpus, num_gpus, backend)
+        state = None if _state is None else self._get_eval_state(_state)
+
+        if state is None or not (
+            period.from_ts <= state['to_ts'] <= period.to_ts
+        ):
+            return self.predict(
+                bucket,
+                from_date,
+                to_date,
+                num_cpus=num_cpus,
+                num_gpus=num_gpus,
+                backend=backend,
+                _state=_state,
+            )
+
+        # Buckets before the end of the previous range are already evaluated
+        from_ts = state['to_ts']
+        predict_len = int((period.to_ts - from_ts) / self.bucket_interval)
+
+        if from_ts > period.from_ts:
+            logging.info(
+                "predict2(%s) range=%s, clipped to start at %s, already "
+                "evaluated",
+                self.name, period, ts_to_datetime(from_ts),
+            )
+        else:
+            logging.info(
+                "predict2(%s) range=%s, incremental from %s",
+                self.name, period, ts_to_datetime(from_ts),
+            )
+
+        if predict_len == 0:
+            # Nothing new since last evaluation
+            return self._build_prediction(
+                timestamps=[],
+                observed=np.array([], dtype=float),
+                x_=np.zeros((0, self._window)),
+                std=np.zeros((0,)),
+                predict_len=0,
+            )
+
+        dataset, X = self._fetch_dataset(bucket, from_ts, period.to_ts)
+
+        buffer = np.array(
+            [np.nan if val is None else val for val in state['buffer']],
+            dtype=float,
+        )
+        imputed = np.array(state['imputed'], dtype=float)
+
+        norm_dataset = np.concatenate((buffer, self.scale_dataset(dataset)))
+        init = np.copy(norm_dataset)
+        init[:len(buffer)] = np.where(np.isnan(buffer), imputed, buffer)
+
+        x_, std, iterations = self._predict_windows(norm_dataset, init=init)
+        self._save_eval_state(
+            _state,
+            X[-1] + self.bucket_interval,
+            norm_dataset,
+            x_,
+        )
+
+        return self._build_prediction(
+            timestamps=X,
+            observed=dataset,
+            x_=x_,
+            std=std,
+            predict_len=predict_len,
+            mcmc_iterations=iterations,
         )
 
     def plot_results(
@@ -1678,8 +2565,7 @@ class DonutModel(Model):
             raise errors.LoudMLException("not enough data for prediction")
 
         # display a 2D plot of the digit classes in the latent space
-        z_mean, _, _ = self._encoder_model.predict([X_test, X_miss_val],
-                                                   batch_size=g_mc_batch_size)
+        z_mean, _ = self._encode(X_test, X_miss_val)
 
         if x_dim < 0 or y_dim < 0:
             mses = []
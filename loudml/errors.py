@@ -103,6 +103,18 @@ class UnsupportedBucket(LoudMLException):
         return "{} (type = '{}')".format(self.error, self.bucket_type)
 
 
+class UnsupportedStorage(LoudMLException):
+    """Unsupported storage type"""
+    code = 501
+
+    def __init__(self, storage_type, error=None):
+        self.storage_type = storage_type
+        self.error = error or self.__doc__
+
+    def __str__(self):
+        return "{} (type = '{}')".format(self.error, self.storage_type)
+
+
 class UnsupportedMetric(LoudMLException):
     """Unsupported metric"""
     code = 501
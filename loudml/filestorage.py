@@ -2,13 +2,19 @@
 Loud ML file storage
 """
 
+import base64
+import contextlib
 import copy
+import fcntl
 import glob
+import hashlib
 import json
 import logging
+import mmap
 import os
 import shutil
 import tempfile
+import time
 
 from voluptuous import (
     Length,
@@ -33,15 +39,53 @@ OBJECT_KEY_SCHEMA = schemas.All(
 )
 
 
+class _MappedWeights(mmap.mmap):
+    """
+    Model weights memory-mapped from a checkpoint file
+    """
+    path = None
+    stat = None
+    digest = None
+
+
+def _map_weights(path):
+    with open(path, 'rb') as fd:
+        weights = _MappedWeights(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        st = os.fstat(fd.fileno())
+    weights.path = path
+    weights.stat = (st.st_dev, st.st_ino)
+    return weights
+
+
 class FileStorage(Storage):
     """
     File storage
     """
 
-    def __init__(self, path):
+    # Size of the run state journal that triggers a compaction
+    RUN_JOURNAL_MAX_BYTES = 64 * 1024
+
+    # Size of the model index journal that triggers a compaction
+    INDEX_JOURNAL_MAX_BYTES = 256 * 1024
+
+    # Unreferenced weight blobs younger than this may be about to be linked
+    BLOB_GRACE_PERIOD = 60
+
+    def __init__(self, path, max_checkpoints=None, max_checkpoint_age=None):
+        """
+        max_checkpoints: number of checkpoints to keep per model
+        max_checkpoint_age: age in seconds after which checkpoints are
+            deleted
+
+        The active checkpoint is always kept.
+        """
         self.path = path
+        self.max_checkpoints = max_checkpoints
+        self.max_checkpoint_age = max_checkpoint_age
         self.model_dir = os.path.join(path, 'models')
         self.template_dir = os.path.join(path, 'templates')
+        self.index_path = os.path.join(path, 'models.index.json')
+        self.index_journal_path = os.path.join(path, 'models.index.journal')
 
         try:
             os.makedirs(self.model_dir, exist_ok=True)
@@ -58,15 +102,21 @@ class FileStorage(Storage):
         return "{:02d}".format(i)
 
     def get_next_ckpt_name(self, model_path):
-        path = next(iter(sorted(
-            glob.glob(os.path.join(model_path, '*.ckpt')),
-            key=lambda f: os.stat(f).st_mtime, reverse=True)), None)
+        # Not the most recent checkpoint, that may be an older one made
+        # active again
+        ckpts = [
+            int(ckpt)
+            for ckpt in (
+                os.path.splitext(os.path.basename(path))[0]
+                for path in glob.glob(os.path.join(model_path, '*.ckpt'))
+            )
+            if ckpt.isdigit()
+        ]
 
-        if path is None:
+        if len(ckpts) == 0:
             return self.get_ckpt_name(0)
         else:
-            ckpt = os.path.splitext(os.path.basename(path))[0]
-            return self.get_ckpt_name(int(ckpt)+1)
+            return self.get_ckpt_name(max(ckpts) + 1)
 
     def _convert_models(self):
         """
@@ -113,6 +163,129 @@ class FileStorage(Storage):
         with open(path) as fd:
             return json.load(fd)
 
+    def _weights_path(self, state_path):
+        return os.path.splitext(state_path)[0] + ".weights"
+
+    def _blobs_dir(self, model_path):
+        return os.path.join(model_path, "blobs")
+
+    def _write_blob(self, path, weights):
+        tmp_fd, tmp_path = tempfile.mkstemp(prefix=path + ".")
+        with os.fdopen(tmp_fd, 'wb') as fd:
+            fd.write(weights)
+            fd.flush()
+            os.fsync(fd)
+        os.chmod(tmp_path, 0o440)
+        os.rename(tmp_path, path)
+
+    def _write_weights(self, path, weights):
+        """
+        Write weights to a blob named after their hash, and hard-link the
+        checkpoint weights file to it. Identical weights are stored once.
+        """
+        if isinstance(weights, _MappedWeights):
+            try:
+                st = os.stat(path)
+                if (st.st_dev, st.st_ino) == weights.stat and \
+                   weights.digest is not None:
+                    # Unchanged
+                    return weights.digest
+            except FileNotFoundError:
+                pass
+
+        digest = hashlib.sha256(weights).hexdigest()
+        blobs_dir = self._blobs_dir(os.path.dirname(path))
+        blob_path = os.path.join(blobs_dir, digest)
+        os.makedirs(blobs_dir, exist_ok=True)
+
+        tmp_path = "{}.{}.link".format(path, os.getpid())
+        while True:
+            if not os.path.exists(blob_path):
+                self._write_blob(blob_path, weights)
+            try:
+                if os.path.samefile(blob_path, path):
+                    return digest
+            except FileNotFoundError:
+                pass
+
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            try:
+                os.link(blob_path, tmp_path)
+                break
+            except FileNotFoundError:
+                # Blob deleted in the meantime by a compaction
+                continue
+
+        os.rename(tmp_path, path)
+        return digest
+
+    def _write_state_file(self, state_path, state):
+        """
+        Write model state. Binary weights are written to a separate file
+        referenced by the JSON state.
+        """
+        weights = state.get('weights')
+        if weights is not None and not isinstance(weights, dict):
+            weights_path = self._weights_path(state_path)
+            digest = self._write_weights(weights_path, weights)
+            state = dict(state, weights={
+                'file': os.path.basename(weights_path),
+                'size': len(weights),
+                'sha256': digest,
+            })
+        self._write_json(state_path, state)
+
+    def _read_weights(self, model_path, state_path, state):
+        """
+        Map the weights file referenced by the state
+        """
+        weights = state.get('weights')
+        if isinstance(weights, dict):
+            path = os.path.join(model_path, weights['file'])
+            try:
+                state['weights'] = _map_weights(path)
+                state['weights'].digest = weights.get('sha256')
+            except FileNotFoundError:
+                raise errors.Invalid(
+                    "model weights file not found: {}".format(path))
+        elif state.get('h5py') is not None:
+            # Checkpoint of an older version, converted by `compact()` or
+            # when the state is saved again
+            state['weights'] = base64.b64decode(
+                state.pop('h5py').encode('utf-8'))
+        return state
+
+    def _convert_checkpoint(self, model_path, state_path):
+        """
+        Move base64 encoded weights of an old checkpoint to a binary file.
+        Return True if the checkpoint has been converted.
+        """
+        with self._ckpt_lock(model_path):
+            try:
+                st = os.stat(state_path)
+                state = self._load_json(state_path)
+            except (OSError, ValueError):
+                return False
+            if state.get('h5py') is None:
+                return False
+
+            logging.info("converting checkpoint `%s' to the new format",
+                         state_path)
+            state['weights'] = base64.b64decode(
+                state.pop('h5py').encode('utf-8'))
+            try:
+                self._write_state_file(state_path, state)
+                # The retention policy still applies to the original age
+                os.utime(state_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+            except OSError as exn:
+                logging.error("cannot convert checkpoint `%s': %s",
+                              state_path, str(exn))
+                return False
+        return True
+
     def _write_template_settings(self, model_path, settings):
         settings = copy.deepcopy(settings)
         self._write_json(os.path.join(model_path, "settings.json"), settings)
@@ -136,13 +309,18 @@ class FileStorage(Storage):
         else:
             state_path = os.path.join(model_path, "{}.ckpt".format(ckpt_name))
 
-        if state is None:
-            try:
-                os.unlink(state_path)
-            except FileNotFoundError:
-                pass
-        else:
-            self._write_json(state_path, state)
+        is_current = ckpt_name is None or \
+            ckpt_name == self._get_current_ckpt(model_path)
+
+        with self._ckpt_lock(model_path):
+            if state is None:
+                self._delete_ckpt_files(state_path)
+            else:
+                self._write_state_file(state_path, state)
+
+        if is_current:
+            # The run state has been saved with the whole state
+            self._clear_run_state(model_path)
 
     def _write_model(
         self, path, settings, state=None, save_state=True, save_ckpt=True
@@ -161,6 +339,7 @@ class FileStorage(Storage):
             self._write_model_state(path, state, ckpt_name)
             if save_ckpt:
                 self._set_current_ckpt(path, ckpt_name)
+                self._prune_checkpoints(path)
 
     def _write_template(self, path, settings):
         try:
@@ -178,6 +357,7 @@ class FileStorage(Storage):
 
         self._write_model(model_path, model.settings,
                           model.state, save_state=False)
+        self._update_index(model)
 
     def create_template(self, template):
         template_path = self.template_path(template.name)
@@ -203,15 +383,130 @@ class FileStorage(Storage):
             save_state,
             save_ckpt,
         )
+        self._update_index(model)
         return diff(old_settings, model.settings, expand=True)
 
     def save_state(self, model, ckpt_name=None):
-        self._write_model_state(self.model_path(
-            model.name), model.state, ckpt_name)
+        model_path = self.model_path(model.name)
+        is_current = ckpt_name is None or \
+            ckpt_name == self._get_current_ckpt(model_path)
+        self._write_model_state(model_path, model.state, ckpt_name)
+        if is_current:
+            self._update_index(model)
+
+    def save_run_state(self, model):
+        """
+        Append the run state to the model journal. Unlike `save_state()`,
+        the checkpoint is not rewritten.
+        """
+        model_path = self.model_path(model.name)
+        ckpt_name = self._get_current_ckpt(model_path)
+        if ckpt_name is None:
+            # Not a checkpoint yet
+            self.save_state(model)
+            return
+
+        entry = json.dumps({
+            'ckpt': ckpt_name,
+            'keys': model.RUN_STATE_KEYS,
+            'state': model.run_state,
+        })
+        # Several workers may save the run state of the same model
+        with self._run_state_lock(model_path):
+            with open(self._run_journal_path(model_path), 'a') as fd:
+                fd.write(entry + "\n")
+                fd.flush()
+                os.fsync(fd)
+                size = fd.tell()
+
+            if size > self.RUN_JOURNAL_MAX_BYTES:
+                self._compact_run_state(model_path)
+
+    @contextlib.contextmanager
+    def _lock_file(self, path):
+        with open(path, 'a') as fd:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _run_state_lock(self, model_path):
+        return self._lock_file(os.path.join(model_path, "run.lock"))
+
+    def _ckpt_lock(self, model_path):
+        return self._lock_file(os.path.join(model_path, "ckpt.lock"))
+
+    def _run_journal_path(self, model_path):
+        return os.path.join(model_path, "run.journal")
+
+    def _run_state_path(self, model_path):
+        return os.path.join(model_path, "run.json")
+
+    def _read_run_state(self, model_path):
+        """
+        Return the last run state entry, from the compacted file or the
+        journal
+        """
+        try:
+            entry = self._load_json(self._run_state_path(model_path))
+        except (FileNotFoundError, ValueError):
+            entry = None
+
+        try:
+            with open(self._run_journal_path(model_path)) as fd:
+                for line in fd:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Interrupted write
+                        break
+        except FileNotFoundError:
+            pass
+
+        return entry
+
+    def _compact_run_state(self, model_path):
+        """
+        Replace the journal by its last entry. The run state lock must be
+        held, so that no entry is appended meanwhile.
+        """
+        entry = self._read_run_state(model_path)
+        if entry is not None:
+            self._write_json(self._run_state_path(model_path), entry)
+        try:
+            os.unlink(self._run_journal_path(model_path))
+        except FileNotFoundError:
+            pass
+
+    def _clear_run_state(self, model_path):
+        with self._run_state_lock(model_path):
+            for path in [
+                self._run_journal_path(model_path),
+                self._run_state_path(model_path),
+            ]:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+    def _merge_run_state(self, model_path, ckpt_name, state):
+        entry = self._read_run_state(model_path)
+        if entry is None or entry.get('ckpt') != ckpt_name:
+            return state
+
+        for key in entry['keys']:
+            state.pop(key, None)
+        state.update(entry['state'])
+        return state
 
     def _set_current_ckpt(self, model_path, ckpt_name):
         state_path = os.path.join(model_path, "state.json")
         ckpt_path = os.path.join(model_path, "{}.ckpt".format(ckpt_name))
+        if self._get_current_ckpt(model_path) != ckpt_name:
+            # The run state belongs to the previous checkpoint
+            self._clear_run_state(model_path)
+
         try:
             os.unlink(state_path)
         except FileNotFoundError:
@@ -226,8 +521,146 @@ class FileStorage(Storage):
         model_path = self.model_path(model_name)
         self._set_current_ckpt(model_path, ckpt_name)
 
+    def _delete_blob(self, path):
+        """
+        Delete a weight blob if no checkpoint refers to it anymore, and
+        return the number of bytes freed
+        """
+        try:
+            st = os.stat(path)
+            if st.st_nlink > 1:
+                return 0
+            os.unlink(path)
+        except FileNotFoundError:
+            return 0
+        return st.st_size
+
+    def _delete_ckpt_files(self, state_path):
+        """
+        Delete a checkpoint, and return the number of bytes freed
+        """
+        freed = 0
+        try:
+            ref = self._load_json(state_path).get('weights')
+        except (FileNotFoundError, ValueError, AttributeError):
+            ref = None
+
+        for path in [state_path, self._weights_path(state_path)]:
+            try:
+                st = os.stat(path)
+                os.unlink(path)
+            except FileNotFoundError:
+                continue
+            if st.st_nlink == 1:
+                freed += st.st_size
+
+        if isinstance(ref, dict) and ref.get('sha256'):
+            freed += self._delete_blob(os.path.join(
+                self._blobs_dir(os.path.dirname(state_path)),
+                ref['sha256'],
+            ))
+        return freed
+
+    def _prune_checkpoints(self, model_path):
+        """
+        Delete the checkpoints that are not retained, see `max_checkpoints`
+        and `max_checkpoint_age`. Return the number of deleted checkpoints
+        and the number of bytes freed.
+        """
+        if not self.max_checkpoints and not self.max_checkpoint_age:
+            return 0, 0
+
+        current = self._get_current_ckpt(model_path)
+        ckpts = sorted(
+            (
+                path
+                for path in glob.glob(os.path.join(model_path, '*.ckpt'))
+                if os.path.splitext(os.path.basename(path))[0].isdigit()
+            ),
+            key=lambda path: int(os.path.splitext(os.path.basename(path))[0]),
+            reverse=True,
+        )
+        now = time.time()
+
+        deleted = 0
+        freed = 0
+        for i, path in enumerate(ckpts):
+            if os.path.splitext(os.path.basename(path))[0] == current:
+                continue
+
+            expired = bool(self.max_checkpoints) and i >= self.max_checkpoints
+            if not expired and self.max_checkpoint_age:
+                try:
+                    age = now - os.stat(path).st_mtime
+                except FileNotFoundError:
+                    continue
+                expired = age > self.max_checkpoint_age
+            if not expired:
+                continue
+
+            with self._ckpt_lock(model_path):
+                freed += self._delete_ckpt_files(path)
+            deleted += 1
+
+        return deleted, freed
+
+    def _collect_blobs(self, model_path):
+        """
+        Delete the weight blobs that no checkpoint refers to
+        """
+        deleted = 0
+        freed = 0
+        now = time.time()
+        for path in glob.glob(os.path.join(self._blobs_dir(model_path), '*')):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if st.st_nlink > 1 or now - st.st_ctime < self.BLOB_GRACE_PERIOD:
+                continue
+            size = self._delete_blob(path)
+            if size:
+                deleted += 1
+                freed += size
+        return deleted, freed
+
+    def compact(self):
+        """
+        Apply the checkpoint retention policy, convert the checkpoints
+        saved by older versions and delete unreferenced weight blobs of all
+        models
+        """
+        stats = {
+            'models': 0,
+            'checkpoints': 0,
+            'blobs': 0,
+            'reclaimed_bytes': 0,
+        }
+        for name in self.list_models():
+            model_path = self.model_path(name)
+            deleted, freed = self._prune_checkpoints(model_path)
+            stats['checkpoints'] += deleted
+            stats['reclaimed_bytes'] += freed
+            for path in glob.glob(os.path.join(model_path, '*.ckpt')):
+                self._convert_checkpoint(model_path, path)
+            deleted, freed = self._collect_blobs(model_path)
+            stats['blobs'] += deleted
+            stats['reclaimed_bytes'] += freed
+            stats['models'] += 1
+
+        logging.info(
+            "storage compacted: %d checkpoints and %d blobs deleted, "
+            "%d bytes reclaimed",
+            stats['checkpoints'],
+            stats['blobs'],
+            stats['reclaimed_bytes'],
+        )
+        return stats
+
     def get_current_ckpt(self, model_name):
-        model_path = self.model_path(model_name)
+        return self._get_current_ckpt(self.model_path(model_name))
+
+    def _get_current_ckpt(self, model_path):
         try:
             state_path = os.readlink(
                 os.path.join(model_path, "state.json"))
@@ -235,12 +668,43 @@ class FileStorage(Storage):
         except OSError:
             return None
 
+    def get_model_version(self, name):
+        model_path = self.model_path(name)
+        stamp = []
+        size = 0
+        for filename in [
+            "settings.json",
+            "state.json",
+            "run.json",
+            "run.journal",
+        ]:
+            try:
+                st = os.stat(os.path.join(model_path, filename))
+            except FileNotFoundError:
+                if filename == "settings.json":
+                    raise errors.ModelNotFound(name=name)
+                stamp.append(None)
+                continue
+            stamp.append((st.st_ino, st.st_mtime_ns, st.st_size))
+            size += st.st_size
+
+        try:
+            size += os.stat(self._weights_path(
+                os.path.realpath(os.path.join(model_path, "state.json"))
+            )).st_size
+        except FileNotFoundError:
+            pass
+
+        return self.get_current_ckpt(name), tuple(stamp), size
+
     def delete_model(self, name):
         try:
             shutil.rmtree(self.model_path(name))
         except FileNotFoundError:
             raise errors.ModelNotFound(name=name)
 
+        self._append_index(name, None)
+
     def delete_template(self, name):
         try:
             shutil.rmtree(self.template_path(name))
@@ -292,7 +756,7 @@ class FileStorage(Storage):
             state_path = os.path.join(model_path, "{}.ckpt".format(ckpt_name))
 
         try:
-            return self._load_json(state_path)
+            state = self._load_json(state_path)
         except ValueError as exn:
             raise errors.Invalid(
                 "invalid model state file: {}: {}".format(
@@ -304,6 +768,15 @@ class FileStorage(Storage):
             # Model is not trained yet
             return None
 
+        if state is None:
+            return None
+
+        current = self._get_current_ckpt(model_path)
+        if current is not None and ckpt_name in [None, current]:
+            state = self._merge_run_state(model_path, current, state)
+
+        return self._read_weights(model_path, state_path, state)
+
     def get_model_data(self, name, ckpt_name=None):
         model_path = self.model_path(name)
         settings = self._get_model_settings(model_path, name)
@@ -341,10 +814,15 @@ class FileStorage(Storage):
         return data
 
     def list_checkpoints(self, name):
-        return sorted([
-            os.path.splitext(os.path.basename(path))[0]
-            for path in glob.glob(os.path.join(self.model_dir, name, '*.ckpt'))
-        ])
+        # Checkpoint names are numbers, "100" comes after "99"
+        return sorted(
+            [
+                os.path.splitext(os.path.basename(path))[0]
+                for path in glob.glob(
+                    os.path.join(self.model_dir, name, '*.ckpt'))
+            ],
+            key=lambda ckpt: (int(ckpt) if ckpt.isdigit() else 0, ckpt),
+        )
 
     def list_models(self):
         return sorted([
@@ -352,6 +830,149 @@ class FileStorage(Storage):
             for path in glob.glob(self.model_path('*', validate=False))
         ])
 
+    @contextlib.contextmanager
+    def _index_lock(self, operation=fcntl.LOCK_EX):
+        with open(self.index_path + ".lock", 'a') as fd:
+            fcntl.flock(fd, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _load_index(self):
+        """
+        Load the model index and apply its journal. The index lock must be
+        held.
+        """
+        try:
+            index = self._load_json(self.index_path)
+            if not isinstance(index.get('models'), dict):
+                raise ValueError("unsupported format")
+        except FileNotFoundError:
+            index = {'dir_stamp': None, 'models': {}}
+        except (ValueError, AttributeError) as exn:
+            logging.error("invalid model index, rebuilding: %s", str(exn))
+            index = {'dir_stamp': None, 'models': {}}
+
+        try:
+            with open(self.index_journal_path) as fd:
+                for line in fd:
+                    try:
+                        name, entry = json.loads(line)
+                    except ValueError:
+                        # Interrupted write
+                        break
+                    if entry is None:
+                        index['models'].pop(name, None)
+                    else:
+                        index['models'][name] = entry
+        except FileNotFoundError:
+            pass
+
+        return index
+
+    def _write_index(self, index):
+        """
+        Write the whole model index and drop its journal. The index lock
+        must be held exclusively.
+        """
+        self._write_json(self.index_path, index)
+        try:
+            os.unlink(self.index_journal_path)
+        except FileNotFoundError:
+            pass
+
+    def _append_index(self, name, entry):
+        """
+        Update the index entry of a model, None if deleted
+        """
+        with self._index_lock():
+            # The index is a cache that can be rebuilt, no fsync
+            with open(self.index_journal_path, 'a') as fd:
+                fd.write(json.dumps([name, entry]) + "\n")
+                size = fd.tell()
+
+            if size > self.INDEX_JOURNAL_MAX_BYTES:
+                self._write_index(self._load_index())
+
+    def _dir_stamp(self):
+        """
+        Models are added or removed when the stamp of the model directory
+        changes
+        """
+        st = os.stat(self.model_dir)
+        return [st.st_ino, st.st_mtime_ns]
+
+    def _index_stamp(self, model_path):
+        stamp = []
+        for filename in ["settings.json", "state.json"]:
+            try:
+                st = os.stat(os.path.join(model_path, filename))
+                stamp.append([st.st_ino, st.st_mtime_ns, st.st_size])
+            except FileNotFoundError:
+                stamp.append(None)
+        return stamp
+
+    def _update_index(self, model):
+        self._append_index(model.name, {
+            'stamp': self._index_stamp(self.model_path(model.name)),
+            'preview': model.preview,
+        })
+
+    def _rebuild_index(self, index):
+        """
+        Rebuild the index entries of models that were added, removed or
+        modified out of band
+        """
+        models = {}
+        for name in self.list_models():
+            stamp = self._index_stamp(self.model_path(name))
+            entry = index['models'].get(name)
+            if entry is None or entry['stamp'] != stamp:
+                try:
+                    preview = self.load_model(name).preview
+                except errors.UnsupportedModel:
+                    preview = None
+                except errors.LoudMLException as exn:
+                    logging.error("cannot load model '%s': %s",
+                                  name, str(exn))
+                    continue
+                entry = {
+                    'stamp': stamp,
+                    'preview': preview,
+                }
+            models[name] = entry
+        index['models'] = models
+
+    def list_model_previews(self):
+        """
+        List model previews from the model index
+
+        The index is trusted as long as the model directory is unchanged:
+        models saved through the storage update their entry. Otherwise,
+        entries are checked against the files of each model and rebuilt if
+        needed.
+        """
+        dir_stamp = self._dir_stamp()
+        with self._index_lock(fcntl.LOCK_SH):
+            index = self._load_index()
+
+        if index['dir_stamp'] != dir_stamp:
+            with self._index_lock():
+                index = self._load_index()
+                dir_stamp = self._dir_stamp()
+                if index['dir_stamp'] != dir_stamp:
+                    self._rebuild_index(index)
+                    index['dir_stamp'] = dir_stamp
+                    self._write_index(index)
+
+        models = index['models']
+        return [
+            models[name]['preview']
+            for name in sorted(models)
+            if models[name]['preview'] is not None
+        ]
+
     def list_templates(self):
         return sorted([
             os.path.splitext(os.path.basename(path))[0]
@@ -433,6 +1054,16 @@ class FileStorage(Storage):
         schemas.validate(OBJECT_KEY_SCHEMA, key)
         return os.path.join(model_path, "objects", key + ".json")
 
+    def list_model_objects(self, model_name):
+        """List model objects"""
+
+        objects_dir = os.path.join(self.model_path(model_name), "objects")
+
+        return sorted([
+            os.path.splitext(os.path.basename(path))[0]
+            for path in glob.glob(os.path.join(objects_dir, '*.json'))
+        ])
+
     def set_model_object(self, model_name, key, data):
         """Save model object"""
 
@@ -0,0 +1,113 @@
+"""
+In-flight evaluations
+
+When the evaluation of a model takes longer than its interval, the next
+scheduled evaluations of this model would pile up and race to save its
+state. Evaluations are tracked by model, so that an evaluation requested
+while another one is in flight is handled according to the overlap policy
+of the model:
+
+- `skip`: the new evaluation is dropped.
+- `merge`: the new evaluation is merged into a pending job, that covers the
+  union of the time ranges and starts when the running job is done.
+- `allow`: the new evaluation runs concurrently.
+"""
+
+import threading
+
+from loudml.misc import (
+    make_ts,
+)
+
+OVERLAP_POLICIES = ['skip', 'merge', 'allow']
+
+
+def merge_eval_range(kwargs, other):
+    """
+    Extend the time range of an evaluation to the one of `other`. The other
+    settings of `other` supersede the ones of `kwargs`.
+    """
+    from_date = min(kwargs['from_date'], other['from_date'], key=make_ts)
+    to_date = max(kwargs['to_date'], other['to_date'], key=make_ts)
+    kwargs.update(other)
+    kwargs['from_date'] = from_date
+    kwargs['to_date'] = to_date
+
+
+class InFlightEvals:
+    """
+    Track the evaluation jobs of each model
+
+    `create(model_name, kwargs)` must return a new job, that is started
+    later, for pending evaluations. Jobs must provide `is_stopped()`, and
+    their `kwargs` must be mutable.
+    """
+
+    def __init__(self, create):
+        self.create = create
+        self.skipped = 0
+        self.merged = 0
+        self._lock = threading.Lock()
+        self._running = {}
+        self._pending = {}
+
+    def acquire(self, model_name, job):
+        """
+        Register the job that evaluates a model
+        """
+        with self._lock:
+            self._running[model_name] = job
+
+    def get_overlap(self, model_name, overlap, kwargs):
+        """
+        Apply the overlap policy to a new evaluation. Return None if the
+        evaluation must run, or the job it has been merged into, or the
+        running job if it has been skipped.
+        """
+        if overlap == 'allow':
+            return None
+
+        with self._lock:
+            running = self._running.get(model_name)
+            if running is None or running.is_stopped():
+                return None
+
+            if overlap == 'skip':
+                self.skipped += 1
+                return running
+
+            pending = self._pending.get(model_name)
+            if pending is None or pending.is_stopped():
+                pending = self.create(model_name, dict(kwargs))
+                self._pending[model_name] = pending
+            else:
+                merge_eval_range(pending.kwargs, kwargs)
+            self.merged += 1
+            return pending
+
+    def release(self, model_name, job):
+        """
+        Unregister a job that is done. Return the pending job of the model,
+        that must be started, if any.
+        """
+        with self._lock:
+            if self._running.get(model_name) is not job:
+                return None
+
+            del self._running[model_name]
+            pending = self._pending.pop(model_name, None)
+            if pending is None or pending.is_stopped():
+                return None
+
+            self._running[model_name] = pending
+            return pending
+
+    @property
+    def desc(self):
+        with self._lock:
+            return {
+                'running': len(self._running),
+                'pending': len(self._pending),
+                'skipped': self.skipped,
+                'merged': self.merged,
+            }
@@ -0,0 +1,178 @@
+"""
+Job classes
+
+Jobs are split into classes, e.g. training, inference and bucket I/O, that
+run on their own workers. Each class queues its jobs until one of its
+workers is free, so that a long training does not delay the evaluation of
+models. Queued jobs are run by order of priority, then by order of arrival.
+"""
+
+import concurrent.futures
+import heapq
+import itertools
+import threading
+import time
+
+from loudml import (
+    errors,
+)
+from loudml.pump import (
+    Latency,
+)
+
+
+class _QueuedFuture(concurrent.futures.Future):
+    """
+    Result of a queued job, completed with the result of the job once
+    submitted to a worker
+    """
+
+    def __init__(self, queue):
+        super().__init__()
+        self._queue = queue
+        self._inner = None
+        self._cancel_requested = False
+
+    def _set_inner(self, inner):
+        self._inner = inner
+        if self._cancel_requested:
+            inner.cancel()
+        inner.add_done_callback(self._inner_done)
+
+    def _inner_done(self, inner):
+        if inner.cancelled():
+            super().cancel()
+            return
+
+        exn = inner.exception()
+        if exn is None:
+            self.set_result(inner.result())
+        else:
+            self.set_exception(exn)
+
+    def cancel(self):
+        if self._queue.discard(self):
+            return super().cancel()
+        if self._inner is None:
+            # Being submitted
+            self._cancel_requested = True
+            return True
+        return self._inner.cancel()
+
+
+class JobQueue:
+    """
+    Queue of the jobs of a class
+
+    `submit(key, func, args, kwargs)` sends a job to the workers of the
+    class and returns its future. At most `workers` jobs are submitted at
+    once. `LimitReached` is raised when `max_queue` jobs are waiting. The
+    workers of the class run with the `nice` value.
+    """
+
+    def __init__(self, name, submit, workers, max_queue=None, nice=0):
+        if workers < 1:
+            raise ValueError("at least one worker is required")
+
+        self.name = name
+        self.submit = submit
+        self.workers = workers
+        self.max_queue = max_queue
+        self.nice = nice
+        self.jobs = 0
+        self.rejected = 0
+        self.queue_time = Latency()
+        self._lock = threading.Lock()
+        self._waiting = []
+        self._running = 0
+        self._seq = itertools.count()
+
+    def schedule(self, key, func, args=None, kwargs=None, priority=0):
+        """
+        Queue a job. Jobs with a higher priority run first.
+        """
+        future = _QueuedFuture(self)
+        entry = (
+            -priority,
+            next(self._seq),
+            future,
+            (key, func, args, kwargs),
+            time.monotonic(),
+        )
+
+        with self._lock:
+            if self.max_queue is not None \
+               and self._running >= self.workers \
+               and len(self._waiting) >= self.max_queue:
+                self.rejected += 1
+                raise errors.LimitReached(
+                    "too many {} jobs queued ({})".format(
+                        self.name,
+                        len(self._waiting),
+                    )
+                )
+            heapq.heappush(self._waiting, entry)
+            self.jobs += 1
+
+        self._run_pending()
+        return future
+
+    def discard(self, future):
+        """
+        Remove a job that is still waiting. Return True if found.
+        """
+        with self._lock:
+            for i, entry in enumerate(self._waiting):
+                if entry[2] is future:
+                    self._waiting.pop(i)
+                    heapq.heapify(self._waiting)
+                    return True
+        return False
+
+    def _next(self):
+        with self._lock:
+            if self._running >= self.workers or not self._waiting:
+                return None
+            self._running += 1
+            return heapq.heappop(self._waiting)
+
+    def _done(self, _):
+        with self._lock:
+            self._running -= 1
+        self._run_pending()
+
+    def _run_pending(self):
+        while True:
+            entry = self._next()
+            if entry is None:
+                break
+
+            _, _, future, (key, func, args, kwargs), queued = entry
+            self.queue_time.add(time.monotonic() - queued)
+            try:
+                inner = self.submit(key, func, args, kwargs)
+            except Exception as exn:
+                with self._lock:
+                    self._running -= 1
+                future.set_exception(exn)
+                continue
+
+            inner.add_done_callback(self._done)
+            future._set_inner(inner)
+
+    @property
+    def desc(self):
+        with self._lock:
+            running = self._running
+            waiting = len(self._waiting)
+
+        return {
+            'workers': self.workers,
+            'nice': self.nice,
+            'max_queue': self.max_queue,
+            'running': running,
+            'queue_depth': waiting,
+            'jobs': self.jobs,
+            'rejected': self.rejected,
+            'queue_time': self.queue_time.desc,
+        }
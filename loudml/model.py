@@ -210,6 +210,8 @@ class Model:
     """
 
     TYPE = 'model_cls'
+    # State keys updated at each evaluation
+    RUN_STATE_KEYS = []
     SCHEMA = Schema({
         Required('name'): All(schemas.key, Length(max=256)),
         Required('type'): All(schemas.key, Length(max=256)),
@@ -230,6 +232,7 @@ class Model:
         'max_threshold': schemas.score,
         'min_threshold': schemas.score,
         'max_evals': All(int, Range(min=1)),
+        'eval_overlap': Any('skip', 'merge', 'allow'),
     }, extra=ALLOW_EXTRA)
 
     def __init__(self, settings, state=None):
@@ -299,6 +302,14 @@ class Model:
     def default_bucket(self):
         return self._settings.get('default_bucket')
 
+    @property
+    def eval_overlap(self):
+        """
+        What to do with a scheduled evaluation when the previous one is
+        not done yet
+        """
+        return self._settings.get('eval_overlap') or 'merge'
+
     def get_tags(self):
         tags = {
             'model': self.name,
@@ -339,6 +350,19 @@ class Model:
     def state(self):
         return self._state
 
+    @property
+    def run_state(self):
+        """
+        State fields updated at each evaluation
+        """
+        if self._state is None:
+            return {}
+        return {
+            key: self._state[key]
+            for key in self.RUN_STATE_KEYS
+            if key in self._state
+        }
+
     @property
     def preview(self):
         state = {
@@ -0,0 +1,126 @@
+"""
+In-memory cache of loaded models for long-lived workers
+"""
+
+import collections
+import logging
+
+from . import (
+    errors,
+)
+
+g_model_cache_size = 16
+g_model_cache_max_bytes = 512 * 1024 * 1024
+
+
+class ModelCache:
+    """
+    LRU cache of loaded models
+
+    Entries are keyed by (model name, checkpoint name). Before a cached
+    model is returned, its version is read from the storage, so that
+    models modified by another process are reloaded. The memory used by
+    a model is approximated by the size of its stored data. Least recently
+    used models are evicted to stay below `max_models` and `max_bytes`.
+    """
+
+    def __init__(self, max_models=None, max_bytes=None):
+        self.max_models = g_model_cache_size \
+            if max_models is None else max_models
+        self.max_bytes = g_model_cache_max_bytes \
+            if max_bytes is None else max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def stats(self):
+        return {
+            'models': len(self._entries),
+            'nbytes': self.nbytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def _pop(self, key):
+        model, _, size = self._entries.pop(key)
+        self.nbytes -= size
+        unload = getattr(model, 'unload', None)
+        if unload is not None:
+            unload()
+
+    def discard(self, name):
+        """
+        Drop all cached checkpoints of a model
+        """
+        for key in [key for key in self._entries if key[0] == name]:
+            self._pop(key)
+
+    def clear(self):
+        for key in list(self._entries):
+            self._pop(key)
+
+    def get(self, storage, name):
+        """
+        Return the model from the cache, or load it from the storage
+        """
+        try:
+            version = storage.get_model_version(name)
+        except errors.ModelNotFound:
+            self.discard(name)
+            raise
+
+        if version is None or self.max_models == 0:
+            return storage.load_model(name)
+
+        ckpt_name, stamp, size = version
+        key = (name, ckpt_name)
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] == stamp:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            logging.debug("model cache hit: %s", name)
+            return entry[0]
+
+        self.misses += 1
+        logging.debug("model cache miss: %s", name)
+        self.discard(name)
+        model = storage.load_model(name)
+        if size > self.max_bytes:
+            return model
+
+        while len(self._entries) and (
+            len(self._entries) >= self.max_models or
+            self.nbytes + size > self.max_bytes
+        ):
+            self._pop(next(iter(self._entries)))
+            self.evictions += 1
+
+        self._entries[key] = (model, stamp, size)
+        self.nbytes += size
+        return model
+
+    def refresh(self, storage, model):
+        """
+        Update the version of a cached model after it has been saved
+        by the current process
+        """
+        version = storage.get_model_version(model.name)
+        if version is None:
+            return
+
+        ckpt_name, stamp, size = version
+        key = (model.name, ckpt_name)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] is not model:
+            self.discard(model.name)
+            return
+
+        self._entries[key] = (model, stamp, size)
+        self.nbytes += size - entry[2]
@@ -0,0 +1,283 @@
+"""
+NumPy inference for trained Donut models
+
+The encoder and decoder of a Donut VAE are stacks of `Dense` layers.
+Once the model is trained, inference does not need TensorFlow: weights
+are read from the Keras HDF5 file and layers are evaluated as plain
+matrix products.
+"""
+
+import base64
+import io
+import json
+
+import h5py
+import numpy as np
+from scipy.special import ndtri
+
+from . import (
+    errors,
+)
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+}
+
+
+class DenseLayer:
+    """
+    Fully connected layer
+    """
+
+    def __init__(self, name, kernel, bias, activation='linear'):
+        if activation not in ACTIVATIONS:
+            raise errors.Invalid(
+                "unsupported activation '{}' in layer '{}'".format(
+                    activation, name))
+
+        self.name = name
+        self.kernel = kernel
+        self.bias = bias
+        self.activation = activation
+        self._activation = ACTIVATIONS[activation]
+
+    @property
+    def nbytes(self):
+        return self.kernel.nbytes + self.bias.nbytes
+
+    def __call__(self, x):
+        return self._activation(np.dot(x, self.kernel) + self.bias)
+
+    def last_unit(self):
+        """
+        Return a layer that only computes the last output unit
+        """
+        return DenseLayer(
+            self.name,
+            self.kernel[:, -1:],
+            self.bias[-1:],
+            self.activation,
+        )
+
+
+def _get_layer_configs(h5file):
+    model_config = h5file.attrs.get('model_config')
+    if model_config is None:
+        raise errors.Invalid("model configuration not found in HDF5 file")
+    if isinstance(model_config, bytes):
+        model_config = model_config.decode('utf-8')
+
+    return {
+        layer['config']['name']: layer
+        for layer in json.loads(model_config)['config']['layers']
+    }
+
+
+def _inbound_layer(layer_config):
+    nodes = layer_config.get('inbound_nodes') or []
+    if len(nodes) == 0:
+        return None
+    return nodes[0][0][0]
+
+
+def _read_dense(h5file, layer_config, dtype):
+    name = layer_config['config']['name']
+    group = h5file['model_weights'][name]
+    weights = {}
+    for weight_name in group.attrs['weight_names']:
+        if isinstance(weight_name, bytes):
+            weight_name = weight_name.decode('utf-8')
+        key = weight_name.split('/')[-1].split(':')[0]
+        weights[key] = np.asarray(group[weight_name], dtype=dtype)
+
+    return DenseLayer(
+        name,
+        weights['kernel'],
+        weights['bias'],
+        layer_config['config'].get('activation', 'linear'),
+    )
+
+
+class NumpyDonut:
+    """
+    Donut encoder and decoder evaluated with NumPy
+    """
+
+    DECODER_LAYERS = [
+        'decoder_dense_0',
+        'decoder_dense_1',
+        'decoder_dense_2',
+    ]
+
+    def __init__(self, encoder, z_mean, z_log_var, decoder):
+        self.encoder = encoder
+        self.z_mean = z_mean
+        self.z_log_var = z_log_var
+        self.decoder = decoder
+        self.decoder_last = decoder[:-1] + [decoder[-1].last_unit()]
+        self.dtype = z_mean.kernel.dtype
+
+    @property
+    def W(self):
+        return self.decoder[-1].kernel.shape[1]
+
+    @property
+    def latent_dim(self):
+        return self.z_mean.kernel.shape[1]
+
+    @property
+    def nbytes(self):
+        layers = self.encoder + [self.z_mean, self.z_log_var] + self.decoder
+        return sum(layer.nbytes for layer in layers)
+
+    @classmethod
+    def from_hdf5(cls, h5file, dtype=np.float32):
+        """
+        Extract weights from an opened Keras HDF5 file
+        """
+        layers = _get_layer_configs(h5file)
+        for name in ['z_mean', 'z_log_var'] + cls.DECODER_LAYERS:
+            if name not in layers:
+                raise errors.Invalid("layer '{}' not found".format(name))
+
+        # Walk back from z_mean to the main input to find hidden layers
+        encoder = []
+        name = _inbound_layer(layers['z_mean'])
+        while name is not None and layers[name]['class_name'] == 'Dense':
+            encoder.insert(0, _read_dense(h5file, layers[name], dtype))
+            name = _inbound_layer(layers[name])
+
+        return cls(
+            encoder=encoder,
+            z_mean=_read_dense(h5file, layers['z_mean'], dtype),
+            z_log_var=_read_dense(h5file, layers['z_log_var'], dtype),
+            decoder=[
+                _read_dense(h5file, layers[name], dtype)
+                for name in cls.DECODER_LAYERS
+            ],
+        )
+
+    @classmethod
+    def from_bytes(cls, data, dtype=np.float32):
+        """
+        Extract weights from Keras HDF5 file contents
+        """
+        with h5py.File(io.BytesIO(data), mode='r') as h5file:
+            return cls.from_hdf5(h5file, dtype)
+
+    @classmethod
+    def from_b64(cls, model_b64, dtype=np.float32):
+        """
+        Extract weights from a base64 encoded Keras HDF5 file
+        """
+        return cls.from_bytes(
+            base64.b64decode(model_b64.encode('utf-8')), dtype)
+
+    def encode(self, x):
+        """
+        Return the mean and log of variance of Q(z|X)
+        """
+        h = np.asarray(x, dtype=self.dtype)
+        for layer in self.encoder:
+            h = layer(h)
+        return self.z_mean(h), self.z_log_var(h)
+
+    def decode(self, z, last_only=False):
+        """
+        Reconstruct windows from latent vectors. If `last_only` is set,
+        only the last bucket of each window is computed.
+        """
+        h = np.asarray(z, dtype=self.dtype)
+        for layer in (self.decoder_last if last_only else self.decoder):
+            h = layer(h)
+        return h
+
+
+MC_SAMPLING = [
+    'random',
+    'antithetic',
+    'stratified',
+    'qmc',
+    'sigma_points',
+]
+
+_PRIMES = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53]
+
+
+def _halton(count, dim):
+    """
+    First points of the Halton sequence in [0, 1[^dim
+    """
+    if dim > len(_PRIMES):
+        raise errors.Invalid(
+            "QMC sampling supports up to {} latent dimensions".format(
+                len(_PRIMES)))
+
+    points = np.zeros((count, dim))
+    for d, base in enumerate(_PRIMES[:dim]):
+        index = np.arange(1, count + 1)
+        f = 1.0
+        while np.any(index > 0):
+            f /= base
+            points[:, d] += f * (index % base)
+            index //= base
+    return points
+
+
+def _uniform_to_normal(u):
+    eps = np.finfo(float).eps
+    return ndtri(np.clip(u, eps, 1 - eps))
+
+
+def mc_noise(rows, count, dim, sampling='random'):
+    """
+    Standard normal noise for Monte Carlo integration over the latent space
+
+    Returns an array of shape (rows, n, dim) with n samples for each row,
+    and the weights of the samples, or None if samples are equally
+    weighted. n is `count` except for sigma points, where n = 2 * dim + 1.
+    """
+    if sampling == 'random':
+        return np.random.standard_normal((rows, count, dim)), None
+
+    if sampling == 'antithetic':
+        half = np.random.standard_normal((rows, (count + 1) // 2, dim))
+        return np.concatenate((half, -half), axis=1)[:, :count], None
+
+    if sampling == 'stratified':
+        # Latin hypercube: one sample per stratum in each dimension
+        strata = np.argsort(np.random.random((rows, count, dim)), axis=1)
+        u = (strata + np.random.random((rows, count, dim))) / count
+        return _uniform_to_normal(u), None
+
+    if sampling == 'qmc':
+        # Randomized Halton sequence, with one random shift per row
+        shift = np.random.random((rows, 1, dim))
+        u = (_halton(count, dim)[np.newaxis] + shift) % 1.0
+        return _uniform_to_normal(u), None
+
+    if sampling == 'sigma_points':
+        # Unscented transform with kappa = 1
+        kappa = 1.0
+        scale = np.sqrt(dim + kappa)
+        points = np.zeros((2 * dim + 1, dim))
+        points[1:dim + 1] = scale * np.eye(dim)
+        points[dim + 1:] = -scale * np.eye(dim)
+        weights = np.full((2 * dim + 1,), 1 / (2 * (dim + kappa)))
+        weights[0] = kappa / (dim + kappa)
+        return np.tile(points, (rows, 1, 1)), weights
+
+    raise errors.Invalid("unknown MC sampling '{}'".format(sampling))
+
+
+def weighted_std(samples, weights=None):
+    """
+    Standard deviation of samples along the last axis, with optional
+    weights
+    """
+    if weights is None:
+        return np.std(samples, axis=-1)
+
+    mean = np.sum(samples * weights, axis=-1, keepdims=True)
+    return np.sqrt(np.sum(weights * (samples - mean)**2, axis=-1))
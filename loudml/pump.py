@@ -0,0 +1,313 @@
+"""
+Job message pump and scheduler
+
+Worker processes report job states and statistics through a
+multiprocessing queue. The pump waits on the queue from a native thread,
+so that it wakes up as soon as messages arrive without blocking the gevent
+loop of the HTTP server, and applies them by batch.
+
+Periodic tasks registered with `schedule` run from their own thread, that
+sleeps until the next task is due.
+"""
+
+import datetime
+import logging
+import math
+import queue
+import threading
+import time
+import zlib
+
+import schedule
+
+# Maximum number of messages applied at once
+g_batch_size = 256
+
+
+class Latency:
+    """
+    Latency statistics, in seconds
+    """
+
+    def __init__(self, alpha=0.1):
+        self.alpha = alpha
+        self.count = 0
+        self.last = None
+        self.avg = None
+        self.max = None
+
+    def add(self, value):
+        value = max(0.0, value)
+        self.count += 1
+        self.last = value
+        if self.avg is None:
+            self.avg = value
+            self.max = value
+        else:
+            self.avg += self.alpha * (value - self.avg)
+            self.max = max(self.max, value)
+
+    @property
+    def desc(self):
+        return {
+            'count': self.count,
+            'last': self.last,
+            'avg': self.avg,
+            'max': self.max,
+        }
+
+
+def make_message(msg_type, **kwargs):
+    """
+    Build a message to send to the pump
+    """
+    return dict(kwargs, type=msg_type, ts=time.time())
+
+
+def _coalesce_key(msg):
+    """
+    Messages with the same key supersede each other
+    """
+    return msg['type'], msg.get('job_id'), msg.get('worker_id')
+
+
+class MessagePump:
+    """
+    Drain worker messages and dispatch them by type to `handlers`
+
+    Messages read at once are applied together. Only the last message for
+    a given job or worker is applied, e.g. intermediate progress updates
+    of a job are skipped when the pump is late.
+    """
+
+    def __init__(self, msg_queue, handlers, batch_size=None):
+        self.msg_queue = msg_queue
+        self.handlers = handlers
+        self.batch_size = batch_size or g_batch_size
+        self.messages = 0
+        self.batches = 0
+        self.queue_lag = Latency()
+        self.state_latency = Latency()
+        self._thread = None
+        self._stopping = False
+
+    def _read_batch(self):
+        msgs = [self.msg_queue.get()]
+        while len(msgs) < self.batch_size:
+            try:
+                msgs.append(self.msg_queue.get(block=False))
+            except queue.Empty:
+                break
+        return msgs
+
+    def apply(self, msgs):
+        """
+        Apply a batch of messages
+        """
+        now = time.time()
+        batch = {}
+        for msg in msgs:
+            if 'ts' in msg:
+                self.queue_lag.add(now - msg['ts'])
+            batch.pop(_coalesce_key(msg), None)
+            batch[_coalesce_key(msg)] = msg
+
+        for msg in batch.values():
+            handler = self.handlers.get(msg['type'])
+            if handler is None:
+                logging.warning("got unknown message type '%s'", msg['type'])
+                continue
+            try:
+                handler(msg)
+            except Exception:
+                logging.exception("cannot apply message '%s'", msg['type'])
+
+        now = time.time()
+        for msg in msgs:
+            if msg['type'] == 'job_state' and 'ts' in msg:
+                self.state_latency.add(now - msg['ts'])
+
+        self.messages += len(msgs)
+        self.batches += 1
+
+    def _run(self):
+        while True:
+            msgs = self._read_batch()
+            stop = None in msgs
+            msgs = [msg for msg in msgs if msg is not None]
+            if len(msgs):
+                self.apply(msgs)
+            if stop and self._stopping:
+                break
+
+    def start(self):
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._run,
+            name="message-pump",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """
+        Stop the pump once the pending messages have been applied
+        """
+        if self._thread is None:
+            return
+        self._stopping = True
+        self.msg_queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    @property
+    def desc(self):
+        try:
+            depth = self.msg_queue.qsize()
+        except NotImplementedError:
+            # Not available on macOS
+            depth = None
+
+        return {
+            'messages': self.messages,
+            'batches': self.batches,
+            'queue_depth': depth,
+            'queue_lag': self.queue_lag.desc,
+            'job_state_latency': self.state_latency.desc,
+        }
+
+
+def get_phase(key, period):
+    """
+    Deterministic offset in [0, period) seconds for the runs of a
+    periodic job, so that jobs with the same period are spread over it
+    """
+    if period <= 0:
+        return 0
+    ms = int(period * 1000)
+    return ((zlib.crc32(key.encode('utf-8')) & 0xffffffff) % ms) / 1000
+
+
+class PhasedJob(schedule.Job):
+    """
+    Periodic job that runs `phase` seconds after each multiple of its
+    period since the epoch, instead of one period after its previous run.
+    Runs missed while the job was late are skipped.
+    """
+
+    def __init__(self, interval, scheduler=None, phase=0):
+        super().__init__(interval, scheduler)
+        self.phase = phase
+
+    def _schedule_next_run(self):
+        super()._schedule_next_run()
+        if self.at_time is not None or self.start_day is not None:
+            return
+
+        period = self.period.total_seconds()
+        now = time.time()
+        ts = (math.floor((now - self.phase) / period) + 1) * period \
+            + self.phase
+        self.next_run = datetime.datetime.fromtimestamp(ts)
+
+
+class Scheduler:
+    """
+    Run pending `schedule` jobs when they are due
+
+    `wake()` must be called when jobs are added, so that the next run
+    time is computed again. The functions in `after_run` are called once
+    the due jobs have run, and whenever the scheduler is woken up.
+    """
+
+    def __init__(self, scheduler=None, max_sleep=60):
+        self.scheduler = scheduler or schedule.default_scheduler
+        self.max_sleep = max_sleep
+        self.after_run = []
+        self.runs = 0
+        self.lateness = Latency()
+        self._event = threading.Event()
+        self._thread = None
+        self._stopping = False
+
+    def wake(self):
+        self._event.set()
+
+    def run_pending(self):
+        """
+        Run the jobs that are due and return the time to wait for the
+        next one
+        """
+        next_run = self.scheduler.next_run
+        if next_run is not None:
+            now = datetime.datetime.now()
+            if next_run <= now:
+                self.lateness.add((now - next_run).total_seconds())
+                self.scheduler.run_pending()
+                self.runs += 1
+                next_run = self.scheduler.next_run
+
+        for func in self.after_run:
+            func()
+
+        if next_run is None:
+            return self.max_sleep
+
+        delay = (next_run - datetime.datetime.now()).total_seconds()
+        return min(max(0.0, delay), self.max_sleep)
+
+    def _run(self):
+        while not self._stopping:
+            self._event.clear()
+            try:
+                delay = self.run_pending()
+            except Exception:
+                logging.exception("scheduler error")
+                delay = 1
+            self._event.wait(delay)
+
+    def start(self):
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._run,
+            name="scheduler",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        if self._thread is None:
+            return
+        self._stopping = True
+        self.wake()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def get_load(self, window=60):
+        """
+        Number of job runs due in each second of the next `window` seconds
+        """
+        load = [0] * window
+        now = datetime.datetime.now()
+        for job in list(self.scheduler.jobs):
+            if job.next_run is None or job.period is None:
+                continue
+            period = job.period.total_seconds()
+            delay = max(0.0, (job.next_run - now).total_seconds())
+            while delay < window:
+                load[int(delay)] += 1
+                if period <= 0:
+                    break
+                delay += period
+        return load
+
+    @property
+    def desc(self):
+        next_run = self.scheduler.next_run
+        return {
+            'jobs': len(self.scheduler.jobs),
+            'runs': self.runs,
+            'next_run_timestamp': None if next_run is None
+            else next_run.timestamp(),
+            'lateness': self.lateness.desc,
+        }
@@ -103,6 +103,7 @@ ScheduledJob = Schema({
             'sunday',
             ),
         Optional('at'): All(time_str_key, Length(max=256)),
+        Optional('phase'): All(Any(int, float), Range(min=0)),
     }),
 })
 
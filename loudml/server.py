@@ -6,6 +6,8 @@ import copy
 import argparse
 import concurrent.futures
 from datetime import datetime, timedelta
+import gevent
+import gevent.event
 import logging
 import multiprocessing
 import pebble
@@ -13,6 +15,7 @@ import pkg_resources
 import queue
 import schedule
 import sys
+import threading
 import uuid
 import traceback
 import pytz
@@ -25,10 +28,6 @@ import loudml.config
 import loudml.model
 import loudml.worker
 
-from threading import (
-    Timer,
-)
-
 from flask import (
     Flask,
     jsonify,
@@ -42,6 +41,12 @@ from flask_restful import (
 from gevent.pywsgi import (
     WSGIServer,
 )
+from werkzeug.exceptions import (
+    HTTPException,
+)
+from werkzeug.http import (
+    HTTP_STATUS_CODES,
+)
 import loudml
 from loudml import (
     errors,
@@ -50,12 +55,25 @@ from loudml import (
 from loudml.bucket import (
     load_bucket,
 )
-from loudml.filestorage import (
-    FileStorage,
+from loudml.dispatcher import (
+    Dispatcher,
+)
+from loudml.inflight import (
+    OVERLAP_POLICIES,
+    InFlightEvals,
+)
+from loudml.jobqueue import (
+    JobQueue,
 )
 from loudml.metrics import (
     send_metrics,
 )
+from loudml.pump import (
+    MessagePump,
+    PhasedJob,
+    Scheduler,
+    get_phase,
+)
 from loudml.misc import (
     clear_fields,
     make_bool,
@@ -69,6 +87,9 @@ from loudml.misc import (
 from loudml.requests import (
     perform_request,
 )
+from loudml.storage import (
+    load_storage,
+)
 from jinja2 import Template
 import functools
 
@@ -81,10 +102,17 @@ g_scheduled_jobs = {}
 g_training = {}
 g_storage = None
 g_training_pool = None
-g_pool = None
-g_nice = 0
+g_io_pool = None
+g_dispatcher = None
+g_job_queues = {}
 g_queue = None
-g_timer = None
+g_pump = None
+g_scheduler = None
+g_hub_calls = None
+g_session = None
+g_batches = {}
+g_batches_lock = threading.Lock()
+g_evals = None
 
 # Do not change: pid file to ensure we're running single instance
 APP_INSTALL_PATHS = [
@@ -128,7 +156,21 @@ def get_sched_job_desc(job_id, fields=None, include_fields=None):
     return desc
 
 
-def get_schedule(cnt, unit, time_str=None):
+def get_schedule(cnt, unit, time_str=None, phase=None):
+    if phase is not None and time_str is None and unit in [
+        'second',
+        'seconds',
+        'minute',
+        'minutes',
+        'hour',
+        'hours',
+    ]:
+        interval = cnt if unit.endswith('s') else 1
+        return getattr(
+            PhasedJob(interval, schedule.default_scheduler, phase=phase),
+            unit,
+        )
+
     unit_map = {
         'second': schedule.every().second,
         'seconds': schedule.every(cnt).seconds,
@@ -154,12 +196,138 @@ def get_schedule(cnt, unit, time_str=None):
     return scheduled_event
 
 
-@catch_exceptions(cancel_on_failure=False)
-def daemon_exec_scheduled_job(job_id):
-    global g_scheduled_jobs
-    global g_config
+class _HubCalls:
+    """
+    Run functions from other threads in the gevent loop of the HTTP server
 
-    desc = g_scheduled_jobs[job_id]
+    Views and job functions are not thread-safe: they must run in the loop,
+    like requests served over HTTP. Calls are handed to the loop through an
+    async watcher, and run in their own greenlet.
+    """
+
+    def __init__(self):
+        self.hub = gevent.get_hub()
+        self._calls = queue.SimpleQueue()
+        self._closed = False
+        self._watcher = self.hub.loop.async_()
+        self._watcher.start(self._run_pending)
+
+    def _run_pending(self):
+        while True:
+            try:
+                func, future = self._calls.get_nowait()
+            except queue.Empty:
+                break
+            gevent.spawn(self._run, func, future)
+
+    @staticmethod
+    def _run(func, future):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func())
+        except BaseException as exn:
+            future.set_exception(exn)
+
+    def in_hub(self):
+        return threading.get_ident() == self.hub.thread_ident
+
+    def post(self, func, *args, **kwargs):
+        """
+        Schedule the function in the loop and return the future of its
+        result, without waiting
+        """
+        future = concurrent.futures.Future()
+        if self._closed:
+            future.cancel()
+            return future
+
+        self._calls.put((functools.partial(func, *args, **kwargs), future))
+        self._watcher.send()
+        return future
+
+    def call(self, func, *args, **kwargs):
+        """
+        Run the function in the loop and return its result. The calling
+        thread is blocked until the function returns.
+        """
+        if self.in_hub():
+            return func(*args, **kwargs)
+        return self.post(func, *args, **kwargs).result()
+
+    def close(self):
+        """
+        Cancel pending calls. Must be called from the loop.
+        """
+        self._closed = True
+        self._watcher.close()
+        while True:
+            try:
+                _, future = self._calls.get_nowait()
+            except queue.Empty:
+                break
+            future.cancel()
+
+
+def call_in_hub(func, *args, **kwargs):
+    """
+    Run the function in the gevent loop of the HTTP server, or in the
+    current thread if the server is not running
+    """
+    global g_hub_calls
+
+    if g_hub_calls is None:
+        return func(*args, **kwargs)
+    return g_hub_calls.call(func, *args, **kwargs)
+
+
+def post_in_hub(func, *args, **kwargs):
+    """
+    Like `call_in_hub()`, but do not wait for the function to run when
+    called from another thread
+    """
+    global g_hub_calls
+
+    if g_hub_calls is None or g_hub_calls.in_hub():
+        func(*args, **kwargs)
+    else:
+        g_hub_calls.post(func, *args, **kwargs)
+
+
+def dispatch_local_request(method, url, params=None, body=None):
+    """
+    Run the view of this server that handles the request, without going
+    through HTTP. Return the (status code, reason) of the response, or None
+    if no view matches.
+    """
+    method = method.upper()
+    try:
+        app.url_map.bind('localhost').match(url, method=method)
+    except HTTPException:
+        return None
+
+    with app.test_request_context(
+        url,
+        method=method,
+        query_string=params,
+        json=body,
+    ):
+        try:
+            response = app.full_dispatch_request()
+        except Exception as exn:
+            logging.exception(exn)
+            return 500, HTTP_STATUS_CODES[500]
+
+    return response.status_code, HTTP_STATUS_CODES.get(response.status_code)
+
+
+def dispatch_http_request(method, url, params=None, body=None):
+    """
+    Send the request to this server through HTTP. Return the
+    (status code, reason) of the response.
+    """
+    global g_config
+    global g_session
 
     listen_addr = g_config.server['listen']
     host, port = listen_addr.split(':')
@@ -170,59 +338,94 @@ def daemon_exec_scheduled_job(job_id):
     # cluster configurations to construct the base url.
     base_url = 'http://localhost:{}'.format(port)
 
-    session = requests.Session()
-    session.headers = {}
-    session.headers.setdefault('content-type', 'application/json')
-    session.headers.setdefault(
-        'user-agent',
-        'loudmld {}'.format(pkg_resources.require("loudml")[0].version)
+    if g_session is None:
+        session = requests.Session()
+        session.headers = {}
+        session.headers.setdefault('content-type', 'application/json')
+        session.headers.setdefault(
+            'user-agent',
+            'loudmld {}'.format(pkg_resources.require("loudml")[0].version)
+        )
+        g_session = session
+
+    response = perform_request(
+        base_url,
+        method,
+        url,
+        session=g_session,
+        params=params,
+        body=body,
+        timeout=5,
+        ignore=(),
+        headers=None,
     )
-    params = None
+    return response.status_code, response.reason
+
+
+@catch_exceptions(cancel_on_failure=False)
+def daemon_exec_scheduled_job(job_id):
+    global g_scheduled_jobs
+
+    desc = g_scheduled_jobs[job_id]
+
+    params = {}
     if 'params' in desc:
         params = copy.deepcopy(desc['params'])
         for key in ['from', 'to']:
             if key in params:
                 params[key] = int(make_ts(params[key]))
 
-    response = perform_request(
-        base_url,
+    # Endpoints of this server are called in-process, from the loop of the
+    # HTTP server. Do not wait for job results, that would delay the other
+    # scheduled jobs.
+    res = call_in_hub(
+        dispatch_local_request,
         desc['method'],
         desc['relative_url'],
-        session=session,
-        params=params,
+        params=dict({'bg': 'true'}, **params),
         body=desc.get('json'),
-        timeout=5,
-        ignore=(),
-        headers=None,
     )
+    if res is None:
+        res = dispatch_http_request(
+            desc['method'],
+            desc['relative_url'],
+            params=params or None,
+            body=desc.get('json'),
+        )
+    status_code, reason = res
 
-    desc['ok'] = response.ok
-    desc['status_code'] = response.status_code
-    if not response.ok:
-        desc['error'] = response.reason
+    ok = status_code < 400
+    desc['ok'] = ok
+    desc['status_code'] = status_code
+    if not ok:
+        desc['error'] = reason
     else:
         desc.pop('error', None)
     desc['last_run_timestamp'] = datetime.now(pytz.utc).timestamp()
-    if not response.ok:
+    if not ok:
         logging.error(
             "error executing scheduled job '%s':%s",
             desc['name'],
-            response.reason)
+            reason)
 
 
 def add_new_scheduled_job(desc):
     global g_scheduled_jobs
+    global g_scheduler
     scheduled_job_name = desc['name']
     scheduled_event = get_schedule(
         cnt=desc['every'].get('count', 1),
         unit=desc['every']['unit'],
-        time_str=desc['every'].get('at'))
+        time_str=desc['every'].get('at'),
+        phase=desc['every'].get('phase'))
 
     g_scheduled_jobs[scheduled_job_name] = desc
     scheduled_event.do(
         daemon_exec_scheduled_job, scheduled_job_name).tag(
         'scheduled_job:{}'.format(scheduled_job_name),
         'scheduled_job')
+    if g_scheduler is not None:
+        g_scheduler.wake()
     return scheduled_job_name
 
 
@@ -240,32 +443,16 @@ def del_scheduled_job(scheduled_job_name):
         return
 
 
-class RepeatingTimer(object):
-    def __init__(self, interval, cb, *args, **kwargs):
-        self.interval = interval
-        self.cb = cb
-        self.args = args
-        self.kwargs = kwargs
-        self.timer = None
-
-    def callback(self):
-        self.cb(*self.args, **self.kwargs)
-        self.start()
-
-    def cancel(self):
-        self.timer.cancel()
-
-    def start(self):
-        self.timer = Timer(self.interval, self.callback)
-        self.timer.start()
-
-
 class Job:
     """
     Loud ML job
+
+    Jobs run on the workers of their `job_class`, by order of `priority`.
     """
     func = None
     job_type = None
+    job_class = 'inference'
+    priority = 0
     debug = False
 
     def __init__(self):
@@ -277,6 +464,7 @@ class Job:
         self.created_dt = datetime.now(pytz.utc)
         self.done_dt = None
         self._future = None
+        self._done = gevent.event.Event()
         self.model_name = None
 
     @property
@@ -322,6 +510,13 @@ class Job:
     def kwargs(self):
         return {}
 
+    @property
+    def affinity_key(self):
+        """
+        Jobs with the same key are preferably run by the same worker
+        """
+        return None
+
     def is_stopped(self):
         """
         Tell if job is stopped
@@ -332,18 +527,33 @@ class Job:
         """
         Submit job to worker pool
         """
-        global g_pool
+        global g_job_queues
         global g_jobs
 
+        queue = g_job_queues[self.job_class]
         self.debug = config.debug
+
+        # The worker may report the state of the job as soon as it is
+        # scheduled
+        registered = g_jobs.get(self.id) is self
+        state = self.state
         self.state = 'waiting'
-        self._future = g_pool.schedule(
-            loudml.worker.run,
-            args=[self.id, 0, self.func, config] + self.args,
-            kwargs=self.kwargs,
-        )
-        self._future.add_done_callback(self._done_cb)
         g_jobs[self.id] = self
+        try:
+            self._future = queue.schedule(
+                self.affinity_key,
+                loudml.worker.run,
+                args=[self.id, queue.nice, self.func, config] + self.args,
+                kwargs=self.kwargs,
+                priority=self.priority,
+            )
+        except errors.LimitReached:
+            self.state = state
+            if not registered:
+                del g_jobs[self.id]
+            raise
+
+        self._future.add_done_callback(self._done_cb)
 
     def cancel(self):
         """
@@ -355,6 +565,12 @@ class Job:
                 "job is already stopped (state = {})".format(self.state),
             )
 
+        if self._future is None:
+            # Not submitted yet
+            self.error = "job canceled"
+            self.set_final_state('canceled')
+            return
+
         self.state = 'canceling'
         logging.info("job[%s] canceling...", self.id)
         self._future.cancel()
@@ -362,6 +578,9 @@ class Job:
     def set_final_state(self, state):
         self.done_dt = datetime.now(pytz.utc)
         self.state = state
+        # Futures complete in the threads of the job queues, the event must
+        # be set from the loop
+        post_in_hub(self._done.set)
 
     def _done_cb(self, result):
         """
@@ -392,6 +611,14 @@ class Job:
         """
         return self._future.result()
 
+    def wait(self, timeout=None):
+        """
+        Wait until the job is done, or until the timeout in seconds
+        expires. Other requests are served by the HTTP server meanwhile.
+        Return True if the job is done.
+        """
+        return self._done.wait(timeout)
+
 
 @app.route("/jobs/<job_id>/_cancel", methods=['POST'])
 def job_stop(job_id):
@@ -425,25 +652,20 @@ def set_job_state(job_id, state, progress=None):
     job.progress = progress
 
 
-def read_messages():
-    """
-    Read messages from subprocesses
-    """
-    global g_queue
+def on_job_state(msg):
+    set_job_state(
+        msg['job_id'],
+        msg['state'],
+        progress=msg.get('progress'),
+    )
 
-    while True:
-        schedule.run_pending()
-        try:
-            msg = g_queue.get(block=False)
 
-            if msg['type'] == 'job_state':
-                set_job_state(
-                    msg['job_id'],
-                    msg['state'],
-                    progress=msg.get('progress'),
-                )
-        except queue.Empty:
-            break
+def on_worker_stats(msg):
+    global g_dispatcher
+    g_dispatcher.set_worker_stats(
+        msg['worker_id'],
+        msg['cache'],
+    )
 
 
 @app.errorhandler(errors.LoudMLException)
@@ -498,6 +720,39 @@ def get_int_arg(param, default=None):
         raise errors.Invalid("invalid value for parameter '{}'".format(param))
 
 
+def get_timeout_arg(param='timeout'):
+    """
+    Read timeout URL parameter, in seconds. A timeout of 0 means to wait
+    until the job is done, and None is returned.
+    """
+    global g_config
+
+    value = request.args.get(param)
+    if value is None:
+        value = g_config.server['request_timeout']
+        if value is None:
+            return None
+
+    timeout = parse_timedelta(value, min=0).total_seconds()
+    return timeout or None
+
+
+def job_response(job):
+    """
+    Return the result of a job, or its id if it runs in the background or
+    does not complete within the request timeout
+    """
+    if get_bool_arg('bg', default=False):
+        return jsonify(job.id), 202
+
+    if not job.wait(get_timeout_arg()):
+        logging.info("job[%s] not done yet, running in the background",
+                     job.id)
+        return jsonify(job.id), 202
+
+    return jsonify(job.result())
+
+
 def get_date_arg(param, default=None, is_mandatory=False):
     """
     Read date URL parameter
@@ -549,13 +804,9 @@ def get_json(is_mandatory=True):
     return data
 
 
-def get_model_info(name, fields, include_fields):
-    global g_storage
+def _format_model_info(name, info, fields, include_fields):
     global g_training
 
-    model = g_storage.load_model(name)
-    info = model.preview
-
     job = g_training.get(name)
     if job:
         job_desc = job.desc
@@ -575,6 +826,13 @@ def get_model_info(name, fields, include_fields):
     return info
 
 
+def get_model_info(name, fields, include_fields):
+    global g_storage
+
+    model = g_storage.load_model(name)
+    return _format_model_info(name, model.preview, fields, include_fields)
+
+
 def get_model_version_info(model_name, model_version, fields, include_fields):
     global g_storage
 
@@ -706,21 +964,16 @@ class ModelsResource(Resource):
         list_sort_field, list_sort_order = request.args.get(
             'sort', 'name:1').split(':')
 
-        models = []
-        for name in g_storage.list_models():
-            try:
-                model = get_model_info(name, fields, include_fields)
-                models.append(model)
-            except errors.UnsupportedModel:
-                continue
-
         models = sorted(
-            models,
+            g_storage.list_model_previews(),
             key=lambda k: k['settings'].get(list_sort_field),
             reverse=bool(int(list_sort_order) == -1),
         )
-        return jsonify(
-            models[page*per_page:(page+1)*per_page])
+        return jsonify([
+            _format_model_info(
+                info['settings']['name'], info, fields, include_fields)
+            for info in models[page*per_page:(page+1)*per_page]
+        ])
 
     @catch_loudml_error
     def post(self):
@@ -1297,6 +1550,36 @@ api.add_resource(JobsResource, "/jobs")
 api.add_resource(JobResource, "/jobs/<job_ids>")
 
 
+@app.route("/jobs/_workers", methods=['GET'])
+def jobs_workers():
+    """
+    Queue depth and model cache statistics of each inference worker
+    """
+    global g_dispatcher
+    return jsonify(g_dispatcher.desc)
+
+
+@app.route("/jobs/_stats", methods=['GET'])
+def jobs_stats():
+    """
+    Latency of job state updates, of scheduled jobs, and of the job
+    queues of each class
+    """
+    global g_pump
+    global g_scheduler
+    global g_job_queues
+    global g_evals
+    return jsonify({
+        'messages': g_pump.desc,
+        'scheduler': g_scheduler.desc,
+        'evals': g_evals.desc,
+        'queues': {
+            name: queue.desc
+            for name, queue in g_job_queues.items()
+        },
+    })
+
+
 class ScheduledJobsResource(Resource):
     @catch_loudml_error
     def get(self):
@@ -1402,35 +1685,43 @@ api.add_resource(ScheduledJobsResource, "/scheduled_jobs")
 api.add_resource(ScheduledJobResource, "/scheduled_jobs/<job_ids>")
 
 
+@app.route("/scheduled_jobs/_load", methods=['GET'])
+@catch_loudml_error
+def scheduled_jobs_load():
+    """
+    Number of scheduled runs in each second of the next `window` seconds
+    """
+    global g_scheduler
+
+    window = get_int_arg('window', default=60)
+    if window <= 0 or window > 86400:
+        raise errors.Invalid(
+            "invalid value for parameter '{}'".format('window')
+        )
+
+    load = g_scheduler.get_load(window)
+    return jsonify({
+        'window': window,
+        'runs': sum(load),
+        'max': max(load),
+        'mean': sum(load) / window,
+        'load': load,
+    })
+
+
 class TrainingJob(Job):
     """
     Model training job
     """
     func = 'train'
     job_type = 'training'
+    job_class = 'training'
 
     def __init__(self, model_name, **kwargs):
         super().__init__()
         self.model_name = model_name
         self._kwargs = kwargs
 
-    def start(self, config):
-        """
-        Submit training job to worker pool
-        """
-        global g_training_pool
-        global g_nice
-        global g_jobs
-
-        g_jobs[self.id] = self
-        self.state = 'waiting'
-        self._future = g_training_pool.schedule(
-            loudml.worker.run,
-            args=[self.id, g_nice, self.func, config] + self.args,
-            kwargs=self.kwargs,
-        )
-        self._future.add_done_callback(self._done_cb)
-
     @property
     def args(self):
         return [self.model_name]
@@ -1457,6 +1748,7 @@ class ReadBucketJob(Job):
     """
     func = 'read_from_bucket'
     job_type = 'read'
+    job_class = 'io'
 
     def __init__(
         self,
@@ -1490,6 +1782,7 @@ class WriteBucketJob(Job):
     """
     func = 'write_to_bucket'
     job_type = 'write'
+    job_class = 'io'
 
     def __init__(
         self,
@@ -1520,6 +1813,8 @@ class PredictionJob(Job):
     """
     func = 'predict'
     job_type = 'prediction'
+    # Anomalies must be detected in time, forecasts can wait
+    priority = 1
 
     def __init__(self, model_name, **kwargs):
         super().__init__()
@@ -1534,6 +1829,129 @@ class PredictionJob(Job):
     def kwargs(self):
         return self._kwargs
 
+    @property
+    def affinity_key(self):
+        return self.model_name
+
+    def set_final_state(self, state):
+        super().set_final_state(state)
+        release_evals(self, [self.model_name])
+
+
+class BatchPredictionJob(Job):
+    """
+    Prediction job of several models that read the same data
+    """
+    func = 'predict_batch'
+    job_type = 'batch_prediction'
+    priority = 1
+
+    def __init__(self, batch):
+        super().__init__()
+        self.batch = batch
+        self.evals = []
+
+    def add(self, model_name, **kwargs):
+        self.evals.append(dict(kwargs, model_name=model_name))
+
+    @property
+    def desc(self):
+        desc = super().desc
+        desc['batch'] = self.batch
+        desc['models'] = [kwargs['model_name'] for kwargs in self.evals]
+        return desc
+
+    @property
+    def args(self):
+        return [self.evals]
+
+    @property
+    def affinity_key(self):
+        return self.batch
+
+    def set_final_state(self, state):
+        super().set_final_state(state)
+        release_evals(self, [kwargs['model_name'] for kwargs in self.evals])
+
+
+def _create_pending_eval(model_name, kwargs):
+    global g_jobs
+
+    job = PredictionJob(model_name, **kwargs)
+    g_jobs[job.id] = job
+    return job
+
+
+def release_evals(job, model_names):
+    """
+    Start the pending evaluations of models once their job is done
+    """
+    global g_evals
+    global g_config
+
+    if g_evals is None:
+        return
+
+    for model_name in model_names:
+        pending = g_evals.release(model_name, job)
+        if pending is None:
+            continue
+
+        logging.info("job[%s] starting pending evaluation of model '%s'",
+                     pending.id, model_name)
+        try:
+            pending.start(g_config)
+        except errors.LoudMLException as exn:
+            pending.error = str(exn)
+            pending.set_final_state('failed')
+            logging.error("job[%s] failed: %s", pending.id, pending.error)
+
+
+def queue_batch_prediction(batch, model_name, **kwargs):
+    """
+    Add a prediction to the pending job of the given batch. Pending jobs
+    are started by the scheduler, once the due scheduled jobs have run.
+    """
+    global g_batches
+    global g_jobs
+    global g_scheduler
+
+    with g_batches_lock:
+        job = g_batches.get(batch)
+        if job is None:
+            job = BatchPredictionJob(batch)
+            g_batches[batch] = job
+            g_jobs[job.id] = job
+        job.add(model_name, **kwargs)
+        if g_evals is not None:
+            g_evals.acquire(model_name, job)
+
+    if g_scheduler is not None:
+        g_scheduler.wake()
+    return job
+
+
+def start_batch_predictions():
+    """
+    Start pending batch prediction jobs
+    """
+    global g_batches
+    global g_config
+
+    with g_batches_lock:
+        jobs = list(g_batches.values())
+        g_batches.clear()
+
+    for job in jobs:
+        if job.is_stopped():
+            continue
+        try:
+            job.start(g_config)
+        except errors.LoudMLException as exn:
+            job.error = str(exn)
+            job.set_final_state('failed')
+            logging.error("job[%s] failed: %s", job.id, job.error)
+
 
 class ForecastJob(Job):
     """
@@ -1555,6 +1973,30 @@ class ForecastJob(Job):
     def kwargs(self):
         return self._kwargs
 
+    @property
+    def affinity_key(self):
+        return self.model_name
+
+
+class CompactStorageJob(Job):
+    """
+    Storage compaction job
+    """
+    func = 'compact_storage'
+    job_type = 'compact_storage'
+    job_class = 'io'
+    priority = -1
+
+
+@app.route("/storage/_compact", methods=['POST'])
+@catch_loudml_error
+def storage_compact():
+    global g_config
+
+    job = CompactStorageJob()
+    job.start(g_config)
+    return job_response(job)
+
 
 def _model_start(model, params):
     """
@@ -1567,6 +2009,18 @@ def _model_start(model, params):
 
     params['from'] = 'now-{:.0f}s'.format(model.offset + model.interval)
     params['to'] = 'now-{:.0f}s'.format(model.offset)
+    params['overlap'] = model.eval_overlap
+    phase_key = model.name
+    if g_config.inference['batch_evals']:
+        # Models that read the same data are evaluated together
+        params['batch'] = '{}:{}'.format(
+            model.default_bucket,
+            model.bucket_interval,
+        )
+        phase_key = '{}:{}'.format(params['batch'], model.interval)
+    else:
+        params.pop('batch', None)
+
     request_url = '/models/{}/_eval'.format(model.name)
     add_new_scheduled_job({
         'name': scheduled_job_name,
@@ -1576,6 +2030,8 @@ def _model_start(model, params):
         'every': {
             'count': model.interval,
             'unit': 'seconds',
+            # Spread the evaluations of the models over the interval
+            'phase': get_phase(phase_key, model.interval),
         },
     })
 
@@ -1585,21 +2041,42 @@ def model_eval(model_name):
     global g_storage
     global g_config
 
-    job = PredictionJob(
-        model_name,
+    kwargs = dict(
         save_run_state=False,
         from_date=get_date_arg('from', is_mandatory=True),
         to_date=get_date_arg('to', is_mandatory=True),
         save_prediction=get_bool_arg('save_output_data', default=False),
         output_bucket=request.args.get('output_bucket'),
         detect_anomalies=get_bool_arg('flag_abnormal_data', default=False),
+        incremental=get_bool_arg('incremental', default=False),
     )
-    job.start(g_config)
 
-    if get_bool_arg('bg', default=False):
+    bg = get_bool_arg('bg', default=False)
+    overlap = request.args.get('overlap', 'allow')
+    if overlap not in OVERLAP_POLICIES:
+        raise errors.Invalid("invalid value for parameter 'overlap'")
+
+    if bg and g_evals is not None:
+        job = g_evals.get_overlap(model_name, overlap, kwargs)
+        if job is not None:
+            logging.info("evaluation of model '%s' overlaps job[%s] (%s)",
+                         model_name, job.id, overlap)
+            return jsonify(job.id), 202
+
+    batch = request.args.get('batch')
+    if batch and bg:
+        job = queue_batch_prediction(batch, model_name, **kwargs)
         return jsonify(job.id), 202
 
-    return jsonify(job.result())
+    job = PredictionJob(model_name, **kwargs)
+    if g_evals is not None:
+        g_evals.acquire(model_name, job)
+    try:
+        job.start(g_config)
+    except errors.LoudMLException:
+        release_evals(job, [model_name])
+        raise
+    return job_response(job)
 
 
 @app.route("/models/<model_name>/_top")
@@ -1634,6 +2111,7 @@ def model_start(model_name):
         'save_output_data': get_bool_arg('save_output_data'),
         'output_bucket': request.args.get('output_bucket'),
         'flag_abnormal_data': get_bool_arg('flag_abnormal_data'),
+        'incremental': get_bool_arg('incremental', default=True),
     }
 
     model = g_storage.load_model(model_name)
@@ -1696,11 +2174,7 @@ def model_forecast(model_name):
 
     job = ForecastJob(model.name, **params)
     job.start(g_config)
-
-    if get_bool_arg('bg', default=False):
-        return jsonify(job.id), 202
-
-    return jsonify(job.result())
+    return job_response(job)
 
 #
 # Example of job
@@ -1801,7 +2275,7 @@ def err_internal(e):
 
 
 def setup_scheduled_jobs(config):
-    storage = FileStorage(config.storage['path'])
+    storage = load_storage(config.storage)
     for scheduled_job in config.scheduled_jobs.values():
         undeclared = find_undeclared_variables(scheduled_job)
         if 'model_name' not in undeclared:
@@ -1845,31 +2319,86 @@ def restart_predict_jobs():
 
 def g_app_init(path):
     global g_config
+    global g_evals
     global g_training_pool
-    global g_nice
-    global g_pool
+    global g_io_pool
+    global g_job_queues
+    global g_dispatcher
     global g_queue
     global g_storage
-    global g_timer
+    global g_pump
+    global g_scheduler
+    global g_hub_calls
 
     g_config = loudml.config.load_config(path)
-    g_storage = FileStorage(g_config.storage['path'])
+    g_storage = load_storage(g_config.storage)
     g_queue = multiprocessing.Queue()
-    g_nice = g_config.training.get('nice', 0)
+    g_evals = InFlightEvals(_create_pending_eval)
+    training = g_config.training
+    inference = g_config.inference
+    io = g_config.io
     g_training_pool = pebble.ProcessPool(
-        max_workers=g_config.server.get('workers', 1),
+        max_workers=training['workers'],
         max_tasks=g_config.server.get('maxtasksperchild', 1),
         initializer=loudml.worker.init_worker,
         initargs=[g_queue],
     )
-    g_pool = pebble.ProcessPool(
-        max_workers=g_config.server.get('workers', 1),
+    g_io_pool = pebble.ProcessPool(
+        max_workers=io['workers'],
         max_tasks=g_config.server.get('maxtasksperchild', 1),
         initializer=loudml.worker.init_worker,
         initargs=[g_queue],
     )
-    g_timer = RepeatingTimer(1, read_messages)
-    g_timer.start()
+    # Inference workers are long-lived to keep models loaded in memory.
+    # Each one has its own pool, so that jobs are routed by model.
+    g_dispatcher = Dispatcher(
+        inference['workers'],
+        lambda worker_id: pebble.ProcessPool(
+            max_workers=1,
+            max_tasks=g_config.inference['maxtasksperchild'],
+            initializer=loudml.worker.init_worker,
+            initargs=[g_queue, worker_id],
+        ),
+        spillover=g_config.inference['spillover'],
+    )
+    g_job_queues = {
+        'training': JobQueue(
+            'training',
+            lambda key, func, args, kwargs: g_training_pool.schedule(
+                func, args=args, kwargs=kwargs),
+            training['workers'],
+            max_queue=training['max_queue'],
+            nice=training['nice'],
+        ),
+        # Each lane of the dispatcher runs one job and queues the next ones
+        # up to `spillover`. With this budget, a lane with room is always
+        # available, so that lanes are kept busy and jobs beyond the budget
+        # wait in the queue by order of priority.
+        'inference': JobQueue(
+            'inference',
+            g_dispatcher.schedule,
+            inference['workers'] * g_dispatcher.spillover,
+            max_queue=inference['max_queue'],
+            nice=inference['nice'],
+        ),
+        'io': JobQueue(
+            'io',
+            lambda key, func, args, kwargs: g_io_pool.schedule(
+                func, args=args, kwargs=kwargs),
+            io['workers'],
+            max_queue=io['max_queue'],
+            nice=io['nice'],
+        ),
+    }
+    g_pump = MessagePump(g_queue, {
+        'job_state': on_job_state,
+        'worker_stats': on_worker_stats,
+    })
+    g_pump.start()
+    g_hub_calls = _HubCalls()
+    g_scheduler = Scheduler()
+    g_scheduler.after_run.append(
+        lambda: call_in_hub(start_batch_predictions))
 
     @catch_exceptions(cancel_on_failure=False)
     def daemon_send_metrics():
@@ -1892,28 +2421,38 @@ def g_app_init(path):
         for i in expired:
             del g_jobs[i]
 
-    schedule.every().minute.do(daemon_clear_jobs)
+    schedule.every().minute.do(call_in_hub, daemon_clear_jobs)
+    g_scheduler.start()
 
 
 def g_app_stop():
-    global g_timer
-    global g_pool
+    global g_pump
+    global g_scheduler
+    global g_dispatcher
     global g_training_pool
+    global g_io_pool
+    global g_job_queues
     global g_config
-    global g_nice
     global g_queue
+    global g_hub_calls
 
     schedule.clear('bg')
-    g_timer.cancel()
-    g_pool.stop()
-    g_pool.join()
+    g_hub_calls.close()
+    g_scheduler.stop()
+    g_dispatcher.stop()
+    g_dispatcher.join()
     g_training_pool.stop()
     g_training_pool.join()
+    g_io_pool.stop()
+    g_io_pool.join()
+    g_pump.stop()
     g_config = None
-    g_nice = 0
-    g_pool = None
+    g_job_queues = {}
+    g_dispatcher = None
     g_queue = None
-    g_timer = None
+    g_pump = None
+    g_scheduler = None
+    g_hub_calls = None
 
 
 def main():
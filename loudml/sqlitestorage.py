@@ -0,0 +1,732 @@
+"""
+Loud ML SQLite storage
+
+All models, checkpoints, templates, hooks and model objects are stored in
+a single SQLite database, in WAL mode. Model weights are stored as BLOBs,
+apart from the JSON state.
+"""
+
+import argparse
+import base64
+import contextlib
+import copy
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from . import (
+    errors,
+    schemas,
+)
+from .filestorage import (
+    OBJECT_KEY_SCHEMA,
+)
+from .storage import (
+    Storage,
+)
+
+from dictdiffer import diff
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS models (
+    name TEXT PRIMARY KEY,
+    settings TEXT NOT NULL,
+    current_ckpt TEXT,
+    run_state TEXT,
+    preview TEXT,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    model TEXT NOT NULL REFERENCES models(name) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    state TEXT NOT NULL,
+    weights BLOB,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (model, name)
+);
+CREATE TABLE IF NOT EXISTS templates (
+    name TEXT PRIMARY KEY,
+    settings TEXT NOT NULL,
+    meta TEXT
+);
+CREATE TABLE IF NOT EXISTS hooks (
+    model TEXT NOT NULL REFERENCES models(name) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (model, name)
+);
+CREATE TABLE IF NOT EXISTS objects (
+    model TEXT NOT NULL REFERENCES models(name) ON DELETE CASCADE,
+    key TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (model, key)
+);
+"""
+
+
+class SQLiteStorage(Storage):
+    """
+    SQLite storage
+    """
+
+    def __init__(
+        self,
+        path,
+        filename="loudml.db",
+        max_checkpoints=None,
+        max_checkpoint_age=None,
+    ):
+        """
+        max_checkpoints: number of checkpoints to keep per model
+        max_checkpoint_age: age in seconds after which checkpoints are
+            deleted
+
+        The active checkpoint is always kept.
+        """
+        self.path = path
+        self.max_checkpoints = max_checkpoints
+        self.max_checkpoint_age = max_checkpoint_age
+        self.db_path = os.path.join(path, filename)
+
+        try:
+            os.makedirs(path, exist_ok=True)
+        except OSError as exn:
+            raise errors.LoudMLException(str(exn))
+
+        self._lock = threading.RLock()
+        self._conn = None
+        self._pid = None
+        self._depth = 0
+
+        with self._lock:
+            self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        # Connections cannot be shared with forked worker processes
+        if self._conn is None or self._pid != os.getpid():
+            try:
+                conn = sqlite3.connect(
+                    self.db_path,
+                    isolation_level=None,
+                    check_same_thread=False,
+                )
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute("PRAGMA foreign_keys=ON")
+            except sqlite3.Error as exn:
+                raise errors.LoudMLException(str(exn))
+            self._conn = conn
+            self._pid = os.getpid()
+            self._depth = 0
+        return self._conn
+
+    @contextlib.contextmanager
+    def batch(self, write=True):
+        """
+        Group operations in a single transaction. Nested batches are part
+        of the outermost one.
+        """
+        with self._lock:
+            conn = self._connect()
+            if self._depth == 0:
+                conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            self._depth += 1
+            try:
+                yield conn
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    conn.execute("ROLLBACK")
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                conn.execute("COMMIT")
+
+    def _query(self, sql, args=()):
+        with self._lock:
+            return self._connect().execute(sql, args).fetchall()
+
+    def _query_one(self, sql, args=()):
+        rows = self._query(sql, args)
+        return rows[0] if len(rows) else None
+
+    def _validate_name(self, model_name):
+        schemas.validate(schemas.key, model_name, name='model_name')
+
+    def _get_settings(self, name):
+        row = self._query_one(
+            "SELECT settings FROM models WHERE name = ?", (name,))
+        if row is None:
+            raise errors.ModelNotFound(name=name)
+
+        settings = json.loads(row[0])
+        settings['name'] = name
+        return settings
+
+    def model_exists(self, name):
+        return self._query_one(
+            "SELECT 1 FROM models WHERE name = ?", (name,)) is not None
+
+    def list_models(self):
+        return [
+            row[0]
+            for row in self._query("SELECT name FROM models ORDER BY name")
+        ]
+
+    def list_checkpoints(self, name):
+        return [
+            row[0]
+            for row in self._query(
+                "SELECT name FROM checkpoints WHERE model = ? "
+                "ORDER BY CAST(name AS INTEGER), name",
+                (name,),
+            )
+        ]
+
+    def _next_ckpt_name(self, conn, name):
+        names = [
+            int(row[0])
+            for row in conn.execute(
+                "SELECT name FROM checkpoints WHERE model = ?", (name,))
+            if row[0].isdigit()
+        ]
+        return "{:02d}".format(max(names) + 1 if len(names) else 0)
+
+    def _write_settings(self, conn, model):
+        settings = copy.deepcopy(model.settings)
+        settings.pop('name', None)
+        conn.execute(
+            "INSERT INTO models (name, settings) VALUES (?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET "
+            "settings = excluded.settings, version = version + 1",
+            (model.name, json.dumps(settings)),
+        )
+
+    def _write_state(self, conn, name, ckpt_name, state):
+        if state is None:
+            conn.execute(
+                "DELETE FROM checkpoints WHERE model = ? AND name = ?",
+                (name, ckpt_name),
+            )
+            return
+
+        state = dict(state)
+        weights = state.pop('weights', None)
+        if weights is None and state.get('h5py') is not None:
+            weights = base64.b64decode(state.pop('h5py').encode('utf-8'))
+        if weights is not None:
+            weights = memoryview(weights)
+
+        data = json.dumps(state)
+        size = len(data) + (0 if weights is None else len(weights))
+        conn.execute(
+            "INSERT OR REPLACE INTO checkpoints "
+            "(model, name, state, weights, size, created) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (name, ckpt_name, data, weights, size, time.time()),
+        )
+
+    def _write_preview(self, conn, model):
+        conn.execute(
+            "UPDATE models SET preview = ? WHERE name = ?",
+            (json.dumps(model.preview), model.name),
+        )
+
+    def _clear_run_state(self, conn, name):
+        conn.execute(
+            "UPDATE models SET run_state = NULL, version = version + 1 "
+            "WHERE name = ?",
+            (name,),
+        )
+
+    def _set_current_ckpt(self, conn, name, ckpt_name):
+        if self._get_current_ckpt(conn, name) != ckpt_name:
+            # The run state belongs to the previous checkpoint
+            self._clear_run_state(conn, name)
+
+        conn.execute(
+            "UPDATE models SET current_ckpt = ?, version = version + 1 "
+            "WHERE name = ?",
+            (ckpt_name, name),
+        )
+
+    def _get_current_ckpt(self, conn, name):
+        row = conn.execute(
+            "SELECT current_ckpt FROM models WHERE name = ?",
+            (name,),
+        ).fetchone()
+        if row is None:
+            raise errors.ModelNotFound(name=name)
+        return row[0]
+
+    def create_model(self, model):
+        self._validate_name(model.name)
+        with self.batch() as conn:
+            if self.model_exists(model.name):
+                raise errors.ModelExists()
+            self._write_settings(conn, model)
+            self._write_preview(conn, model)
+
+    def save_model(self, model, save_state=True, save_ckpt=True):
+        self._validate_name(model.name)
+        with self.batch() as conn:
+            try:
+                old_settings = self._get_settings(model.name)
+            except errors.ModelNotFound:
+                old_settings = {'name': model.name}
+
+            self._write_settings(conn, model)
+            if save_state:
+                if save_ckpt:
+                    ckpt_name = self._next_ckpt_name(conn, model.name)
+                    self._write_state(conn, model.name, ckpt_name, model.state)
+                    self._set_current_ckpt(conn, model.name, ckpt_name)
+                    self._prune_checkpoints(conn, model.name)
+                else:
+                    self._save_state(conn, model)
+            self._write_preview(conn, model)
+
+        return diff(old_settings, model.settings, expand=True)
+
+    def _save_state(self, conn, model, ckpt_name=None):
+        current = self._get_current_ckpt(conn, model.name)
+        if ckpt_name is None:
+            ckpt_name = current
+        if ckpt_name is None:
+            ckpt_name = self._next_ckpt_name(conn, model.name)
+            current = ckpt_name
+
+        self._write_state(conn, model.name, ckpt_name, model.state)
+        if ckpt_name == current:
+            # The run state has been saved with the whole state
+            self._clear_run_state(conn, model.name)
+            self._set_current_ckpt(conn, model.name, ckpt_name)
+            self._write_preview(conn, model)
+
+    def save_state(self, model, ckpt_name=None):
+        with self.batch() as conn:
+            self._save_state(conn, model, ckpt_name)
+
+    def save_run_state(self, model):
+        """
+        Save the run state apart from the checkpoint
+        """
+        with self.batch() as conn:
+            ckpt_name = self._get_current_ckpt(conn, model.name)
+            if ckpt_name is None:
+                self._save_state(conn, model)
+                return
+
+            conn.execute(
+                "UPDATE models SET run_state = ?, version = version + 1 "
+                "WHERE name = ?",
+                (json.dumps({
+                    'keys': model.RUN_STATE_KEYS,
+                    'state': model.run_state,
+                }), model.name),
+            )
+
+    def set_current_ckpt(self, model_name, ckpt_name):
+        with self.batch() as conn:
+            self._get_current_ckpt(conn, model_name)
+            self._set_current_ckpt(conn, model_name, ckpt_name)
+
+    def _prune_checkpoints(self, conn, name):
+        """
+        Delete the checkpoints that are not retained, see `max_checkpoints`
+        and `max_checkpoint_age`. Return the number of deleted checkpoints
+        and the number of bytes freed.
+        """
+        if not self.max_checkpoints and not self.max_checkpoint_age:
+            return 0, 0
+
+        current = self._get_current_ckpt(conn, name)
+        rows = sorted(
+            (
+                row
+                for row in conn.execute(
+                    "SELECT name, size, created FROM checkpoints "
+                    "WHERE model = ?",
+                    (name,),
+                )
+                if row[0].isdigit()
+            ),
+            key=lambda row: int(row[0]),
+            reverse=True,
+        )
+        now = time.time()
+
+        deleted = 0
+        freed = 0
+        for i, (ckpt_name, size, created) in enumerate(rows):
+            if ckpt_name == current:
+                continue
+
+            expired = bool(self.max_checkpoints) and i >= self.max_checkpoints
+            if not expired and self.max_checkpoint_age:
+                expired = now - created > self.max_checkpoint_age
+            if not expired:
+                continue
+
+            conn.execute(
+                "DELETE FROM checkpoints WHERE model = ? AND name = ?",
+                (name, ckpt_name),
+            )
+            deleted += 1
+            freed += size
+
+        return deleted, freed
+
+    def compact(self):
+        """
+        Apply the checkpoint retention policy to all models
+        """
+        stats = {
+            'models': 0,
+            'checkpoints': 0,
+            'blobs': 0,
+            'reclaimed_bytes': 0,
+        }
+        for name in self.list_models():
+            try:
+                with self.batch() as conn:
+                    deleted, freed = self._prune_checkpoints(conn, name)
+            except errors.ModelNotFound:
+                continue
+            stats['checkpoints'] += deleted
+            stats['reclaimed_bytes'] += freed
+            stats['models'] += 1
+
+        with self._lock:
+            # Truncate the write-ahead log, freed pages are reused later
+            self._connect().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+        logging.info(
+            "storage compacted: %d checkpoints deleted, %d bytes reclaimed",
+            stats['checkpoints'],
+            stats['reclaimed_bytes'],
+        )
+        return stats
+
+    def get_current_ckpt(self, model_name):
+        row = self._query_one(
+            "SELECT current_ckpt FROM models WHERE name = ?", (model_name,))
+        return None if row is None else row[0]
+
+    def get_model_version(self, name):
+        row = self._query_one(
+            "SELECT m.current_ckpt, m.version, "
+            "length(m.settings) + coalesce(c.size, 0) "
+            "FROM models m LEFT JOIN checkpoints c "
+            "ON c.model = m.name AND c.name = m.current_ckpt "
+            "WHERE m.name = ?",
+            (name,),
+        )
+        if row is None:
+            raise errors.ModelNotFound(name=name)
+        return row[0], row[1], row[2]
+
+    def get_model_data(self, name, ckpt_name=None):
+        with self.batch(write=False) as conn:
+            settings = self._get_settings(name)
+            current, run_state = conn.execute(
+                "SELECT current_ckpt, run_state FROM models WHERE name = ?",
+                (name,),
+            ).fetchone()
+            if ckpt_name is None:
+                ckpt_name = current
+
+            row = conn.execute(
+                "SELECT state, weights FROM checkpoints "
+                "WHERE model = ? AND name = ?",
+                (name, ckpt_name),
+            ).fetchone()
+
+        data = {
+            'settings': settings,
+        }
+        if row is None:
+            # Model is not trained yet
+            return data
+
+        state = json.loads(row[0])
+        if row[1] is not None:
+            state['weights'] = row[1]
+        if run_state is not None and ckpt_name == current:
+            run_state = json.loads(run_state)
+            for key in run_state['keys']:
+                state.pop(key, None)
+            state.update(run_state['state'])
+
+        data['state'] = state
+        return data
+
+    def list_model_previews(self):
+        previews = []
+        for name, preview in self._query(
+            "SELECT name, preview FROM models ORDER BY name"
+        ):
+            if preview is None:
+                # Imported model
+                try:
+                    model = self.load_model(name)
+                except errors.UnsupportedModel:
+                    continue
+                with self.batch() as conn:
+                    self._write_preview(conn, model)
+                previews.append(model.preview)
+            else:
+                previews.append(json.loads(preview))
+        return previews
+
+    def delete_model(self, name):
+        with self.batch() as conn:
+            cursor = conn.execute("DELETE FROM models WHERE name = ?", (name,))
+            if cursor.rowcount == 0:
+                raise errors.ModelNotFound(name=name)
+
+    def import_model(self, settings, checkpoints, current_ckpt=None):
+        """
+        Import a model with all its checkpoints
+
+        checkpoints: dict of states by checkpoint name
+        """
+        name = settings['name']
+        self._validate_name(name)
+        settings = copy.deepcopy(settings)
+        settings.pop('name', None)
+        with self.batch() as conn:
+            conn.execute("DELETE FROM models WHERE name = ?", (name,))
+            conn.execute(
+                "INSERT INTO models (name, settings, current_ckpt) "
+                "VALUES (?, ?, ?)",
+                (name, json.dumps(settings), current_ckpt),
+            )
+            for ckpt_name, state in checkpoints.items():
+                self._write_state(conn, name, ckpt_name, state)
+
+    def template_exists(self, name):
+        return self._query_one(
+            "SELECT 1 FROM templates WHERE name = ?", (name,)) is not None
+
+    def get_template_data(self, name):
+        row = self._query_one(
+            "SELECT settings, meta FROM templates WHERE name = ?", (name,))
+        if row is None:
+            raise errors.ModelNotFound(name=name)
+
+        data = {
+            'settings': json.loads(row[0]),
+            'name': name,
+        }
+        if row[1] is not None:
+            data.update(json.loads(row[1]))
+        return data
+
+    def list_templates(self):
+        return [
+            row[0]
+            for row in self._query(
+                "SELECT name FROM templates ORDER BY name")
+        ]
+
+    def create_template(self, template):
+        self.import_template(template.name, template.settings)
+
+    def import_template(self, name, settings, meta=None):
+        with self.batch() as conn:
+            if self.template_exists(name):
+                raise errors.TemplateExists()
+            conn.execute(
+                "INSERT INTO templates (name, settings, meta) "
+                "VALUES (?, ?, ?)",
+                (name, json.dumps(settings),
+                 None if meta is None else json.dumps(meta)),
+            )
+
+    def delete_template(self, name):
+        with self.batch() as conn:
+            cursor = conn.execute(
+                "DELETE FROM templates WHERE name = ?", (name,))
+            if cursor.rowcount == 0:
+                raise errors.TemplateNotFound(name=name)
+
+    def list_model_hooks(self, model_name):
+        """List model hooks"""
+        return [
+            row[0]
+            for row in self._query(
+                "SELECT name FROM hooks WHERE model = ? ORDER BY name",
+                (model_name,),
+            )
+        ]
+
+    def get_model_hook(self, model_name, hook_name):
+        """Get model hook"""
+        row = self._query_one(
+            "SELECT data FROM hooks WHERE model = ? AND name = ?",
+            (model_name, hook_name),
+        )
+        if row is None:
+            raise errors.NotFound("hook not found")
+        return json.loads(row[0])
+
+    def set_model_hook(self, model_name, hook_name, hook_type, config):
+        """Set model hook"""
+        schemas.validate(schemas.key, hook_name)
+        with self.batch() as conn:
+            if not self.model_exists(model_name):
+                raise errors.ModelNotFound(name=model_name)
+            conn.execute(
+                "INSERT OR REPLACE INTO hooks (model, name, data) "
+                "VALUES (?, ?, ?)",
+                (model_name, hook_name, json.dumps({
+                    'type': hook_type,
+                    'config': config,
+                })),
+            )
+
+    def delete_model_hook(self, model_name, hook_name):
+        """Delete model hook"""
+        with self.batch() as conn:
+            cursor = conn.execute(
+                "DELETE FROM hooks WHERE model = ? AND name = ?",
+                (model_name, hook_name),
+            )
+            if cursor.rowcount == 0:
+                raise errors.NotFound("hook not found")
+
+    def list_model_objects(self, model_name):
+        """List model objects"""
+        return [
+            row[0]
+            for row in self._query(
+                "SELECT key FROM objects WHERE model = ? ORDER BY key",
+                (model_name,),
+            )
+        ]
+
+    def set_model_object(self, model_name, key, data):
+        """Save model object"""
+        schemas.validate(OBJECT_KEY_SCHEMA, key)
+        with self.batch() as conn:
+            if not self.model_exists(model_name):
+                raise KeyError("model object not found")
+            conn.execute(
+                "INSERT OR REPLACE INTO objects (model, key, data) "
+                "VALUES (?, ?, ?)",
+                (model_name, key, json.dumps(data)),
+            )
+
+    def get_model_object(self, model_name, key):
+        """Get model object"""
+        schemas.validate(OBJECT_KEY_SCHEMA, key)
+        row = self._query_one(
+            "SELECT data FROM objects WHERE model = ? AND key = ?",
+            (model_name, key),
+        )
+        if row is None:
+            raise KeyError("model object not found")
+        return json.loads(row[0])
+
+    def delete_model_object(self, model_name, key):
+        """Delete model object"""
+        schemas.validate(OBJECT_KEY_SCHEMA, key)
+        with self.batch() as conn:
+            cursor = conn.execute(
+                "DELETE FROM objects WHERE model = ? AND key = ?",
+                (model_name, key),
+            )
+            if cursor.rowcount == 0:
+                raise KeyError("model object not found")
+
+
+def migrate_storage(src, dst):
+    """
+    Copy templates and models, with their checkpoints, hooks and objects,
+    from `src` to a SQLite storage
+    """
+    nb_models = 0
+    with dst.batch():
+        for name in src.list_templates():
+            data = src.get_template_data(name)
+            settings = data.pop('settings')
+            data.pop('name', None)
+            if dst.template_exists(name):
+                dst.delete_template(name)
+            dst.import_template(name, settings, meta=data or None)
+
+        for name in src.list_models():
+            logging.info("migrating model '%s'", name)
+            data = src.get_model_data(name)
+            current = src.get_current_ckpt(name)
+            checkpoints = {
+                ckpt_name: src.get_model_data(name, ckpt_name).get('state')
+                for ckpt_name in src.list_checkpoints(name)
+            }
+            if current is not None:
+                # Including the run state
+                checkpoints[current] = data.get('state')
+            dst.import_model(
+                data['settings'],
+                {
+                    ckpt_name: state
+                    for ckpt_name, state in checkpoints.items()
+                    if state is not None
+                },
+                current,
+            )
+
+            for hook_name in src.list_model_hooks(name):
+                hook = src.get_model_hook(name, hook_name)
+                dst.set_model_hook(
+                    name, hook_name, hook['type'], hook.get('config'))
+
+            for key in src.list_model_objects(name):
+                dst.set_model_object(
+                    name, key, src.get_model_object(name, key))
+
+            nb_models += 1
+
+    return nb_models
+
+
+def main():
+    """
+    Migrate Loud ML models from file storage to SQLite storage
+    """
+    from .filestorage import FileStorage
+
+    parser = argparse.ArgumentParser(
+        description=main.__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        'src',
+        help="Path of the file storage",
+        type=str,
+    )
+    parser.add_argument(
+        'dst',
+        help="Path of the SQLite storage",
+        type=str,
+    )
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO)
+
+    try:
+        nb_models = migrate_storage(
+            FileStorage(args.src),
+            SQLiteStorage(args.dst),
+        )
+    except errors.LoudMLException as exn:
+        logging.error(exn)
+        sys.exit(1)
+
+    logging.info("%d models migrated", nb_models)
@@ -12,6 +12,7 @@ from abc import (
 from .misc import (
     load_hook,
     find_undeclared_variables,
+    parse_timedelta,
 )
 from .model import (
     load_model,
@@ -39,6 +40,16 @@ class Storage(metaclass=ABCMeta):
     def list_models(self):
         """List models"""
 
+    def list_model_previews(self):
+        """List model previews, see `Model.preview`"""
+        previews = []
+        for name in self.list_models():
+            try:
+                previews.append(self.load_model(name).preview)
+            except errors.UnsupportedModel:
+                continue
+        return previews
+
     @abstractmethod
     def list_checkpoints(self, model_name):
         """List model checkpoints"""
@@ -64,6 +75,13 @@ class Storage(metaclass=ABCMeta):
     def save_state(self, model, ckpt_name=None):
         """Save model state"""
 
+    def save_run_state(self, model):
+        """
+        Save the state fields updated at each evaluation, see
+        `Model.RUN_STATE_KEYS`. The whole state is saved by default.
+        """
+        self.save_state(model)
+
     @abstractmethod
     def set_current_ckpt(self, model_name, ckpt_name):
         """Set active checkpoint"""
@@ -77,6 +95,20 @@ class Storage(metaclass=ABCMeta):
         model_data = self.get_model_data(name, ckpt_name)
         return load_model(**model_data)
 
+    def get_model_version(self, name):
+        """
+        Get a (ckpt_name, stamp, size) tuple that changes whenever the
+        stored model is modified, or None if the storage cannot tell.
+        `size` is the size of the stored model in bytes.
+        """
+        return None
+
+    def compact(self):
+        """
+        Delete the data that is not retained anymore and return statistics
+        """
+        raise NotImplementedError()
+
     @abstractmethod
     def template_exists(self, name):
         """Tell if a model template exists"""
@@ -155,6 +187,10 @@ class Storage(metaclass=ABCMeta):
 
         return hooks
 
+    def list_model_objects(self, model_name):
+        """List model objects"""
+        raise NotImplementedError()
+
     def set_model_object(self, model_name, key, data):
         """Save model object"""
         raise NotImplementedError()
@@ -166,3 +202,30 @@ class Storage(metaclass=ABCMeta):
     def delete_model_object(self, model_name, key):
         """Delete model object"""
         raise NotImplementedError()
+
+
+def load_storage(settings):
+    """
+    Load storage
+    """
+    from loudml import load_entry_point
+
+    storage_type = settings.get('type', 'file')
+
+    storage_cls = load_entry_point('loudml.storages', storage_type)
+    if storage_cls is None:
+        raise errors.UnsupportedStorage(storage_type)
+
+    max_checkpoint_age = settings.get('max_checkpoint_age')
+    if max_checkpoint_age is not None:
+        max_checkpoint_age = parse_timedelta(
+            max_checkpoint_age,
+            min=0,
+            min_included=False,
+        ).total_seconds()
+
+    return storage_cls(
+        settings['path'],
+        max_checkpoints=settings.get('max_checkpoints'),
+        max_checkpoint_age=max_checkpoint_age,
+    )
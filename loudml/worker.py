@@ -14,8 +14,14 @@ from loudml import (
     errors,
 )
 
-from loudml.filestorage import (
-    FileStorage,
+from loudml.storage import (
+    load_storage,
+)
+from loudml.modelcache import (
+    ModelCache,
+)
+from loudml.pump import (
+    make_message,
 )
 
 g_worker = None
@@ -26,8 +32,11 @@ class Worker:
     Loud ML worker
     """
 
-    def __init__(self, msg_queue):
+    def __init__(self, msg_queue, worker_id=None):
         self.storage = None
+        self.storage_settings = None
+        self.models = None
+        self.worker_id = worker_id
         self._msg_queue = msg_queue
         self.job_id = None
         signal.signal(signal.SIGINT, signal.SIG_IGN)
@@ -37,15 +46,15 @@ class Worker:
         Run requested task and return the result
         """
 
-        self._msg_queue.put({
-            'type': 'job_state',
-            'job_id': job_id,
-            'state': 'running',
-        })
+        self._msg_queue.put(make_message(
+            'job_state',
+            job_id=job_id,
+            state='running',
+        ))
         logging.info("job[%s] starting, nice=%d", job_id, nice)
         self.job_id = job_id
         self.config = config
-        self.storage = FileStorage(config.storage['path'])
+        self._init_storage(config)
         curnice = os.nice(0)
         os.nice(int(nice) - curnice)
 
@@ -59,10 +68,45 @@ class Worker:
         finally:
             self.job_id = None
             self.config = None
-            self.storage = None
+            self._send_stats()
 
         return res
 
+    def _send_stats(self):
+        """
+        Report model cache statistics to the dispatcher
+        """
+        if self.worker_id is None or self.models is None:
+            return
+
+        self._msg_queue.put(make_message(
+            'worker_stats',
+            worker_id=self.worker_id,
+            cache=self.models.stats,
+        ))
+
+    def _init_storage(self, config):
+        """
+        Open the storage, or reuse the one opened by a previous job along
+        with the cached models
+        """
+        settings = config.storage
+        if self.storage is None or self.storage_settings != settings:
+            self.storage = load_storage(settings)
+            self.storage_settings = settings
+            if self.models is not None:
+                self.models.clear()
+
+        inference = config.inference
+        if self.models is None:
+            self.models = ModelCache(
+                max_models=inference['model_cache_size'],
+                max_bytes=inference['model_cache_max_bytes'],
+            )
+        else:
+            self.models.max_models = inference['model_cache_size']
+            self.models.max_bytes = inference['model_cache_max_bytes']
+
     def train(self, model_name, bucket=None, **kwargs):
         """
         Train model
@@ -75,15 +119,15 @@ class Worker:
         bucket = loudml.bucket.load_bucket(bucket_settings)
 
         def progress_cb(current_eval, max_evals):
-            self._msg_queue.put({
-                'type': 'job_state',
-                'job_id': self.job_id,
-                'state': 'running',
-                'progress': {
+            self._msg_queue.put(make_message(
+                'job_state',
+                job_id=self.job_id,
+                state='running',
+                progress={
                     'eval': current_eval,
                     'max_evals': max_evals,
                 },
-            })
+            ))
         windows = bucket.list_anomalies(
             kwargs['from_date'],
             kwargs['to_date'],
@@ -96,6 +140,7 @@ class Worker:
             num_epochs=num_epochs,
             num_cpus=self.config.training['num_cpus'],
             num_gpus=self.config.training['num_gpus'],
+            parallel_trials=self.config.training['parallel_trials'],
             progress_cb=progress_cb,
             windows=windows,
             **kwargs
@@ -215,6 +260,12 @@ class Worker:
 
         bucket.commit()
 
+    def compact_storage(self):
+        """
+        Delete old checkpoints and unreferenced model weights
+        """
+        return self.storage.compact()
+
     def predict(
         self,
         model_name,
@@ -222,24 +273,33 @@ class Worker:
         save_prediction=False,
         detect_anomalies=False,
         output_bucket=None,
+        incremental=False,
+        bucket=None,
         **kwargs
     ):
         """
         Ask model for a prediction
+
+        If `incremental` is set, the evaluation state of the previous call
+        is reused and saved for the next one, and buckets already evaluated
+        by the previous call are skipped, see `DonutModel.predict2()`.
+        `bucket` replaces the default bucket of the model.
         """
 
-        model = self.storage.load_model(model_name)
-        bucket_settings = self.config.get_bucket(model.default_bucket)
-        bucket = loudml.bucket.load_bucket(bucket_settings)
+        model = self.models.get(self.storage, model_name)
+        if bucket is None:
+            bucket_settings = self.config.get_bucket(model.default_bucket)
+            bucket = loudml.bucket.load_bucket(bucket_settings)
 
         if model.type in ['timeseries', 'donut']:
             _state = model.get_run_state()
-            if detect_anomalies:
+            if incremental:
                 prediction = model.predict2(
                     bucket,
                     _state=_state,
                     num_cpus=self.config.inference['num_cpus'],
                     num_gpus=self.config.inference['num_gpus'],
+                    backend=self.config.inference['backend'],
                     **kwargs
                 )
             else:
@@ -247,6 +307,7 @@ class Worker:
                     bucket,
                     num_cpus=self.config.inference['num_cpus'],
                     num_gpus=self.config.inference['num_gpus'],
+                    backend=self.config.inference['backend'],
                     **kwargs
                 )
 
@@ -258,9 +319,13 @@ class Worker:
                     bucket,
                 )
                 model.detect_anomalies(prediction, hooks)
-            if save_run_state:
+            if save_run_state or incremental:
                 model.set_run_state(_state)
-                self.storage.save_state(model)
+                self.storage.save_run_state(model)
+                self.models.refresh(self.storage, model)
+            elif detect_anomalies:
+                # Anomaly state has only been updated in memory
+                self.models.discard(model_name)
             if save_prediction:
                 self._save_timeseries_prediction(
                     model,
@@ -281,6 +346,96 @@ class Worker:
         else:
             logging.info("job[%s] prediction done", self.job_id)
 
+    def _prefetch(self, bucket, models, evals):
+        """
+        Read the data of several predictions with a single query
+        """
+        bucket_interval = models[0].bucket_interval
+        features = []
+        from_ts = None
+        to_ts = None
+
+        for model, kwargs in zip(models, evals):
+            hist = model.get_history_range(
+                kwargs['from_date'],
+                kwargs['to_date'],
+            )
+            features += model.features
+            from_ts = hist.from_ts if from_ts is None \
+                else min(from_ts, hist.from_ts)
+            to_ts = hist.to_ts if to_ts is None else max(to_ts, hist.to_ts)
+
+        try:
+            bucket.prefetch(bucket_interval, features, from_ts, to_ts)
+        except errors.LoudMLException as exn:
+            # Each prediction will send its own query
+            logging.error("job[%s] cannot prefetch data from bucket '%s': %s",
+                          self.job_id, bucket.name, exn)
+
+    def predict_batch(self, evals):
+        """
+        Ask several models for a prediction
+
+        The models that read the same bucket with the same bucket interval
+        share a single query. Return the result of each prediction, or its
+        error, by model name.
+        """
+        results = {}
+        groups = {}
+
+        for kwargs in evals:
+            model_name = kwargs['model_name']
+            try:
+                model = self.models.get(self.storage, model_name)
+            except errors.LoudMLException as exn:
+                results[model_name] = {'error': str(exn)}
+                continue
+
+            key = (
+                model.default_bucket,
+                getattr(model, 'bucket_interval', None),
+            )
+            groups.setdefault(key, []).append((model, kwargs))
+
+        for (bucket_name, _), group in groups.items():
+            try:
+                bucket = loudml.bucket.PrefetchedBucket(
+                    loudml.bucket.load_bucket(
+                        self.config.get_bucket(bucket_name)),
+                )
+            except errors.LoudMLException as exn:
+                for model, _ in group:
+                    results[model.name] = {'error': str(exn)}
+                continue
+
+            models, group_evals = zip(*group)
+            if len(group) > 1 and all(
+                hasattr(model, 'get_history_range') for model in models
+            ):
+                self._prefetch(bucket, models, group_evals)
+
+            for kwargs in group_evals:
+                kwargs = dict(kwargs)
+                model_name = kwargs.pop('model_name')
+                try:
+                    results[model_name] = self.predict(
+                        model_name,
+                        bucket=bucket,
+                        **kwargs
+                    )
+                except Exception as exn:
+                    logging.error(
+                        "job[%s] prediction of model '%s' failed: %s",
+                        self.job_id, model_name, exn,
+                    )
+                    results[model_name] = {'error': str(exn)}
+
+            logging.info("job[%s] %d predictions read bucket '%s' with %d "
+                         "queries", self.job_id, len(group), bucket_name,
+                         bucket.queries)
+
+        return results
+
     def forecast(
         self,
         model_name,
@@ -292,7 +447,7 @@ class Worker:
         Ask model for a forecast
         """
 
-        model = self.storage.load_model(model_name)
+        model = self.models.get(self.storage, model_name)
         bucket_settings = self.config.get_bucket(model.default_bucket)
         bucket = loudml.bucket.load_bucket(bucket_settings)
 
@@ -302,6 +457,7 @@ class Worker:
             bucket,
             num_cpus=self.config.inference['num_cpus'],
             num_gpus=self.config.inference['num_gpus'],
+            backend=self.config.inference['backend'],
             **kwargs
         )
 
@@ -341,9 +497,9 @@ class Worker:
     """
 
 
-def init_worker(msg_queue):
+def init_worker(msg_queue, worker_id=None):
     global g_worker
-    g_worker = Worker(msg_queue)
+    g_worker = Worker(msg_queue, worker_id)
 
 
 def run(job_id, nice, func_name, *args, **kwargs):
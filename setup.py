@@ -91,6 +91,7 @@ setup(
     entry_points={
         'console_scripts': [
             'loudmld=loudml.server:main',
+            'loudml-migrate-storage=loudml.sqlitestorage:main',
         ],
     },
 )
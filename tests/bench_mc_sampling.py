@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark MC sampling schemes used for Donut confidence bands
+
+For each scheme and sample count, the std of the last bucket of decoded
+windows is compared to a reference computed with many random samples.
+The decoder has random weights, so that no trained model is required.
+
+Usage: python3 tests/bench_mc_sampling.py [--latent-dim 3] [--span 20]
+"""
+
+from loudml.npvae import (
+    MC_SAMPLING,
+    DenseLayer,
+    NumpyDonut,
+    mc_noise,
+    weighted_std,
+)
+
+import argparse
+import time
+
+import numpy as np
+
+
+def build_model(W, intermediate_dim, latent_dim):
+    def dense(name, n_in, n_out, activation):
+        return DenseLayer(
+            name,
+            np.random.normal(scale=1 / np.sqrt(n_in), size=(n_in, n_out)),
+            np.random.normal(scale=0.1, size=(n_out,)),
+            activation,
+        )
+
+    return NumpyDonut(
+        encoder=[
+            dense('dense', W, intermediate_dim, 'relu'),
+            dense('dense_1', intermediate_dim, intermediate_dim, 'relu'),
+        ],
+        z_mean=dense('z_mean', intermediate_dim, latent_dim, 'linear'),
+        z_log_var=dense('z_log_var', intermediate_dim, latent_dim, 'linear'),
+        decoder=[
+            dense('decoder_dense_0', latent_dim, intermediate_dim, 'relu'),
+            dense('decoder_dense_1', intermediate_dim,
+                  intermediate_dim, 'relu'),
+            dense('decoder_dense_2', intermediate_dim, W, 'linear'),
+        ],
+    )
+
+
+def mc_std(model, z_mean, z_log_var, count, sampling):
+    rows, dim = z_mean.shape
+    noise, weights = mc_noise(rows, count, dim, sampling)
+    Z = z_mean[:, np.newaxis] + np.exp(0.5 * z_log_var)[:, np.newaxis] * noise
+    x_decoded = model.decode(Z.reshape((-1, dim)), last_only=True)
+    return weighted_std(x_decoded[:, -1].reshape((rows, -1)), weights)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--span', type=int, default=20)
+    parser.add_argument('--latent-dim', type=int, default=3)
+    parser.add_argument('--intermediate-dim', type=int, default=20)
+    parser.add_argument('--windows', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--reference-count', type=int, default=100000)
+    parser.add_argument(
+        '--counts',
+        type=lambda arg: [int(count) for count in arg.split(',')],
+        default=[16, 32, 64, 128, 256, 1000],
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    np.random.seed(args.seed)
+    model = build_model(args.span, args.intermediate_dim, args.latent_dim)
+
+    x = np.random.normal(size=(args.windows, args.span))
+    z_mean, z_log_var = model.encode(x)
+
+    reference = np.array([
+        mc_std(model, z_mean[i:i + 1], z_log_var[i:i + 1],
+               args.reference_count, 'random')[0]
+        for i in range(args.windows)
+    ])
+
+    print("relative band error (mean over {} windows x {} runs)".format(
+        args.windows, args.repeat))
+    print("{:>14} {:>7} {:>10} {:>10} {:>10}".format(
+        "sampling", "count", "mean", "p95", "time(ms)"))
+
+    for sampling in MC_SAMPLING:
+        counts = [None] if sampling == 'sigma_points' else args.counts
+        for count in counts:
+            errors = []
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                std = mc_std(model, z_mean, z_log_var, count, sampling)
+                errors.append(np.abs(std - reference) / reference)
+            duration = (time.perf_counter() - start) / args.repeat
+            errors = np.concatenate(errors)
+            print("{:>14} {:>7} {:>10.4f} {:>10.4f} {:>10.2f}".format(
+                sampling,
+                2 * args.latent_dim + 1 if count is None else count,
+                np.mean(errors),
+                np.percentile(errors, 95),
+                duration * 1000,
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the dispatch of scheduled jobs
+
+Each tick of a scheduled job calls an endpoint of the server, either
+in-process or through an HTTP request to the loopback interface. The
+overhead per call is reported for both.
+
+Usage: python3 tests/bench_scheduled_jobs.py [--count 1000]
+"""
+
+from loudml import (
+    config,
+    server,
+)
+
+import argparse
+import logging
+import os
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+
+def timeit(func, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        status_code, _ = func('get', '/scheduled_jobs')
+        assert status_code == 200
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--port', type=int, default=18077)
+    args = parser.parse_args()
+
+    logging.getLogger('werkzeug').disabled = True
+
+    server.g_config = config.load_config(
+        os.path.join(os.path.dirname(__file__), '..', 'examples', 'config.yml')
+    )
+    server.g_config._server['listen'] = 'localhost:{}'.format(args.port)
+
+    httpd = make_server('localhost', args.port, server.app, threaded=True)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        for name, func in [
+            ('http', server.dispatch_http_request),
+            ('in-process', server.dispatch_local_request),
+        ]:
+            # Warm up
+            timeit(func, 10)
+            duration = timeit(func, args.count)
+            print("{:12} {:8.3f} ms/call".format(name, duration * 1e3))
+    finally:
+        httpd.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+"""
+Load test of a running Loud ML server
+
+Synchronous `_eval` requests are kept in flight for a trained model while
+`GET /models` is timed. The read latency must not depend on the number of
+pending evaluations: the server waits for job results without blocking
+the other requests.
+
+Usage: python3 tests/bench_server.py --model <name> [--addr localhost:8077]
+"""
+
+import argparse
+import concurrent.futures
+import threading
+import time
+
+import requests
+
+
+def percentile(values, ratio):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+def time_reads(base_url, count):
+    durations = []
+    session = requests.Session()
+    for _ in range(count):
+        start = time.perf_counter()
+        session.get(base_url + '/models').raise_for_status()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def run_evals(base_url, args, stop):
+    session = requests.Session()
+    results = {'done': 0, 'accepted': 0, 'failed': 0}
+    while not stop.is_set():
+        response = session.post(
+            '{}/models/{}/_eval'.format(base_url, args.model),
+            params={
+                'from': args.from_date,
+                'to': args.to_date,
+                'timeout': args.timeout,
+            },
+        )
+        if response.status_code == 200:
+            results['done'] += 1
+        elif response.status_code == 202:
+            results['accepted'] += 1
+        else:
+            results['failed'] += 1
+    return results
+
+
+def report(name, durations):
+    print("{:24} p50 {:8.1f} ms   p99 {:8.1f} ms   max {:8.1f} ms".format(
+        name,
+        percentile(durations, 0.5) * 1e3,
+        percentile(durations, 0.99) * 1e3,
+        max(durations) * 1e3,
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument('--addr', type=str, default="localhost:8077")
+    parser.add_argument('--model', type=str, required=True)
+    parser.add_argument('--from', dest='from_date', default="now-1d")
+    parser.add_argument('--to', dest='to_date', default="now")
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--reads', type=int, default=200)
+    parser.add_argument('--timeout', type=str, default="30s")
+    args = parser.parse_args()
+
+    base_url = 'http://{}'.format(args.addr)
+
+    report("idle", time_reads(base_url, args.reads))
+
+    stop = threading.Event()
+    with concurrent.futures.ThreadPoolExecutor(args.concurrency) as pool:
+        futures = [
+            pool.submit(run_evals, base_url, args, stop)
+            for _ in range(args.concurrency)
+        ]
+        # Let the evaluations pile up
+        time.sleep(1)
+        try:
+            durations = time_reads(base_url, args.reads)
+        finally:
+            stop.set()
+
+        totals = {'done': 0, 'accepted': 0, 'failed': 0}
+        for future in futures:
+            for key, value in future.result().items():
+                totals[key] += value
+
+    report("{} evals in flight".format(args.concurrency), durations)
+    print("evals: {done} done, {accepted} accepted (timeout), "
+          "{failed} failed".format(**totals))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark model storage backends
+
+A fleet of trained models is created in file and SQLite storage, then
+the operations done by the server and the workers are timed: listing
+models, loading a model and saving its run state after an evaluation.
+
+Usage: python3 tests/bench_storage.py [--models 1000] [--weights-size 65536]
+"""
+
+from loudml.donut import DonutModel
+from loudml.filestorage import FileStorage
+from loudml.sqlitestorage import SQLiteStorage
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+FEATURES = [
+    {
+        'name': 'avg_foo',
+        'metric': 'avg',
+        'field': 'foo',
+        'default': 0,
+    },
+]
+
+
+def build_model(name, weights):
+    return DonutModel(dict(
+        name=name,
+        offset=30,
+        span=5,
+        bucket_interval=60,
+        interval=60,
+        features=FEATURES,
+        max_threshold=70,
+        min_threshold=60,
+    ), state={
+        'weights': weights,
+        'means': [0.0],
+        'loss': 0.5,
+    })
+
+
+def timeit(func, count=1):
+    start = time.perf_counter()
+    for i in range(count):
+        func(i)
+    return (time.perf_counter() - start) / count
+
+
+def run(args, storage):
+    weights = os.urandom(args.weights_size)
+    names = ["model-{}".format(i) for i in range(args.models)]
+    results = {}
+
+    results['create'] = timeit(
+        lambda i: storage.save_model(build_model(names[i], weights)),
+        args.models,
+    )
+    results['list'] = timeit(lambda i: storage.list_model_previews(), 5)
+    results['load'] = timeit(
+        lambda i: storage.load_model(names[i % args.models]),
+        args.iterations,
+    )
+
+    model = storage.load_model(names[0])
+
+    def save_run_state(i):
+        model.set_run_state({'to_ts': i})
+        storage.save_run_state(model)
+
+    results['save_run_state'] = timeit(save_run_state, args.iterations)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument('--models', type=int, default=1000)
+    parser.add_argument('--weights-size', type=int, default=65536)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    logging.getLogger('tensorflow').disabled = True
+
+    for name, storage_cls in [
+        ('file', FileStorage),
+        ('sqlite', SQLiteStorage),
+    ]:
+        with tempfile.TemporaryDirectory() as tmp:
+            results = run(args, storage_cls(tmp))
+
+        for op, duration in sorted(results.items()):
+            print("{:8} {:16} {:10.3f} ms".format(name, op, duration * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark Donut training throughput
+
+Training batches are drawn with `generator()` and fed to
+`train_on_batch()`. MCMC imputation runs either in the TF graph or from
+Python. Throughput is reported in samples per second.
+
+Usage: python3 tests/bench_training.py [--span 100] [--batch-size 256]
+"""
+
+from loudml.donut import (
+    _build_keras_model,
+    generator,
+)
+
+import argparse
+import logging
+import time
+
+import numpy as np
+
+from tensorflow.contrib.keras.api.keras import backend as K
+
+
+def run(args, x, missing, in_graph):
+    K.clear_session()
+    keras_model = _build_keras_model(
+        args.span, args.intermediate_dim, args.latent_dim)
+    batches = generator(
+        x,
+        missing,
+        args.batch_size,
+        keras_model,
+        in_graph=in_graph,
+    )
+
+    # Warm up
+    inputs, _ = next(batches)
+    keras_model.train_on_batch(inputs, None)
+
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        inputs, _ = next(batches)
+        keras_model.train_on_batch(inputs, None)
+    duration = time.perf_counter() - start
+
+    return args.steps * args.batch_size / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--span', type=int, default=100)
+    parser.add_argument('--latent-dim', type=int, default=5)
+    parser.add_argument('--intermediate-dim', type=int, default=100)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--windows', type=int, default=100000)
+    parser.add_argument('--steps', type=int, default=200)
+    parser.add_argument('--missing-rate', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    logging.getLogger('tensorflow').disabled = True
+    np.random.seed(args.seed)
+
+    series = np.sin(np.arange(args.windows + args.span) * 2 * np.pi / 288)
+    series += np.random.normal(scale=0.1, size=len(series))
+    series[np.random.random(len(series)) < args.missing_rate] = np.nan
+
+    windows = np.lib.stride_tricks.as_strided(
+        series,
+        shape=(args.windows, args.span),
+        strides=(series.strides[0], series.strides[0]),
+        writeable=False,
+    )
+    missing = np.isnan(windows)
+    x = np.where(missing, 0, windows)
+
+    print("{:>10} {:>14}".format("mcmc", "samples/sec"))
+    for in_graph in [False, True]:
+        print("{:>10} {:>14.0f}".format(
+            "graph" if in_graph else "python",
+            run(args, x, missing, in_graph),
+        ))
+
+
+if __name__ == '__main__':
+    main()
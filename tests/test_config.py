@@ -7,3 +7,17 @@ class TestConfig(unittest.TestCase):
     def test_default_config(self):
         c = Config({})
         self.assertTrue(c.metrics['enable'])
+        # All checkpoints are kept unless retention is configured
+        self.assertFalse(c.storage['max_checkpoints'])
+
+    def test_job_classes(self):
+        c = Config({
+            'server': {'workers': 8},
+            'inference': {'workers': 2},
+        })
+        self.assertEqual(c.training['workers'], 8)
+        self.assertEqual(c.training['nice'], 5)
+        self.assertEqual(c.inference['workers'], 2)
+        self.assertEqual(c.inference['nice'], 0)
+        self.assertEqual(c.io['workers'], 2)
+        self.assertEqual(c.io['max_queue'], 256)
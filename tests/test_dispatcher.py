@@ -0,0 +1,88 @@
+from loudml.dispatcher import Dispatcher
+
+import concurrent.futures
+import unittest
+
+
+class FakePool:
+    def __init__(self, worker_id):
+        self.worker_id = worker_id
+        self.futures = []
+
+    def schedule(self, func, args=None, kwargs=None):
+        future = concurrent.futures.Future()
+        self.futures.append(future)
+        return future
+
+    def complete(self):
+        for future in self.futures:
+            if not future.done():
+                future.set_result(None)
+
+
+class TestDispatcher(unittest.TestCase):
+    def setUp(self):
+        self.pools = []
+
+        def create_pool(worker_id):
+            pool = FakePool(worker_id)
+            self.pools.append(pool)
+            return pool
+
+        self.dispatcher = Dispatcher(4, create_pool, spillover=2)
+
+    def test_affinity(self):
+        lanes = self.dispatcher.get_lanes('model-1')
+        self.assertEqual(sorted(lanes), [0, 1, 2, 3])
+        self.assertEqual(self.dispatcher.get_lanes('model-1'), lanes)
+
+        for _ in range(10):
+            self.dispatcher.schedule('model-1', None)
+            self.pools[lanes[0]].complete()
+
+        desc = self.dispatcher.desc
+        self.assertEqual(len(self.pools[lanes[0]].futures), 10)
+        self.assertEqual(desc[lanes[0]]['jobs'], 10)
+        self.assertEqual(desc[lanes[0]]['affine_jobs'], 10)
+        self.assertEqual(desc[lanes[0]]['queue_depth'], 0)
+
+        # Models are spread over workers
+        used = {
+            self.dispatcher.get_lanes('model-{}'.format(i))[0]
+            for i in range(100)
+        }
+        self.assertEqual(used, {0, 1, 2, 3})
+
+    def test_spillover(self):
+        lanes = self.dispatcher.get_lanes('model-1')
+        for _ in range(3):
+            self.dispatcher.schedule('model-1', None)
+
+        desc = self.dispatcher.desc
+        self.assertEqual(desc[lanes[0]]['queue_depth'], 2)
+        self.assertEqual(desc[lanes[1]]['queue_depth'], 1)
+        self.assertEqual(desc[lanes[1]]['spilled_jobs'], 1)
+
+        # Back to the preferred worker once it is not busy anymore
+        self.pools[lanes[0]].complete()
+        self.dispatcher.schedule('model-1', None)
+        self.assertEqual(self.dispatcher.desc[lanes[0]]['queue_depth'], 1)
+
+        # All busy: least loaded worker
+        for _ in range(8):
+            self.dispatcher.schedule('model-1', None)
+        depths = [lane['queue_depth'] for lane in self.dispatcher.desc]
+        self.assertLessEqual(max(depths) - min(depths), 1)
+
+    def test_no_key(self):
+        for _ in range(8):
+            self.dispatcher.schedule(None, None)
+        depths = [lane['queue_depth'] for lane in self.dispatcher.desc]
+        self.assertEqual(depths, [2, 2, 2, 2])
+
+    def test_worker_stats(self):
+        self.dispatcher.set_worker_stats(1, {'hits': 3, 'misses': 1})
+        self.dispatcher.set_worker_stats(10, {'hits': 3, 'misses': 1})
+        desc = self.dispatcher.desc
+        self.assertEqual(desc[1]['cache']['hit_ratio'], 0.75)
+        self.assertIsNone(desc[0]['cache']['hit_ratio'])
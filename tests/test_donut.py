@@ -6,12 +6,24 @@ from loudml.filestorage import TempStorage
 from loudml.membucket import MemBucket
 from loudml.donut import (
     DonutModel,
+    _TrialHistory,
+    _TrialPruner,
+    _WindowCache,
+    _build_keras_model,
     _format_windows,
+    _mc_chunk_size,
+    generator,
+    mcmc_impute,
+)
+from loudml.npvae import (
+    NumpyDonut,
+    mc_noise,
 )
 from randevents import (
     FlatEventGenerator,
     SinEventGenerator,
 )
+from scipy.stats import norm
 
 import datetime
 import logging
@@ -19,6 +31,7 @@ import math
 import os
 import random
 import unittest
+import unittest.mock
 
 import numpy as np
 
@@ -293,6 +306,413 @@ class TestTimes(unittest.TestCase):
             [10.0, 12.0, 0.0],
         ])
 
+    def test_format_lazy(self):
+        dataset = np.array([0, np.nan, 4, 6, 8, 10, 12, 14])
+        model = DonutModel(dict(
+            name='test_fmt',
+            offset=30,
+            span=3,
+            bucket_interval=20 * 60,
+            interval=60,
+            features=[
+                FEATURE_COUNT_FOO,
+            ],
+            max_evals=1,
+            dtype='float32',
+        ))
+
+        missing, x = model._format_dataset(dataset)
+        lazy_missing, lazy_x = model._format_dataset(dataset, lazy=True)
+        self.assertEqual(x.dtype, np.float32)
+        self.assertEqual(lazy_x.dtype, np.float32)
+        self.assertEqual(lazy_missing.tolist(), missing.tolist())
+        self.assertEqual(lazy_x.tolist(), x.tolist())
+
+        # Windows share the memory of a single series
+        self.assertFalse(lazy_x.flags.writeable)
+        self.assertTrue(np.shares_memory(lazy_x[0], lazy_x[1]))
+
+        missing, x = model._format_dataset(dataset[:2])
+        self.assertEqual(x.shape, (0, 3))
+
+    def test_window_cache(self):
+        model = DonutModel(dict(
+            name='test_cache',
+            offset=30,
+            span=10,
+            bucket_interval=20 * 60,
+            interval=60,
+            features=[
+                FEATURE_COUNT_FOO,
+            ],
+            max_evals=1,
+        ))
+        dataset = np.arange(1000, dtype=float)
+        builds = []
+
+        def split():
+            builds.append(model.span)
+            return model.train_test_split(dataset, train_size=0.5)
+
+        # float64 values + bool mask for 500 + 500 buckets
+        entry_size = 1000 * 9
+        cache = _WindowCache(max_bytes=2 * entry_size)
+
+        first = cache.get((10, None, 0.5), split)
+        second = cache.get((10, None, 0.5), split)
+        self.assertIs(first, second)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(cache.nbytes, entry_size)
+
+        model.span = 20
+        cache.get((20, None, 0.5), split)
+        self.assertEqual(len(cache), 2)
+        cache.get((10, None, 0.5), split)
+
+        # Least recently used entry is evicted
+        model.span = 30
+        cache.get((30, None, 0.5), split)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 1)
+        cache.get((10, None, 0.5), split)
+        self.assertEqual(builds, [10, 20, 30])
+
+        model.span = 20
+        cache.get((20, None, 0.5), split)
+        self.assertEqual(builds, [10, 20, 30, 20])
+        self.assertLessEqual(cache.nbytes, cache.max_bytes)
+
+    def test_mc_chunk_size(self):
+        # 1000 samples of 100 float64 values = 800 KB per window
+        self.assertEqual(_mc_chunk_size(100, 1000, 8 * 1024 * 1024), 10)
+        self.assertEqual(_mc_chunk_size(100, 1000, 1), 1)
+
+    def test_predict_batched_mc(self):
+        self._require_training()
+
+        to_date = self.to_date
+        from_date = to_date - 24 * 3600
+        prediction = self.model.predict(self.source, from_date, to_date)
+
+        self.assertTrue(np.all(prediction.upper > prediction.predicted))
+        self.assertTrue(np.all(prediction.lower < prediction.predicted))
+
+        # Reference: one MC integration per window
+        _, X = self.model._format_dataset(
+            self.model.scale_dataset(prediction.observed))
+        batched = self.model._mc_std(X[:5])
+        for i, x in enumerate(X[:5]):
+            _, _, Z = self.model._encoder_model.predict([
+                np.tile(x, [1000, 1]),
+                np.full((1000, len(x)), False, dtype=bool),
+            ])
+            x_decoded = self.model._decoder_model.predict(Z)
+            self.assertAlmostEqual(
+                batched[i],
+                np.std(x_decoded[:, -1]),
+                delta=0.2 * batched[i],
+            )
+
+    def test_numpy_backend(self):
+        self._require_training()
+
+        to_date = self.to_date
+        from_date = to_date - 24 * 3600
+
+        # Same layers, same outputs
+        self.model.load(backend='keras')
+        missing, X = self.model._format_dataset(
+            self.model.scale_dataset(np.arange(100, dtype=float)))
+        z_mean, z_log_var = self.model._encode(X, missing)
+        x_decoded = self.model._decode(z_mean)
+
+        np_model = NumpyDonut.from_bytes(self.model.weights)
+        np_z_mean, np_z_log_var = np_model.encode(X)
+        np.testing.assert_allclose(np_z_mean, z_mean, rtol=1e-4, atol=1e-5)
+        np.testing.assert_allclose(
+            np_z_log_var, z_log_var, rtol=1e-4, atol=1e-5)
+        np.testing.assert_allclose(
+            np_model.decode(z_mean), x_decoded, rtol=1e-4, atol=1e-5)
+        np.testing.assert_allclose(
+            np_model.decode(z_mean, last_only=True)[:, -1],
+            x_decoded[:, -1],
+            rtol=1e-4,
+            atol=1e-5,
+        )
+
+        keras_prediction = self.model.predict(
+            self.source, from_date, to_date, backend='keras')
+        np_prediction = self.model.predict(
+            self.source, from_date, to_date, backend='numpy')
+
+        np.testing.assert_allclose(
+            np_prediction.predicted,
+            keras_prediction.predicted,
+            rtol=1e-3,
+            atol=1e-3,
+        )
+        np.testing.assert_allclose(
+            np_prediction.upper - np_prediction.predicted,
+            keras_prediction.upper - keras_prediction.predicted,
+            rtol=0.2,
+        )
+
+    def test_mcmc_impute(self):
+        def reconstruct(x, missing):
+            # Converges to 2
+            return 0.5 * x + 1
+
+        missing = np.full((3, 4), False, dtype=bool)
+        missing[0, -1] = True
+        missing[1, 1:] = True
+
+        x = np.zeros((3, 4))
+        iterations = mcmc_impute(x, missing, reconstruct, max_iter=10)
+        self.assertEqual(iterations.tolist(), [10, 10, 10])
+        np.testing.assert_allclose(x[missing], 2, atol=0.01)
+        np.testing.assert_equal(x[~missing], 0)
+
+        x = np.zeros((3, 4))
+        iterations = mcmc_impute(
+            x, missing, reconstruct, tolerance=0.1, max_iter=10)
+        self.assertEqual(iterations.tolist(), [5, 5, 0])
+        np.testing.assert_allclose(x[missing], 2, atol=0.1)
+        np.testing.assert_equal(x[~missing], 0)
+
+        x = np.zeros((3, 4))
+        iterations = mcmc_impute(
+            x, missing, reconstruct, tolerance=0.1, max_iter=3)
+        self.assertEqual(iterations.tolist(), [3, 3, 0])
+
+    def test_generator(self):
+        W = 10
+        keras_model = _build_keras_model(W, 8, 3)
+
+        missing = np.full((100, W), False, dtype=bool)
+        missing[::2, -1] = True
+        x = np.random.normal(size=(100, W))
+        x[missing] = 0
+
+        for in_graph in [True, False]:
+            batches = generator(
+                x, missing, 32, keras_model, in_graph=in_graph)
+            for _ in range(3):
+                (batch_x, batch_missing), _ = next(batches)
+                self.assertEqual(batch_x.shape, (32, W))
+                self.assertEqual(batch_missing.shape, (32, W))
+
+                # Only missing points are imputed
+                is_missing = batch_missing > 0
+                self.assertTrue(np.all(batch_x[is_missing] != 0))
+                for row, row_missing in zip(batch_x, is_missing):
+                    self.assertTrue(np.any(np.all(
+                        x[:, ~row_missing] == row[~row_missing],
+                        axis=1,
+                    )))
+
+    def test_predict_mcmc_tolerance(self):
+        self._require_training()
+
+        to_date = self.to_date
+        from_date = to_date - 24 * 3600
+
+        reference = self.model.predict(self.source, from_date, to_date)
+        self.assertTrue(np.all(reference.mcmc_iterations == 10))
+
+        self.model.mcmc_tolerance = 0.01
+        try:
+            prediction = self.model.predict(self.source, from_date, to_date)
+        finally:
+            self.model.mcmc_tolerance = None
+
+        self.assertTrue(np.all(prediction.mcmc_iterations >= 1))
+        self.assertTrue(np.all(prediction.mcmc_iterations <= 10))
+        np.testing.assert_allclose(
+            prediction.predicted, reference.predicted, rtol=0.05, atol=0.1)
+
+        self.model.detect_anomalies(prediction)
+        self.assertEqual(
+            [stats['mcmc_iterations'] for stats in prediction.stats],
+            prediction.mcmc_iterations.tolist(),
+        )
+
+    def test_predict_incremental(self):
+        self._require_training()
+
+        to_date = self.to_date
+        mid_date = to_date - 6 * 3600
+        from_date = to_date - 24 * 3600
+
+        _state = {}
+        self.model.predict2(self.source, from_date, mid_date, _state=_state)
+        self.assertEqual(_state['eval']['to_ts'], mid_date)
+        self.assertEqual(
+            len(_state['eval']['buffer']), self.model._window - 1)
+
+        inc = self.model.predict2(
+            self.source, mid_date, to_date, _state=_state)
+        full = self.model.predict(self.source, mid_date, to_date)
+
+        self.assertEqual(_state['eval']['to_ts'], to_date)
+        self.assertEqual(inc.timestamps, full.timestamps)
+        np.testing.assert_allclose(inc.observed, full.observed)
+        np.testing.assert_allclose(
+            inc.predicted, full.predicted, rtol=1e-4, atol=1e-4)
+
+        # Nothing new since last evaluation
+        empty = self.model.predict2(
+            self.source, mid_date, to_date, _state=_state)
+        self.assertEqual(len(empty.timestamps), 0)
+        self.assertEqual(len(empty.predicted), 0)
+
+        # Overlapping range, clipped to the buckets not evaluated yet
+        _state = {}
+        self.model.predict2(self.source, from_date, mid_date, _state=_state)
+        inc = self.model.predict2(
+            self.source, mid_date - 3600, to_date, _state=_state)
+        self.assertEqual(inc.timestamps, full.timestamps)
+        self.assertEqual(inc.timestamps[0], mid_date)
+        np.testing.assert_allclose(
+            inc.predicted, full.predicted, rtol=1e-4, atol=1e-4)
+        self.assertEqual(_state['eval']['to_ts'], to_date)
+
+        # Range does not follow the previous one, full prediction
+        prediction = self.model.predict2(
+            self.source, from_date, from_date + 3600, _state=_state)
+        self.assertEqual(len(prediction.predicted), 3)
+        self.assertEqual(_state['eval']['to_ts'], from_date + 3600)
+
+    def test_train_parallel_trials(self):
+        model = DonutModel(dict(
+            name='test_parallel',
+            offset=30,
+            span=20,
+            bucket_interval=20 * 60,
+            interval=60,
+            features=FEATURES,
+            max_evals=3,
+        ))
+
+        progress = []
+
+        def progress_cb(current_eval, max_evals):
+            progress.append((current_eval, max_evals))
+
+        model.train(
+            self.source,
+            self.to_date - 3600 * 24 * 7,
+            self.to_date,
+            batch_size=32,
+            num_epochs=5,
+            progress_cb=progress_cb,
+            parallel_trials=2,
+        )
+        self.assertTrue(model.is_trained)
+        self.assertEqual(model.span, 20)
+        # 3 trials, then the final training with the best parameters
+        self.assertEqual(progress[1:], [(1, 3), (2, 3), (3, 3), (4, 3)])
+
+    def test_train_parallel_trials_daemon(self):
+        model = DonutModel(dict(
+            name='test_parallel_daemon',
+            offset=30,
+            span=20,
+            bucket_interval=20 * 60,
+            interval=60,
+            features=FEATURES,
+            max_evals=2,
+        ))
+
+        # Daemonic processes cannot start trials in child processes
+        process = unittest.mock.Mock(daemon=True)
+        with unittest.mock.patch(
+            'loudml.donut.multiprocessing.current_process',
+            return_value=process,
+        ), unittest.mock.patch.object(
+            DonutModel,
+            '_parallel_search',
+            side_effect=AssertionError("unexpected parallel search"),
+        ):
+            model.train(
+                self.source,
+                self.to_date - 3600 * 24 * 7,
+                self.to_date,
+                batch_size=32,
+                num_epochs=5,
+                parallel_trials=2,
+            )
+        self.assertTrue(model.is_trained)
+
+    def test_trial_pruner(self):
+        class FakeModel:
+            stop_training = False
+
+        history = [
+            [1.0, 0.8, 0.6, 0.5, 0.4, 0.35, 0.3],
+            [1.2, 0.9, 0.7, 0.6, 0.5],
+        ]
+
+        # Never pruned before `min_epochs`
+        pruner = _TrialPruner('median', history, min_epochs=5)
+        pruner.set_model(FakeModel())
+        for epoch, val_loss in enumerate([1.5, 1.4, 1.3, 1.2]):
+            pruner.on_epoch_end(epoch, {'val_loss': val_loss})
+        self.assertFalse(pruner.pruned)
+        pruner.on_epoch_end(4, {'val_loss': 1.1})
+        self.assertTrue(pruner.pruned)
+        self.assertTrue(pruner.model.stop_training)
+
+        # Better than median
+        pruner = _TrialPruner('median', history, min_epochs=5)
+        pruner.set_model(FakeModel())
+        for epoch, val_loss in enumerate([1.0, 0.8, 0.6, 0.5, 0.42]):
+            pruner.on_epoch_end(epoch, {'val_loss': val_loss})
+        self.assertFalse(pruner.pruned)
+
+        # Halving keeps the top third at epochs 5, 15, 45...
+        history += [[2.0, 1.9, 1.8, 1.7, 1.6]] * 2
+        pruner = _TrialPruner('halving', history, min_epochs=5)
+        pruner.set_model(FakeModel())
+        for epoch, val_loss in enumerate([1.0, 0.8, 0.6, 0.5, 0.45]):
+            pruner.on_epoch_end(epoch, {'val_loss': val_loss})
+        self.assertTrue(pruner.pruned)
+
+        trials = _TrialHistory()
+        trials.add([1.0] * 10, False)
+        trials.add([1.0] * 20, False)
+        trials.add([1.0] * 5, True)
+        self.assertEqual(trials.stats(num_epochs=100), {
+            'trials': 3,
+            'pruned': 1,
+            'epochs': 35,
+            'epochs_saved': 10,
+        })
+
+    def test_train_trial_pruning(self):
+        model = DonutModel(dict(
+            name='test_pruning',
+            offset=30,
+            span=20,
+            bucket_interval=20 * 60,
+            interval=60,
+            features=FEATURES,
+            max_evals=4,
+            trial_pruning='median',
+        ))
+
+        res = model.train(
+            self.source,
+            self.to_date - 3600 * 24 * 7,
+            self.to_date,
+            batch_size=32,
+            num_epochs=20,
+        )
+        self.assertTrue(model.is_trained)
+        stats = res['trial_pruning']
+        self.assertEqual(stats['trials'], 4)
+        self.assertGreaterEqual(stats['epochs_saved'], 0)
+        self.assertEqual(model.state['trial_pruning'], stats)
+
     def test_train_abnormal(self):
         source = MemBucket()
         from_date = '1970-01-01T00:00:00.000Z'
@@ -394,6 +814,14 @@ class TestTimes(unittest.TestCase):
         self.assertEqual(len(forecast.timestamps), expected)
         self.assertEqual(forecast.observed.shape, (expected,))
         self.assertEqual(forecast.predicted.shape, (expected,))
+        self.assertEqual(
+            len(forecast.format_series()['step_durations']), expected)
+        self.assertTrue(np.all(forecast.upper >= forecast.predicted))
+        self.assertTrue(np.all(forecast.lower <= forecast.predicted))
+        np.testing.assert_allclose(
+            forecast.upper - forecast.predicted,
+            forecast.predicted - forecast.lower,
+        )
 
         all_default = np.full(
             (expected,),
@@ -423,6 +851,97 @@ class TestTimes(unittest.TestCase):
         # print(forecast_good)
         self.assertEqual(np.all(forecast_good), True)
 
+    def _forecast_ensemble(self, **kwargs):
+        """
+        Forecast with a model whose latent space is the last bucket of the
+        window, so that trajectories are random walks
+        """
+        model = DonutModel(dict(
+            name='test_ensemble',
+            offset=30,
+            span=5,
+            bucket_interval=20 * 60,
+            interval=60,
+            features=FEATURES,
+            **kwargs
+        ))
+        W = model._window
+        rows = []
+        noise = []
+
+        def encode(x, missing):
+            rows.append(len(x))
+            return x[:, -2:-1].copy(), np.zeros((len(x), 1))
+
+        def decode(z, batch_size=None, last_only=False):
+            return np.tile(z[:, :1], (1, W))
+
+        def identity(dataset):
+            return np.array(dataset, dtype=float)
+
+        def fetch_dataset(bucket, from_ts, to_ts):
+            # History is 0, 1, 2... and the forecast range is empty
+            X = np.arange(from_ts, to_ts, model.bucket_interval)
+            dataset = np.arange(len(X), dtype=float)
+            dataset[X >= self.to_date] = np.nan
+            return dataset, X
+
+        def record_noise(*args):
+            epsilon, weights = mc_noise(*args)
+            noise.append(epsilon[0, :, 0])
+            return epsilon, weights
+
+        with unittest.mock.patch.multiple(
+            model,
+            load=unittest.mock.DEFAULT,
+            scale_dataset=identity,
+            unscale_dataset=identity,
+            _encode=encode,
+            _decode=decode,
+            _fetch_dataset=fetch_dataset,
+        ), unittest.mock.patch(
+            'loudml.donut.mc_noise',
+            side_effect=record_noise,
+        ):
+            forecast = model.forecast(
+                self.source,
+                self.to_date,
+                self.to_date + 10 * model.bucket_interval,
+            )
+        # Last value of the history, number of trajectories, and noise of
+        # each step
+        return forecast, W - 2, max(rows), noise[1:]
+
+    def test_forecast_ensemble(self):
+        p = norm().ppf(1 - (1 - 0.68) / 2)
+
+        # Sigma points in one dimension: 3 trajectories whose spread grows
+        # by one at each step, weights are (1/2, 1/4, 1/4)
+        forecast, last, nb_trajectories, _ = self._forecast_ensemble(
+            mc_sampling='sigma_points')
+        self.assertEqual(nb_trajectories, 4)
+        # The first trajectory follows the mean
+        np.testing.assert_allclose(forecast.predicted, np.full(10, last))
+        np.testing.assert_allclose(
+            (forecast.upper - forecast.predicted) / p, np.arange(1, 11))
+        np.testing.assert_allclose(
+            (forecast.predicted - forecast.lower) / p, np.arange(1, 11))
+        self.assertEqual(len(forecast.format_series()['step_durations']), 10)
+
+        # Seeded run, the bands are the spread of the sampled trajectories
+        np.random.seed(0)
+        forecast, last, nb_trajectories, noise = self._forecast_ensemble(
+            mc_sampling='random',
+            forecast_trajectories=5,
+        )
+        self.assertEqual(nb_trajectories, 5)
+        self.assertEqual(len(noise), 10)
+        np.testing.assert_allclose(forecast.predicted, np.full(10, last))
+        np.testing.assert_allclose(
+            (forecast.upper - forecast.predicted) / p,
+            np.std(np.cumsum(noise, axis=0), axis=1),
+        )
+
     def test_predict_aligned(self):
         self._require_training()
 
@@ -3,9 +3,15 @@ from loudml.donut import DonutModel
 from loudml import (
     errors,
 )
+import base64
+import hashlib
+import json
 import logging
+import os
 import tempfile
+import threading
 import unittest
+from unittest import mock
 
 logging.getLogger('tensorflow').disabled = True
 
@@ -69,3 +75,287 @@ class TestFileStorage(unittest.TestCase):
             self.assertEqual(model.type, 'donut')
             self.assertEqual(model.name, 'test-2')
             self.assertEqual(model.offset, 56)
+
+    def _create_model(self, storage, state):
+        model = DonutModel(dict(
+            name='test-1',
+            offset=30,
+            span=5,
+            bucket_interval=60,
+            interval=60,
+            features=FEATURES,
+            max_threshold=70,
+            min_threshold=60,
+        ), state=state)
+        storage.save_model(model)
+        return storage.model_path(model.name)
+
+    def test_weights_file(self):
+        weights = os.urandom(1024)
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = FileStorage(tmp)
+            model_path = self._create_model(storage, {
+                'weights': weights,
+                'means': [0.0],
+            })
+
+            # Weights are not embedded in the JSON state
+            with open(os.path.join(model_path, "00.ckpt")) as fd:
+                state = json.load(fd)
+            self.assertEqual(state['weights'], {
+                'file': '00.weights',
+                'size': 1024,
+                'sha256': hashlib.sha256(weights).hexdigest(),
+            })
+
+            model = storage.load_model('test-1')
+            self.assertTrue(model.is_trained)
+            self.assertEqual(bytes(model.weights), weights)
+
+            # Run state is saved without rewriting weights
+            weights_path = os.path.join(model_path, "00.weights")
+            inode = os.stat(weights_path).st_ino
+            model.set_run_state({'foo': 'bar'})
+            storage.save_state(model)
+            self.assertEqual(os.stat(weights_path).st_ino, inode)
+
+            # New checkpoint
+            storage.save_model(model)
+            self.assertEqual(storage.list_checkpoints('test-1'), ['00', '01'])
+            model = storage.load_model('test-1')
+            self.assertEqual(bytes(model.weights), weights)
+            self.assertEqual(model.get_run_state(), {'foo': 'bar'})
+
+    def test_convert_checkpoint(self):
+        weights = os.urandom(1024)
+        legacy = {
+            'h5py': base64.b64encode(weights).decode('utf-8'),
+            'means': [0.0],
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = FileStorage(tmp)
+            model_path = self._create_model(storage, legacy)
+            state_path = os.path.join(model_path, "00.ckpt")
+            os.utime(state_path, (1000000, 1000000))
+            st = os.stat(state_path)
+
+            # Loading does not convert the checkpoint
+            model = storage.load_model('test-1')
+            self.assertEqual(bytes(model.weights), weights)
+            self.assertNotIn('h5py', model.state)
+            self.assertEqual(os.stat(state_path).st_ino, st.st_ino)
+            self.assertFalse(
+                os.path.exists(os.path.join(model_path, "00.weights")))
+
+            storage.compact()
+            with open(state_path) as fd:
+                state = json.load(fd)
+            self.assertNotIn('h5py', state)
+            self.assertEqual(state['weights']['file'], '00.weights')
+            self.assertEqual(state['means'], [0.0])
+            # The checkpoint keeps its age
+            self.assertEqual(os.stat(state_path).st_mtime, 1000000)
+
+            model = storage.load_model('test-1')
+            self.assertEqual(bytes(model.weights), weights)
+
+            # Saving the state converts the checkpoint too
+            with open(state_path, 'w') as fd:
+                json.dump(legacy, fd)
+            model = storage.load_model('test-1')
+            storage.save_state(model)
+            with open(state_path) as fd:
+                state = json.load(fd)
+            self.assertNotIn('h5py', state)
+            self.assertEqual(state['weights']['file'], '00.weights')
+            model = storage.load_model('test-1')
+            self.assertEqual(bytes(model.weights), weights)
+
+    def test_checkpoint_retention(self):
+        weights = os.urandom(1024)
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = FileStorage(tmp, max_checkpoints=3)
+            for i in range(5):
+                model_path = self._create_model(storage, {
+                    'weights': weights,
+                    'means': [float(i)],
+                })
+            self.assertEqual(
+                storage.list_checkpoints('test-1'), ['02', '03', '04'])
+
+            # Identical weights are stored once
+            blobs = os.listdir(os.path.join(model_path, "blobs"))
+            self.assertEqual(len(blobs), 1)
+            self.assertTrue(os.path.samefile(
+                os.path.join(model_path, "02.weights"),
+                os.path.join(model_path, "blobs", blobs[0]),
+            ))
+
+            # Active checkpoint is kept
+            storage.set_current_ckpt('test-1', '02')
+            storage.max_checkpoints = 1
+            stats = storage.compact()
+            self.assertEqual(stats['checkpoints'], 1)
+            self.assertEqual(storage.list_checkpoints('test-1'), ['02', '04'])
+
+            # Weights are deleted with the last checkpoint using them
+            self._create_model(storage, {
+                'weights': os.urandom(1024),
+                'means': [5.0],
+            })
+            self.assertEqual(storage.list_checkpoints('test-1'), ['05'])
+            self.assertEqual(
+                len(os.listdir(os.path.join(model_path, "blobs"))), 1)
+
+            model = storage.load_model('test-1')
+            self.assertEqual(model.state['means'], [5.0])
+
+    def test_run_state_journal(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = FileStorage(tmp)
+            storage.RUN_JOURNAL_MAX_BYTES = 512
+            model_path = self._create_model(storage, {
+                'weights': os.urandom(1024),
+                'means': [0.0],
+            })
+            ckpt_path = os.path.join(model_path, "00.ckpt")
+            inode = os.stat(ckpt_path).st_ino
+
+            model = storage.load_model('test-1')
+            for i in range(20):
+                model.set_run_state({'to_ts': i})
+                model.state['last_anomaly_ts'] = i
+                storage.save_run_state(model)
+
+            # Checkpoint is untouched, journal has been compacted
+            self.assertEqual(os.stat(ckpt_path).st_ino, inode)
+            self.assertTrue(
+                os.path.exists(os.path.join(model_path, "run.json")))
+            journal_path = os.path.join(model_path, "run.journal")
+            if os.path.exists(journal_path):
+                self.assertLessEqual(
+                    os.path.getsize(journal_path),
+                    storage.RUN_JOURNAL_MAX_BYTES,
+                )
+
+            model = storage.load_model('test-1')
+            self.assertEqual(model.get_run_state(), {'to_ts': 19})
+            self.assertEqual(model.state['last_anomaly_ts'], 19)
+
+            # Same checkpoint: the run state is kept
+            storage.set_current_ckpt('test-1', '00')
+            model = storage.load_model('test-1')
+            self.assertEqual(model.get_run_state(), {'to_ts': 19})
+
+            # Removed keys
+            model.set_run_state(None)
+            storage.save_run_state(model)
+            model = storage.load_model('test-1')
+            self.assertEqual(model.get_run_state(), {})
+            self.assertEqual(model.state['means'], [0.0])
+
+            # Whole state saved: journal is not needed anymore
+            model.set_run_state({'to_ts': 20})
+            storage.save_state(model)
+            self.assertFalse(
+                os.path.exists(os.path.join(model_path, "run.journal")))
+            model = storage.load_model('test-1')
+            self.assertEqual(model.get_run_state(), {'to_ts': 20})
+
+    def test_run_state_concurrent(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = FileStorage(tmp)
+            storage.RUN_JOURNAL_MAX_BYTES = 64
+            self._create_model(storage, {'means': [0.0]})
+            model = storage.load_model('test-1')
+            other = storage.load_model('test-1')
+            read_run_state = storage._read_run_state
+
+            def save_other():
+                other.set_run_state({'to_ts': 2})
+                storage.save_run_state(other)
+
+            thread = threading.Thread(target=save_other)
+
+            # Another worker saves its run state while the journal is
+            # being compacted
+            def read_and_save(model_path):
+                storage._read_run_state = read_run_state
+                entry = read_run_state(model_path)
+                thread.start()
+                thread.join(0.2)
+                return entry
+
+            storage._read_run_state = read_and_save
+            model.set_run_state({'to_ts': 1})
+            storage.save_run_state(model)
+            thread.join()
+
+            model = storage.load_model('test-1')
+            self.assertEqual(model.get_run_state(), {'to_ts': 2})
+
+    def test_model_index(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = FileStorage(tmp)
+            model = DonutModel(dict(
+                name='test-1',
+                offset=30,
+                span=5,
+                bucket_interval=60,
+                interval=60,
+                features=FEATURES,
+                max_threshold=70,
+                min_threshold=60,
+            ))
+            storage.create_model(model)
+
+            with mock.patch.object(storage, 'load_model') as load_model:
+                previews = storage.list_model_previews()
+                load_model.assert_not_called()
+            self.assertEqual(previews, [model.preview])
+            self.assertFalse(previews[0]['state']['trained'])
+
+            # Maintained on save, without rewriting the index
+            index_ino = os.stat(storage.index_path).st_ino
+            self._create_model(storage, {
+                'weights': os.urandom(1024),
+                'loss': 0.5,
+            })
+            self.assertEqual(os.stat(storage.index_path).st_ino, index_ino)
+
+            # No model added or removed, the index is trusted
+            with mock.patch.object(storage, 'load_model') as load_model, \
+                    mock.patch.object(storage, '_index_stamp') as stamp:
+                previews = storage.list_model_previews()
+                load_model.assert_not_called()
+                stamp.assert_not_called()
+            self.assertEqual(previews[0]['state'], {
+                'trained': True,
+                'loss': 0.5,
+            })
+
+            # Models modified by another storage instance are reindexed
+            other = FileStorage(tmp)
+            other._write_model(
+                other.model_path('test-2'),
+                model.settings,
+                save_state=False,
+            )
+            self.assertEqual(
+                [preview['settings']['name']
+                 for preview in storage.list_model_previews()],
+                ['test-1', 'test-2'],
+            )
+
+            # Maintained on delete
+            storage.delete_model('test-1')
+            with mock.patch.object(storage, 'load_model') as load_model:
+                previews = storage.list_model_previews()
+                load_model.assert_not_called()
+            self.assertEqual(len(previews), 1)
+
+            # The journal is compacted
+            storage.INDEX_JOURNAL_MAX_BYTES = 0
+            storage.save_model(storage.load_model('test-2'))
+            self.assertFalse(os.path.exists(storage.index_journal_path))
+            self.assertEqual(len(storage.list_model_previews()), 1)
@@ -0,0 +1,76 @@
+from loudml.inflight import (
+    InFlightEvals,
+    merge_eval_range,
+)
+
+import unittest
+
+
+class FakeJob:
+    def __init__(self, model_name, kwargs):
+        self.model_name = model_name
+        self.kwargs = kwargs
+        self.stopped = False
+
+    def is_stopped(self):
+        return self.stopped
+
+
+class TestInFlightEvals(unittest.TestCase):
+    def setUp(self):
+        self.evals = InFlightEvals(FakeJob)
+        self.running = FakeJob('model-1', {})
+        self.evals.acquire('model-1', self.running)
+
+    def test_merge_eval_range(self):
+        kwargs = {'from_date': 60, 'to_date': 120, 'incremental': False}
+        merge_eval_range(kwargs, {
+            'from_date': 120,
+            'to_date': 180,
+            'incremental': True,
+        })
+        self.assertEqual(kwargs, {
+            'from_date': 60,
+            'to_date': 180,
+            'incremental': True,
+        })
+
+    def test_skip(self):
+        kwargs = {'from_date': 60, 'to_date': 120}
+        self.assertIs(
+            self.evals.get_overlap('model-1', 'skip', kwargs),
+            self.running,
+        )
+        self.assertIsNone(self.evals.get_overlap('model-2', 'skip', kwargs))
+        self.assertEqual(self.evals.desc['skipped'], 1)
+
+        self.running.stopped = True
+        self.assertIsNone(self.evals.get_overlap('model-1', 'skip', kwargs))
+        self.assertIsNone(self.evals.release('model-1', self.running))
+        self.assertEqual(self.evals.desc['running'], 0)
+
+    def test_merge(self):
+        pending = self.evals.get_overlap('model-1', 'merge', {
+            'from_date': 60,
+            'to_date': 120,
+        })
+        self.assertIsNot(pending, self.running)
+        self.assertIs(self.evals.get_overlap('model-1', 'merge', {
+            'from_date': 120,
+            'to_date': 180,
+        }), pending)
+        self.assertEqual(pending.kwargs, {'from_date': 60, 'to_date': 180})
+        self.assertEqual(self.evals.desc['merged'], 2)
+        self.assertEqual(self.evals.desc['pending'], 1)
+
+        # Only the current job releases the model
+        self.assertIsNone(self.evals.release('model-1', FakeJob('x', {})))
+
+        # Pending job runs next
+        self.assertIs(self.evals.release('model-1', self.running), pending)
+        self.assertEqual(self.evals.desc['pending'], 0)
+        self.assertIs(self.evals.get_overlap('model-1', 'skip', {}), pending)
+        self.assertIsNone(self.evals.release('model-1', pending))
+
+    def test_allow(self):
+        self.assertIsNone(self.evals.get_overlap('model-1', 'allow', {}))
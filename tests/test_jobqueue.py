@@ -0,0 +1,95 @@
+from loudml.jobqueue import JobQueue
+from loudml import (
+    errors,
+)
+
+import concurrent.futures
+import unittest
+
+
+class FakePool:
+    def __init__(self):
+        self.jobs = []
+
+    def schedule(self, key, func, args=None, kwargs=None):
+        future = concurrent.futures.Future()
+        self.jobs.append((args[0], future))
+        return future
+
+    def complete(self, index=0):
+        name, future = self.jobs.pop(index)
+        future.set_result(name)
+        return name
+
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        self.pool = FakePool()
+        self.queue = JobQueue(
+            'test',
+            self.pool.schedule,
+            workers=2,
+            max_queue=3,
+            nice=5,
+        )
+
+    def schedule(self, name, priority=0):
+        return self.queue.schedule(None, None, args=[name], priority=priority)
+
+    def test_workers(self):
+        futures = [self.schedule('job-{}'.format(i)) for i in range(4)]
+        self.assertEqual([name for name, _ in self.pool.jobs],
+                         ['job-0', 'job-1'])
+        self.assertEqual(self.queue.desc['running'], 2)
+        self.assertEqual(self.queue.desc['queue_depth'], 2)
+
+        # Next job is submitted when a worker is free
+        self.pool.complete()
+        self.assertEqual(futures[0].result(), 'job-0')
+        self.assertEqual([name for name, _ in self.pool.jobs],
+                         ['job-1', 'job-2'])
+
+        while self.pool.jobs:
+            self.pool.complete()
+        self.assertEqual([future.result() for future in futures],
+                         ['job-0', 'job-1', 'job-2', 'job-3'])
+
+        desc = self.queue.desc
+        self.assertEqual(desc['running'], 0)
+        self.assertEqual(desc['jobs'], 4)
+        self.assertEqual(desc['nice'], 5)
+        self.assertEqual(desc['queue_time']['count'], 4)
+
+    def test_priority(self):
+        for i in range(2):
+            self.schedule('busy-{}'.format(i))
+        self.schedule('low', priority=-1)
+        self.schedule('normal')
+        self.schedule('high', priority=1)
+
+        done = [self.pool.complete() for _ in range(5)]
+        self.assertEqual(done, ['busy-0', 'busy-1', 'high', 'normal', 'low'])
+
+    def test_max_queue(self):
+        for i in range(5):
+            self.schedule('job-{}'.format(i))
+
+        with self.assertRaises(errors.LimitReached):
+            self.schedule('job-5')
+        self.assertEqual(self.queue.desc['rejected'], 1)
+
+        self.pool.complete()
+        self.schedule('job-5')
+
+    def test_cancel(self):
+        running = self.schedule('running')
+        self.schedule('busy')
+        waiting = self.schedule('waiting')
+        self.assertTrue(waiting.cancel())
+        self.assertTrue(waiting.cancelled())
+        self.assertEqual(self.queue.desc['queue_depth'], 0)
+
+        # Running jobs are canceled by the pool
+        self.assertTrue(running.cancel())
+        self.assertTrue(running.cancelled())
+        self.assertEqual(self.queue.desc['running'], 1)
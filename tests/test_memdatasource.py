@@ -2,9 +2,12 @@ from loudml.misc import (
     nan_to_none,
 )
 from loudml.donut import DonutModel
+from loudml.model import Feature
 import logging
 import unittest
+from unittest import mock
 
+from loudml.bucket import PrefetchedBucket
 from loudml.membucket import MemBucket
 
 logging.getLogger('tensorflow').disabled = True
@@ -73,3 +76,54 @@ class TestMemBucket(unittest.TestCase):
             foo_avg.append(nan_to_none(line[1][0]))
 
         self.assertEqual(foo_avg, [2.5, None, 4.0])
+
+    def test_prefetch(self):
+        foo = Feature(name='foo', metric='avg', field='foo')
+        bar = Feature(name='bar', metric='max', field='foo')
+        # Same name as another feature, different aggregation
+        other = Feature(name='foo', metric='count', field='foo')
+
+        bucket = PrefetchedBucket(self.source)
+        with mock.patch.object(
+            self.source,
+            'get_times_data',
+            wraps=self.source.get_times_data,
+        ) as get_times_data:
+            bucket.prefetch(3, [foo, bar, other, foo], 0, 12)
+            self.assertEqual(get_times_data.call_count, 1)
+            self.assertEqual(
+                len(get_times_data.call_args[1]['features']), 3)
+
+            for features, from_date, to_date in [
+                ([foo], 0, 12),
+                ([bar, foo], 3, 9),
+                ([other], 6, 12),
+            ]:
+                res = bucket.get_times_data(
+                    bucket_interval=3,
+                    features=features,
+                    from_date=from_date,
+                    to_date=to_date,
+                )
+                expected = list(self.source.get_times_data(
+                    bucket_interval=3,
+                    features=features,
+                    from_date=from_date,
+                    to_date=to_date,
+                ))
+                self.assertEqual(
+                    [(offset, list(map(nan_to_none, X)), timeval)
+                     for offset, X, timeval in res],
+                    [(offset, list(map(nan_to_none, X)), timeval)
+                     for offset, X, timeval in expected],
+                )
+            self.assertEqual(bucket.queries, 1)
+
+            # Not covered
+            bucket.get_times_data(
+                bucket_interval=3,
+                features=[foo],
+                from_date=0,
+                to_date=15,
+            )
+            self.assertEqual(bucket.queries, 2)
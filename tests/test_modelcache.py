@@ -0,0 +1,116 @@
+from loudml.filestorage import FileStorage
+from loudml.donut import DonutModel
+from loudml.modelcache import ModelCache
+from loudml import (
+    errors,
+)
+import logging
+import tempfile
+import unittest
+
+logging.getLogger('tensorflow').disabled = True
+
+
+FEATURES = [
+    {
+        'name': 'avg_foo',
+        'metric': 'avg',
+        'field': 'foo',
+        'default': 0,
+    },
+]
+
+
+def build_model(name):
+    return DonutModel(dict(
+        name=name,
+        offset=30,
+        span=5,
+        bucket_interval=60,
+        interval=60,
+        features=FEATURES,
+        max_threshold=70,
+        min_threshold=60,
+    ), state={
+        'means': [0.0],
+        'stds': [1.0],
+    })
+
+
+class TestModelCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.storage = FileStorage(self.tmp.name)
+        for name in ['test-1', 'test-2', 'test-3']:
+            self.storage.save_model(build_model(name))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_hit(self):
+        cache = ModelCache()
+        model = cache.get(self.storage, 'test-1')
+        self.assertEqual(model.name, 'test-1')
+        self.assertIs(cache.get(self.storage, 'test-1'), model)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(len(cache), 1)
+        self.assertGreater(cache.nbytes, 0)
+
+    def test_invalidate(self):
+        cache = ModelCache()
+        model = cache.get(self.storage, 'test-1')
+
+        # New checkpoint saved by another process
+        other = FileStorage(self.tmp.name)
+        other.save_model(build_model('test-1'))
+        reloaded = cache.get(self.storage, 'test-1')
+        self.assertIsNot(reloaded, model)
+        self.assertEqual(len(cache), 1)
+
+        # Same checkpoint, state modified by another process
+        updated = other.load_model('test-1')
+        updated.set_run_state({'foo': 'bar'})
+        other.save_state(updated)
+        model = cache.get(self.storage, 'test-1')
+        self.assertIsNot(model, reloaded)
+        self.assertEqual(model.get_run_state(), {'foo': 'bar'})
+        self.assertEqual(cache.misses, 3)
+
+    def test_refresh(self):
+        cache = ModelCache()
+        model = cache.get(self.storage, 'test-1')
+        model.set_run_state({'foo': 'bar'})
+        self.storage.save_state(model)
+        cache.refresh(self.storage, model)
+        self.assertIs(cache.get(self.storage, 'test-1'), model)
+        self.assertEqual(cache.misses, 1)
+
+    def test_evict(self):
+        cache = ModelCache(max_models=2)
+        model_1 = cache.get(self.storage, 'test-1')
+        cache.get(self.storage, 'test-2')
+        cache.get(self.storage, 'test-1')
+        cache.get(self.storage, 'test-3')
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 1)
+        self.assertIs(cache.get(self.storage, 'test-1'), model_1)
+
+        _, _, size = self.storage.get_model_version('test-1')
+        cache = ModelCache(max_bytes=2 * size)
+        for name in ['test-1', 'test-2', 'test-3']:
+            cache.get(self.storage, name)
+        self.assertEqual(len(cache), 2)
+        self.assertLessEqual(cache.nbytes, 2 * size)
+
+        cache = ModelCache(max_models=0)
+        cache.get(self.storage, 'test-1')
+        self.assertEqual(len(cache), 0)
+
+    def test_deleted(self):
+        cache = ModelCache()
+        cache.get(self.storage, 'test-1')
+        self.storage.delete_model('test-1')
+        with self.assertRaises(errors.ModelNotFound):
+            cache.get(self.storage, 'test-1')
+        self.assertEqual(len(cache), 0)
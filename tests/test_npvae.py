@@ -0,0 +1,160 @@
+from loudml import errors
+from loudml.npvae import (
+    MC_SAMPLING,
+    NumpyDonut,
+    mc_noise,
+    weighted_std,
+)
+
+import base64
+import io
+import json
+import math
+import unittest
+
+import h5py
+import numpy as np
+
+
+def build_h5(layers):
+    """
+    Build a Keras-like HDF5 file with the given Dense layers
+
+    layers: list of (name, inbound, activation, kernel, bias)
+    """
+    config = [{
+        'class_name': 'InputLayer',
+        'config': {'name': 'input_1'},
+        'inbound_nodes': [],
+    }]
+    for name, inbound, activation, _, _ in layers:
+        config.append({
+            'class_name': 'Dense',
+            'config': {'name': name, 'activation': activation},
+            'inbound_nodes': [[[inbound, 0, 0, {}]]],
+        })
+
+    fd = io.BytesIO()
+    with h5py.File(fd, mode='w') as h5file:
+        h5file.attrs['model_config'] = json.dumps({
+            'class_name': 'Model',
+            'config': {'layers': config},
+        }).encode('utf-8')
+        weights = h5file.create_group('model_weights')
+        for name, _, _, kernel, bias in layers:
+            group = weights.create_group(name)
+            group.attrs['weight_names'] = [
+                '{}/kernel:0'.format(name).encode('utf-8'),
+                '{}/bias:0'.format(name).encode('utf-8'),
+            ]
+            group['{}/kernel:0'.format(name)] = kernel
+            group['{}/bias:0'.format(name)] = bias
+
+    return fd.getvalue()
+
+
+class TestNumpyDonut(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        W, hidden, latent = 6, 4, 2
+
+        def dense(n_in, n_out):
+            return rng.normal(size=(n_in, n_out)), rng.normal(size=(n_out,))
+
+        self.w = {
+            'dense': dense(W, hidden),
+            'dense_1': dense(hidden, hidden),
+            'z_mean': dense(hidden, latent),
+            'z_log_var': dense(hidden, latent),
+            'decoder_dense_0': dense(latent, hidden),
+            'decoder_dense_1': dense(hidden, hidden),
+            'decoder_dense_2': dense(hidden, W),
+        }
+        layers = [
+            ('dense', 'input_1', 'relu'),
+            ('dense_1', 'dense', 'relu'),
+            ('z_mean', 'dense_1', 'linear'),
+            ('z_log_var', 'dense_1', 'linear'),
+            ('decoder_dense_0', 'z', 'relu'),
+            ('decoder_dense_1', 'decoder_dense_0', 'relu'),
+            ('decoder_dense_2', 'decoder_dense_1', 'linear'),
+        ]
+        data = build_h5([
+            (name, inbound, activation) + self.w[name]
+            for name, inbound, activation in layers
+        ])
+        self.model_b64 = base64.b64encode(data).decode('utf-8')
+        self.x = rng.normal(size=(5, W))
+
+    def _dense(self, name, x, relu=True):
+        kernel, bias = self.w[name]
+        y = np.dot(x, kernel) + bias
+        return np.maximum(y, 0) if relu else y
+
+    def test_encode_decode(self):
+        model = NumpyDonut.from_b64(self.model_b64, dtype=np.float64)
+        self.assertEqual(model.W, 6)
+        self.assertEqual(model.latent_dim, 2)
+        self.assertEqual(len(model.encoder), 2)
+
+        h = self._dense('dense_1', self._dense('dense', self.x))
+        z_mean, z_log_var = model.encode(self.x)
+        np.testing.assert_allclose(
+            z_mean, self._dense('z_mean', h, relu=False))
+        np.testing.assert_allclose(
+            z_log_var, self._dense('z_log_var', h, relu=False))
+
+        h = self._dense('decoder_dense_1', self._dense('decoder_dense_0', z_mean))
+        expected = self._dense('decoder_dense_2', h, relu=False)
+        np.testing.assert_allclose(model.decode(z_mean), expected)
+        np.testing.assert_allclose(
+            model.decode(z_mean, last_only=True)[:, -1],
+            expected[:, -1],
+        )
+
+
+class TestMCSampling(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+
+    def test_shapes(self):
+        for sampling in MC_SAMPLING:
+            noise, weights = mc_noise(4, 64, 3, sampling)
+            if sampling == 'sigma_points':
+                self.assertEqual(noise.shape, (4, 7, 3))
+                self.assertAlmostEqual(np.sum(weights), 1.0)
+            else:
+                self.assertEqual(noise.shape, (4, 64, 3))
+                self.assertIsNone(weights)
+            self.assertTrue(np.all(np.isfinite(noise)))
+
+    def test_antithetic(self):
+        noise, _ = mc_noise(2, 8, 3, 'antithetic')
+        np.testing.assert_allclose(noise[:, :4], -noise[:, 4:])
+        np.testing.assert_allclose(np.mean(noise, axis=1), 0, atol=1e-12)
+
+    def test_stratified(self):
+        count = 16
+        noise, _ = mc_noise(2, count, 3, 'stratified')
+        # One sample in each of the `count` equiprobable strata
+        u = 0.5 * (1 + np.vectorize(math.erf)(noise / math.sqrt(2)))
+        strata = np.sort(np.floor(u * count), axis=1)
+        for row in strata:
+            for d in range(3):
+                self.assertEqual(row[:, d].tolist(), list(range(count)))
+
+    def test_std(self):
+        # Linear function of z: std is exact with sigma points
+        a = np.array([0.5, -2.0, 1.0])
+        expected = np.linalg.norm(a)
+
+        for sampling in MC_SAMPLING:
+            noise, weights = mc_noise(1, 256, 3, sampling)
+            std = weighted_std(np.dot(noise, a), weights)
+            self.assertEqual(std.shape, (1,))
+            delta = 1e-9 if sampling == 'sigma_points' else 0.15 * expected
+            self.assertAlmostEqual(std[0], expected, delta=delta)
+
+    def test_unknown(self):
+        with self.assertRaises(errors.Invalid):
+            mc_noise(1, 8, 3, 'foo')
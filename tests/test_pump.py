@@ -0,0 +1,121 @@
+from loudml.pump import (
+    MessagePump,
+    PhasedJob,
+    Scheduler,
+    get_phase,
+    make_message,
+)
+
+import queue
+import threading
+import time
+import unittest
+
+import schedule
+
+
+class TestMessagePump(unittest.TestCase):
+    def setUp(self):
+        self.queue = queue.Queue()
+        self.states = []
+        self.stats = {}
+        self.pump = MessagePump(self.queue, {
+            'job_state': lambda msg: self.states.append(
+                (msg['job_id'], msg['state'])),
+            'worker_stats': lambda msg: self.stats.update(
+                {msg['worker_id']: msg['cache']}),
+        })
+
+    def test_coalesce(self):
+        self.pump.apply([
+            make_message('job_state', job_id='a', state='waiting'),
+            make_message('job_state', job_id='b', state='running'),
+            make_message('job_state', job_id='a', state='running'),
+            make_message('worker_stats', worker_id=0, cache={'hits': 1}),
+            make_message('worker_stats', worker_id=0, cache={'hits': 2}),
+        ])
+        self.assertEqual(self.states, [('b', 'running'), ('a', 'running')])
+        self.assertEqual(self.stats, {0: {'hits': 2}})
+
+        desc = self.pump.desc
+        self.assertEqual(desc['messages'], 5)
+        self.assertEqual(desc['batches'], 1)
+        self.assertEqual(desc['queue_lag']['count'], 5)
+        self.assertEqual(desc['job_state_latency']['count'], 3)
+
+    def test_wake_on_message(self):
+        applied = threading.Event()
+        self.pump.handlers['job_state'] = lambda msg: applied.set()
+        self.pump.start()
+        try:
+            start = time.monotonic()
+            self.queue.put(make_message('job_state', job_id='a', state='done'))
+            self.assertTrue(applied.wait(1))
+            self.assertLess(time.monotonic() - start, 0.5)
+        finally:
+            self.pump.stop()
+
+    def test_stop(self):
+        self.pump.start()
+        self.queue.put(make_message('job_state', job_id='a', state='done'))
+        self.pump.stop()
+        self.assertEqual(self.states, [('a', 'done')])
+
+
+class TestScheduler(unittest.TestCase):
+    def test_run_pending(self):
+        runs = []
+        scheduler = Scheduler(schedule.Scheduler(), max_sleep=60)
+        self.assertEqual(scheduler.run_pending(), 60)
+
+        scheduler.scheduler.every(10).seconds.do(lambda: runs.append(1))
+        delay = scheduler.run_pending()
+        self.assertEqual(runs, [])
+        self.assertGreater(delay, 9)
+        self.assertLessEqual(delay, 10)
+
+        # Due
+        scheduler.scheduler.jobs[0].next_run -= \
+            scheduler.scheduler.jobs[0].period
+        scheduler.run_pending()
+        self.assertEqual(runs, [1])
+        self.assertEqual(scheduler.desc['runs'], 1)
+        self.assertEqual(scheduler.desc['lateness']['count'], 1)
+
+    def test_wake(self):
+        runs = threading.Event()
+        scheduler = Scheduler(schedule.Scheduler(), max_sleep=60)
+        scheduler.start()
+        try:
+            # Sleeping until woken up
+            time.sleep(0.1)
+            scheduler.scheduler.every(10).seconds.do(runs.set)
+            scheduler.scheduler.jobs[0].next_run -= \
+                scheduler.scheduler.jobs[0].period
+            scheduler.wake()
+            self.assertTrue(runs.wait(1))
+        finally:
+            scheduler.stop()
+
+    def test_phase(self):
+        scheduler = Scheduler(schedule.Scheduler())
+        for i in range(100):
+            name = 'model-{}'.format(i)
+            phase = get_phase(name, 60)
+            self.assertGreaterEqual(phase, 0)
+            self.assertLess(phase, 60)
+            self.assertEqual(phase, get_phase(name, 60))
+            job = PhasedJob(60, scheduler.scheduler, phase=phase)
+            job.seconds.do(lambda: None)
+            self.assertAlmostEqual(
+                job.next_run.timestamp() % 60, phase, places=3)
+
+        # Spread over the interval
+        load = scheduler.get_load(60)
+        self.assertEqual(sum(load), 100)
+        self.assertLess(max(load), 10)
+
+        # Not phased
+        for _ in range(100):
+            scheduler.scheduler.every(60).seconds.do(lambda: None)
+        self.assertGreaterEqual(max(scheduler.get_load(60)), 100)
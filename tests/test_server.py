@@ -1,9 +1,15 @@
+import concurrent.futures
+import gevent
 import os
+import threading
+import timeit
 import unittest
 from unittest import mock
 
 from loudml import server
 from loudml import config
+from loudml import errors
+from loudml.jobqueue import JobQueue
 
 
 def mocked_get_distribution(*args, **kwargs):
@@ -31,3 +37,195 @@ class TestServer(unittest.TestCase):
         self.assertTrue(rv.is_json)
         data = rv.get_json()
         self.assertIn('tagline', data)
+
+    def test_job_wait(self):
+        job = server.Job()
+        job._future = concurrent.futures.Future()
+        job._future.add_done_callback(job._done_cb)
+        self.assertFalse(job.wait(timeout=0.01))
+
+        # Completed by another thread while waiting
+        threading.Timer(0.05, job._future.set_result, [42]).start()
+        start = timeit.default_timer()
+        self.assertTrue(job.wait(timeout=5))
+        # Woken up on completion, not by polling
+        self.assertLess(timeit.default_timer() - start, 0.09)
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(job.result(), 42)
+
+        # Job canceled before being submitted
+        job = server.Job()
+        job.cancel()
+        self.assertTrue(job.wait(timeout=0))
+
+    def test_job_wait_hub(self):
+        server.g_hub_calls = server._HubCalls()
+        try:
+            job = server.Job()
+            job._future = concurrent.futures.Future()
+            job._future.add_done_callback(job._done_cb)
+            threading.Timer(0.05, job._future.set_result, [42]).start()
+            self.assertTrue(job.wait(timeout=5))
+            self.assertEqual(job.state, 'done')
+        finally:
+            server.g_hub_calls.close()
+            server.g_hub_calls = None
+
+    def test_timeout_arg(self):
+        with server.app.test_request_context('/?timeout=30s'):
+            self.assertEqual(server.get_timeout_arg(), 30)
+
+        # 0 waits until the job is done
+        with server.app.test_request_context('/?timeout=0'):
+            self.assertIsNone(server.get_timeout_arg())
+
+        with server.app.test_request_context('/'):
+            self.assertEqual(server.get_timeout_arg(), 60)
+            for value in [0, '0s', None]:
+                server.g_config._server['request_timeout'] = value
+                self.assertIsNone(server.get_timeout_arg())
+
+        # The job is completed from another thread, like in the server
+        server.g_hub_calls = server._HubCalls()
+        try:
+            job = server.Job()
+            job._future = concurrent.futures.Future()
+            job._future.add_done_callback(job._done_cb)
+            threading.Timer(0.05, job._future.set_result, [42]).start()
+            with server.app.test_request_context('/?timeout=0'):
+                rv = server.job_response(job)
+                self.assertEqual(rv.get_json(), 42)
+        finally:
+            server.g_hub_calls.close()
+            server.g_hub_calls = None
+
+    def test_job_start(self):
+        states = []
+
+        def submit(key, func, args, kwargs):
+            # The worker reports its state right away
+            server.set_job_state(args[0], 'running')
+            states.append(server.g_jobs[args[0]].state)
+            return concurrent.futures.Future()
+
+        queues = {
+            'inference': JobQueue('inference', submit, 1, max_queue=0),
+        }
+        with mock.patch.object(server, 'g_job_queues', queues):
+            job = server.PredictionJob('test-1')
+            job.start(server.g_config)
+            self.assertEqual(states, ['running'])
+            self.assertEqual(job.state, 'running')
+
+            # Rejected jobs are not registered
+            other = server.PredictionJob('test-2')
+            with self.assertRaises(errors.LimitReached):
+                other.start(server.g_config)
+            self.assertEqual(other.state, 'idle')
+            self.assertNotIn(other.id, server.g_jobs)
+        server.g_jobs.pop(job.id)
+
+    def test_call_in_hub(self):
+        calls = server._HubCalls()
+        try:
+            self.assertEqual(calls.call(threading.get_ident),
+                             threading.get_ident())
+
+            # Calls from other threads run in the loop
+            results = []
+            thread = threading.Thread(
+                target=lambda: results.append(
+                    calls.call(threading.get_ident)),
+            )
+            thread.start()
+            while thread.is_alive():
+                gevent.sleep(0.01)
+            self.assertEqual(results, [threading.get_ident()])
+        finally:
+            calls.close()
+
+        with self.assertRaises(concurrent.futures.CancelledError):
+            with concurrent.futures.ThreadPoolExecutor(1) as pool:
+                pool.submit(calls.call, threading.get_ident).result()
+
+    def test_scheduled_job_in_process(self):
+        self.assertEqual(
+            server.dispatch_local_request('get', '/scheduled_jobs'),
+            (200, 'OK'),
+        )
+        self.assertIsNone(
+            server.dispatch_local_request('get', '/not-found'))
+        self.assertIsNone(
+            server.dispatch_local_request('put', '/scheduled_jobs'))
+
+        server.g_scheduled_jobs['test'] = {
+            'name': 'test',
+            'method': 'get',
+            'relative_url': '/scheduled_jobs',
+        }
+        try:
+            with mock.patch.object(server, 'dispatch_http_request') as http:
+                server.daemon_exec_scheduled_job('test')
+                http.assert_not_called()
+            desc = server.g_scheduled_jobs['test']
+            self.assertTrue(desc['ok'])
+            self.assertEqual(desc['status_code'], 200)
+        finally:
+            server.g_scheduled_jobs.pop('test')
+
+    def test_batch_prediction(self):
+        job_ids = set()
+        for model_name in ['test-1', 'test-2']:
+            rv = self.client.post(
+                '/models/{}/_eval'.format(model_name),
+                query_string={
+                    'from': 0,
+                    'to': 60,
+                    'bg': 'true',
+                    'batch': 'test-bucket:60',
+                },
+            )
+            self.assertEqual(rv.status_code, 202)
+            job_ids.add(rv.get_json())
+
+        self.assertEqual(len(job_ids), 1)
+        job = server.g_jobs[job_ids.pop()]
+        self.assertEqual(job.state, 'idle')
+        self.assertEqual(job.desc['models'], ['test-1', 'test-2'])
+
+        with mock.patch.object(server.BatchPredictionJob, 'start') as start:
+            server.start_batch_predictions()
+            start.assert_called_once_with(server.g_config)
+        self.assertEqual(server.g_batches, {})
+        server.g_jobs.pop(job.id)
+
+    def test_eval_overlap(self):
+        running = server.PredictionJob('test-1')
+        server.g_evals = server.InFlightEvals(server._create_pending_eval)
+        server.g_evals.acquire('test-1', running)
+        try:
+            def post(overlap):
+                rv = self.client.post('/models/test-1/_eval', query_string={
+                    'from': 0,
+                    'to': 60,
+                    'bg': 'true',
+                    'overlap': overlap,
+                })
+                self.assertEqual(rv.status_code, 202)
+                return rv.get_json()
+
+            self.assertEqual(post('skip'), running.id)
+            pending_id = post('merge')
+            self.assertNotEqual(pending_id, running.id)
+            self.assertEqual(post('merge'), pending_id)
+            self.assertEqual(server.g_evals.desc['skipped'], 1)
+            self.assertEqual(server.g_evals.desc['merged'], 2)
+
+            # Pending evaluation starts when the running one is done
+            pending = server.g_jobs[pending_id]
+            with mock.patch.object(pending, 'start') as start:
+                running.set_final_state('done')
+                start.assert_called_once_with(server.g_config)
+        finally:
+            server.g_evals = None
+            server.g_jobs.pop(pending_id, None)
@@ -0,0 +1,270 @@
+from loudml.filestorage import FileStorage
+from loudml.sqlitestorage import (
+    SQLiteStorage,
+    migrate_storage,
+)
+from loudml.donut import DonutModel
+from loudml import (
+    errors,
+)
+import base64
+import logging
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+logging.getLogger('tensorflow').disabled = True
+
+
+FEATURES = [
+    {
+        'name': 'avg_foo',
+        'metric': 'avg',
+        'field': 'foo',
+        'default': 0,
+    },
+]
+
+
+def _build_model(name='test-1', state=None):
+    return DonutModel(dict(
+        name=name,
+        offset=30,
+        span=5,
+        bucket_interval=60,
+        interval=60,
+        features=FEATURES,
+        max_threshold=70,
+        min_threshold=60,
+    ), state=state)
+
+
+class TestSQLiteStorage(unittest.TestCase):
+    def test_create_and_list(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = SQLiteStorage(tmp)
+
+            storage.create_model(_build_model('test-1'))
+            storage.create_model(_build_model('test-2'))
+            self.assertTrue(storage.model_exists('test-1'))
+            self.assertEqual(storage.list_models(), ["test-1", "test-2"])
+
+            with self.assertRaises(errors.ModelExists):
+                storage.create_model(_build_model('test-1'))
+
+            # WAL mode is persistent
+            conn = sqlite3.connect(storage.db_path)
+            self.assertEqual(
+                conn.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+            conn.close()
+
+            # Delete
+            storage.delete_model("test-1")
+            self.assertFalse(storage.model_exists("test-1"))
+            self.assertEqual(storage.list_models(), ["test-2"])
+
+            with self.assertRaises(errors.ModelNotFound):
+                storage.get_model_data("test-1")
+            with self.assertRaises(errors.ModelNotFound):
+                storage.delete_model("test-1")
+
+            # Rebuild
+            model = storage.load_model("test-2")
+            self.assertEqual(model.type, 'donut')
+            self.assertEqual(model.name, 'test-2')
+            self.assertEqual(model.offset, 30)
+
+    def test_checkpoints(self):
+        weights = os.urandom(1024)
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = SQLiteStorage(tmp)
+            model = _build_model(state={
+                'weights': weights,
+                'means': [0.0],
+            })
+            storage.save_model(model)
+            version = storage.get_model_version('test-1')
+
+            model = storage.load_model('test-1')
+            self.assertTrue(model.is_trained)
+            self.assertEqual(bytes(model.weights), weights)
+
+            storage.save_model(model)
+            self.assertEqual(storage.list_checkpoints('test-1'), ['00', '01'])
+            self.assertEqual(storage.get_current_ckpt('test-1'), '01')
+            self.assertNotEqual(storage.get_model_version('test-1'), version)
+
+            storage.set_current_ckpt('test-1', '00')
+            self.assertEqual(storage.get_current_ckpt('test-1'), '00')
+
+            # Checkpoints are deleted with the model
+            storage.delete_model('test-1')
+            self.assertEqual(storage.list_checkpoints('test-1'), [])
+
+    def test_checkpoint_order(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = SQLiteStorage(tmp)
+            for i in range(101):
+                storage.save_model(_build_model(state={'means': [float(i)]}))
+
+            ckpts = storage.list_checkpoints('test-1')
+            self.assertEqual(len(ckpts), 101)
+            self.assertEqual(ckpts[:2], ['00', '01'])
+            self.assertEqual(ckpts[-2:], ['99', '100'])
+            self.assertEqual(storage.get_current_ckpt('test-1'), '100')
+
+            # Retention keeps the most recent checkpoints
+            storage.max_checkpoints = 2
+            storage.save_model(storage.load_model('test-1'))
+            self.assertEqual(storage.list_checkpoints('test-1'),
+                             ['100', '101'])
+
+    def test_checkpoint_retention(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = SQLiteStorage(tmp, max_checkpoints=2)
+            for i in range(4):
+                storage.save_model(_build_model(state={
+                    'weights': os.urandom(1024),
+                    'means': [float(i)],
+                }))
+            self.assertEqual(storage.list_checkpoints('test-1'), ['02', '03'])
+
+            # Active checkpoint is kept
+            storage.set_current_ckpt('test-1', '02')
+            storage.max_checkpoints = 1
+            storage.save_model(storage.load_model('test-1'))
+            self.assertEqual(storage.list_checkpoints('test-1'), ['04'])
+
+            storage.set_current_ckpt('test-1', '04')
+            storage.max_checkpoints = None
+            storage.max_checkpoint_age = 3600
+            self.assertEqual(storage.compact()['checkpoints'], 0)
+
+    def test_run_state(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = SQLiteStorage(tmp)
+            storage.save_model(_build_model(state={
+                'weights': os.urandom(1024),
+                'means': [0.0],
+            }))
+
+            model = storage.load_model('test-1')
+            for i in range(5):
+                version = storage.get_model_version('test-1')
+                model.set_run_state({'to_ts': i})
+                storage.save_run_state(model)
+                self.assertNotEqual(
+                    storage.get_model_version('test-1'), version)
+
+            model = storage.load_model('test-1')
+            self.assertEqual(model.get_run_state(), {'to_ts': 4})
+
+            # Same checkpoint: the run state is kept
+            storage.set_current_ckpt('test-1', '00')
+            model = storage.load_model('test-1')
+            self.assertEqual(model.get_run_state(), {'to_ts': 4})
+
+            # Older checkpoints are not affected
+            storage.save_model(model)
+            storage.set_current_ckpt('test-1', '00')
+            model = storage.load_model('test-1')
+            self.assertEqual(model.get_run_state(), {})
+            self.assertEqual(model.state['means'], [0.0])
+
+    def test_hooks_and_objects(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = SQLiteStorage(tmp)
+
+            with self.assertRaises(errors.ModelNotFound):
+                storage.set_model_hook('test-1', 'hook-1', 'annotations', {})
+
+            storage.create_model(_build_model())
+            storage.set_model_hook('test-1', 'hook-1', 'annotations', {
+                'id': 'foo',
+            })
+            self.assertEqual(storage.list_model_hooks('test-1'), ['hook-1'])
+            self.assertEqual(storage.get_model_hook('test-1', 'hook-1'), {
+                'type': 'annotations',
+                'config': {'id': 'foo'},
+            })
+            storage.delete_model_hook('test-1', 'hook-1')
+            with self.assertRaises(errors.NotFound):
+                storage.get_model_hook('test-1', 'hook-1')
+
+            storage.set_model_object('test-1', 'obj-1', {'foo': 'bar'})
+            self.assertEqual(storage.list_model_objects('test-1'), ['obj-1'])
+            self.assertEqual(
+                storage.get_model_object('test-1', 'obj-1'),
+                {'foo': 'bar'},
+            )
+            storage.delete_model_object('test-1', 'obj-1')
+            with self.assertRaises(KeyError):
+                storage.get_model_object('test-1', 'obj-1')
+
+    def test_batch(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = SQLiteStorage(tmp)
+
+            with self.assertRaises(ValueError):
+                with storage.batch():
+                    storage.create_model(_build_model('test-1'))
+                    storage.create_model(_build_model('test-2'))
+                    raise ValueError()
+            self.assertEqual(storage.list_models(), [])
+
+            with storage.batch():
+                storage.create_model(_build_model('test-1'))
+                storage.create_model(_build_model('test-2'))
+            self.assertEqual(storage.list_models(), ["test-1", "test-2"])
+
+    def test_model_previews(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = SQLiteStorage(tmp)
+            model = _build_model(state={
+                'weights': os.urandom(1024),
+                'loss': 0.5,
+            })
+            storage.save_model(model)
+
+            with mock.patch.object(storage, 'load_model') as load_model:
+                previews = storage.list_model_previews()
+                load_model.assert_not_called()
+            self.assertEqual(previews[0]['state'], {
+                'trained': True,
+                'loss': 0.5,
+            })
+
+    def test_migrate(self):
+        weights = os.urandom(1024)
+        with tempfile.TemporaryDirectory() as tmp:
+            src = FileStorage(os.path.join(tmp, 'file'))
+            src.save_model(_build_model(state={
+                'h5py': base64.b64encode(weights).decode('utf-8'),
+                'means': [0.0],
+            }))
+            model = src.load_model('test-1')
+            src.save_model(model)
+            model.set_run_state({'to_ts': 42})
+            src.save_run_state(model)
+            src.set_model_hook('test-1', 'hook-1', 'annotations', {})
+            src.set_model_object('test-1', 'obj-1', {'foo': 'bar'})
+
+            dst = SQLiteStorage(os.path.join(tmp, 'sqlite'))
+            self.assertEqual(migrate_storage(src, dst), 1)
+
+            self.assertEqual(dst.list_checkpoints('test-1'), ['00', '01'])
+            self.assertEqual(dst.get_current_ckpt('test-1'), '01')
+            model = dst.load_model('test-1')
+            self.assertEqual(bytes(model.weights), weights)
+            self.assertEqual(model.get_run_state(), {'to_ts': 42})
+            self.assertEqual(dst.list_model_hooks('test-1'), ['hook-1'])
+            self.assertEqual(
+                dst.get_model_object('test-1', 'obj-1'),
+                {'foo': 'bar'},
+            )
+
+            # Idempotent
+            self.assertEqual(migrate_storage(src, dst), 1)
+            self.assertEqual(dst.list_models(), ['test-1'])